@@ -20,6 +20,9 @@ class Run_conf(object):
         self.sample_conf_file = sample_conf_file
         self.project_root = project_root
         self.genomon_conf_file = genomon_conf_file 
+        self.drmaa_test_mode = None
+        self.job_monitor = False
+        self.local_exec = False
         
         now = datetime.datetime.now()
         self.analysis_date = date_format.format(
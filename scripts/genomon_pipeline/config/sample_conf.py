@@ -242,7 +242,9 @@ class Sample_conf(object):
                     raise ValueError(err_msg)
                 
                 sequence_prefix, ext = os.path.splitext(sequence)
-                if (not os.path.exists(sequence + '.bai')) and (not os.path.exists(sequence_prefix + '.bai')):
+                # .bai for bam, .crai for cram
+                index_ext = '.crai' if ext == '.cram' else '.bai'
+                if (not os.path.exists(sequence + index_ext)) and (not os.path.exists(sequence_prefix + index_ext)):
                     err_msg = sampleID + ": " + sequence +  " index does not exists"
                     raise ValueError(err_msg)
 
@@ -0,0 +1,100 @@
+#! /usr/bin/env python
+
+from genomon_pipeline.job_stats import *
+
+global critical_path
+
+# runtime [sec] of the stages without any history in the job statistics
+default_runtimes = {"bam2fastq": 7200,
+                    "fastq_splitter": 3600,
+                    "fastq_chunk_index": 1800,
+                    "fastq_pair_splitter": 3600,
+                    "bwa_align": 3600,
+                    "markduplicates": 7200,
+                    "mutation_call": 3600,
+                    "mutation_merge": 600,
+                    "sv_parse": 7200,
+                    "sv_merge": 1800,
+                    "sv_filt": 3600,
+                    "qc_bamstats": 1800,
+                    "qc_coverage": 1800,
+                    "qc_merge": 60,
+                    "post_analysis": 300,
+                    "pre_pmsignature": 300,
+                    "pmsignature": 3600,
+                    "paplot": 300,
+                    "star_align": 7200,
+                    "fusion_count": 1800,
+                    "fusion_merge": 600,
+                    "fusionfusion": 3600,
+                    "genomon_expression": 1800,
+                    "intron_retention": 1800}
+
+# user priority of SGE (qsub -p)
+min_priority = -1023
+
+class Critical_path(object):
+    """
+    class for giving the higher scheduler priority to the jobs on the longer chain of stages
+
+    The runtime of a stage is the median of its past jobs in the job statistics
+    (scaled by the input size when the job knows it), or the default runtime.
+    The remaining path of a stage is its runtime plus the longest remaining path
+    of the downstream stages declared by the pipeline.
+    """
+
+    def __init__(self):
+        self.enable = False
+        self.stage_graph = {}
+        self.history = None
+        self.remaining_paths = {}
+
+
+    def set_graph(self, stage_graph):
+        """
+        stage_graph: {task_name: [task_names of the downstream stages]}
+        """
+        self.stage_graph = stage_graph
+        self.remaining_paths = {}
+
+
+    def load_history(self):
+        if self.history is None:
+            self.history = job_stats.stage_history()
+        return self.history
+
+
+    def estimate(self, task_name, input_size = None):
+        history = self.load_history().get(task_name, [])
+        if len(history) == 0:
+            return default_runtimes.get(task_name, 600)
+
+        if input_size:
+            rates = [wallclock / size for (wallclock, size) in history if size]
+            if len(rates) > 0:
+                return percentile(rates, 50) * input_size
+        return percentile([wallclock for (wallclock, size) in history], 50)
+
+
+    def remaining_path(self, task_name, input_size = None):
+        if input_size:
+            return self.estimate(task_name, input_size) + self.downstream_path(task_name)
+        if task_name not in self.remaining_paths:
+            self.remaining_paths[task_name] = self.estimate(task_name) + self.downstream_path(task_name)
+        return self.remaining_paths[task_name]
+
+
+    def downstream_path(self, task_name):
+        return max([self.remaining_path(child) for child in self.stage_graph.get(task_name, [])] + [0])
+
+
+    def get_priority(self, task_name, input_size = None):
+        if not self.enable or task_name not in self.stage_graph:
+            return None
+        longest = max(self.remaining_path(stage) for stage in self.stage_graph)
+        if longest <= 0:
+            return 0
+        ratio = min(1.0, self.remaining_path(task_name, input_size) / float(longest))
+        return int(round(min_priority * (1.0 - ratio)))
+
+critical_path = Critical_path()
@@ -1,4 +1,5 @@
 import os
+import sys
 import shutil
 import glob
 from ruffus import *
@@ -7,6 +8,8 @@ from genomon_pipeline.config.genomon_conf import *
 from genomon_pipeline.config.sample_conf import *
 from genomon_pipeline.dna_resource.bamtofastq import *
 from genomon_pipeline.dna_resource.fastq_splitter import *
+from genomon_pipeline.dna_resource.fastq_chunk_index import *
+from genomon_pipeline.dna_resource.fastq_pair_splitter import *
 from genomon_pipeline.dna_resource.bwa_align import *
 from genomon_pipeline.dna_resource.markduplicates import *
 from genomon_pipeline.dna_resource.mutation_call import *
@@ -21,36 +24,275 @@ from genomon_pipeline.dna_resource.post_analysis import *
 from genomon_pipeline.dna_resource.pre_pmsignature import *
 from genomon_pipeline.dna_resource.pmsignature import *
 from genomon_pipeline.dna_resource.paplot import *
+from genomon_pipeline.stage_group import *
+from genomon_pipeline.result_cache import *
+from genomon_pipeline.qsub_option import *
+from genomon_pipeline.critical_path import *
+from genomon_pipeline import fastq_chunk
+from genomon_pipeline import fastq_pair_split
+from genomon_pipeline import shard_planner
+from genomon_pipeline import ref_cache
 
 # set task classes
-bamtofastq = Bam2Fastq(genomon_conf.get("bam2fastq", "qsub_option"), run_conf.drmaa)
-fastq_splitter = Fastq_splitter(genomon_conf.get("split_fastq", "qsub_option"), run_conf.drmaa)
-bwa_align = Bwa_align(genomon_conf.get("bwa_mem", "qsub_option"), run_conf.drmaa)
-markduplicates = Markduplicates(genomon_conf.get("markduplicates", "qsub_option"), run_conf.drmaa)
-mutation_call = Mutation_call(genomon_conf.get("mutation_call", "qsub_option"), run_conf.drmaa)
-mutation_merge = Mutation_merge(genomon_conf.get("mutation_merge", "qsub_option"), run_conf.drmaa)
-sv_parse = SV_parse(genomon_conf.get("sv_parse", "qsub_option"), run_conf.drmaa)
-sv_merge = SV_merge(genomon_conf.get("sv_merge", "qsub_option"), run_conf.drmaa)
-sv_filt = SV_filt(genomon_conf.get("sv_filt", "qsub_option"), run_conf.drmaa)
-r_qc_bamstats = Res_QC_Bamstats(genomon_conf.get("qc_bamstats", "qsub_option"), run_conf.drmaa)
-r_qc_coverage = Res_QC_Coverage(genomon_conf.get("qc_coverage", "qsub_option"), run_conf.drmaa)
-r_qc_merge = Res_QC_Merge(genomon_conf.get("qc_merge", "qsub_option"), run_conf.drmaa)
-r_paplot = Res_PA_Plot(genomon_conf.get("paplot", "qsub_option"), run_conf.drmaa)
-r_post_analysis = Res_PostAnalysis(genomon_conf.get("post_analysis", "qsub_option"), run_conf.drmaa)
-r_pre_pmsignature = Res_PrePmsignature(genomon_conf.get("pre_pmsignature", "qsub_option"), run_conf.drmaa)
-r_pmsignature_ind = Res_Pmsignature(genomon_conf.get("pmsignature_ind", "qsub_option"), run_conf.drmaa)
-r_pmsignature_full = Res_Pmsignature(genomon_conf.get("pmsignature_full", "qsub_option"), run_conf.drmaa)
+bamtofastq = Bam2Fastq(genomon_conf.get("bam2fastq", "qsub_option"), run_conf.drmaa, "bam2fastq")
+fastq_splitter = Fastq_splitter(genomon_conf.get("split_fastq", "qsub_option"), run_conf.drmaa, "split_fastq")
+fastq_chunk_index = Fastq_chunk_index(genomon_conf.get("split_fastq", "qsub_option"), run_conf.drmaa, "split_fastq")
+fastq_pair_splitter = Fastq_pair_splitter(genomon_conf.get("split_fastq", "qsub_option"), run_conf.drmaa, "split_fastq")
+bwa_align = Bwa_align(genomon_conf.get("bwa_mem", "qsub_option"), run_conf.drmaa, "bwa_mem")
+markduplicates = Markduplicates(genomon_conf.get("markduplicates", "qsub_option"), run_conf.drmaa, "markduplicates")
+mutation_call = Mutation_call(genomon_conf.get("mutation_call", "qsub_option"), run_conf.drmaa, "mutation_call")
+mutation_merge = Mutation_merge(genomon_conf.get("mutation_merge", "qsub_option"), run_conf.drmaa, "mutation_merge")
+sv_parse = SV_parse(genomon_conf.get("sv_parse", "qsub_option"), run_conf.drmaa, "sv_parse")
+sv_merge = SV_merge(genomon_conf.get("sv_merge", "qsub_option"), run_conf.drmaa, "sv_merge")
+sv_filt = SV_filt(genomon_conf.get("sv_filt", "qsub_option"), run_conf.drmaa, "sv_filt")
+r_qc_bamstats = Res_QC_Bamstats(genomon_conf.get("qc_bamstats", "qsub_option"), run_conf.drmaa, "qc_bamstats")
+r_qc_coverage = Res_QC_Coverage(genomon_conf.get("qc_coverage", "qsub_option"), run_conf.drmaa, "qc_coverage")
+r_qc_merge = Res_QC_Merge(genomon_conf.get("qc_merge", "qsub_option"), run_conf.drmaa, "qc_merge")
+r_paplot = Res_PA_Plot(genomon_conf.get("paplot", "qsub_option"), run_conf.drmaa, "paplot")
+r_post_analysis = Res_PostAnalysis(genomon_conf.get("post_analysis", "qsub_option"), run_conf.drmaa, "post_analysis")
+r_pre_pmsignature = Res_PrePmsignature(genomon_conf.get("pre_pmsignature", "qsub_option"), run_conf.drmaa, "pre_pmsignature")
+r_pmsignature_ind = Res_Pmsignature(genomon_conf.get("pmsignature_ind", "qsub_option"), run_conf.drmaa, "pmsignature_ind")
+r_pmsignature_full = Res_Pmsignature(genomon_conf.get("pmsignature_full", "qsub_option"), run_conf.drmaa, "pmsignature_full")
+
+# stage groups run the small stages in one job
+qc_group = Stage_group("qc_group", [r_qc_bamstats, r_qc_coverage, r_qc_merge], run_conf.drmaa)
+post_analysis_group = Stage_group("post_analysis_group", [r_post_analysis], run_conf.drmaa)
+
+_group_qc = False
+_group_post_analysis = False
+if genomon_conf.has_section("stage_group"):
+    if genomon_conf.has_option("stage_group", "qc"):
+        _group_qc = genomon_conf.getboolean("stage_group", "qc")
+    if genomon_conf.has_option("stage_group", "post_analysis"):
+        _group_post_analysis = genomon_conf.getboolean("stage_group", "post_analysis")
+
+# virtual chunks: bwa_align reads the chunks from the original fastq at the offsets in the chunk index
+_virtual_chunk = False
+if genomon_conf.has_option("split_fastq", "virtual_chunk"):
+    _virtual_chunk = genomon_conf.getboolean("split_fastq", "virtual_chunk")
+
+fastq_chunk_script = os.path.splitext(os.path.abspath(fastq_chunk.__file__))[0] + '.py'
+
+# pair split: read 1 and read 2 are split in one pass, and the splitter counts the reads
+_pair_split = False
+if genomon_conf.has_option("split_fastq", "pair_split"):
+    _pair_split = genomon_conf.getboolean("split_fastq", "pair_split")
+
+fastq_pair_split_script = os.path.splitext(os.path.abspath(fastq_pair_split.__file__))[0] + '.py'
+
+# auto split: the lines of a chunk are chosen from the size of the input fastq
+_auto_split = False
+if genomon_conf.has_option("split_fastq", "auto_split"):
+    _auto_split = genomon_conf.getboolean("split_fastq", "auto_split")
+
+def split_target_chunks():
+    # the chunks of a sample, or the tasks of bwa_mem running at once
+    if genomon_conf.has_option("split_fastq", "target_chunks"):
+        return genomon_conf.getint("split_fastq", "target_chunks")
+    if genomon_conf.has_option("bwa_mem", "max_concurrent_tasks"):
+        return genomon_conf.getint("bwa_mem", "max_concurrent_tasks")
+    return 100
+
+# the bounds of the lines of a chunk
+_min_split_lines = 4000000
+if genomon_conf.has_option("split_fastq", "min_split_line_number"):
+    _min_split_lines = genomon_conf.getint("split_fastq", "min_split_line_number")
+_max_split_lines = 160000000
+if genomon_conf.has_option("split_fastq", "max_split_line_number"):
+    _max_split_lines = genomon_conf.getint("split_fastq", "max_split_line_number")
+
+# per lane: every fastq pair (or bam of bam2fastq) of a sample is split and aligned in fastq/{sample}/{lane},
+# and markdup collects the sorted bams of all the lanes
+_per_lane = False
+if genomon_conf.has_option("split_fastq", "per_lane"):
+    _per_lane = genomon_conf.getboolean("split_fastq", "per_lane")
+
+def fastq_sample(path):
+    # the sample of a path in fastq/{sample} or fastq/{sample}/{lane}
+    return os.path.relpath(path, run_conf.project_root + '/fastq').split(os.sep)[0]
+
+# the stage task that splits the fastq (or indexes the chunks)
+split_task = fastq_chunk_index if _virtual_chunk else (fastq_pair_splitter if _pair_split else fastq_splitter)
+
+if _virtual_chunk:
+    split_output_pattern = "{path[0]}/*.fastq_chunk_index"
+    (first_chunk, second_chunk) = ("1.fastq_chunk_index", "2.fastq_chunk_index")
+else:
+    split_output_pattern = "{path[0]}/*_*.fastq_split"
+    (first_chunk, second_chunk) = ("1_0000.fastq_split", "2_0000.fastq_split")
+
+if _per_lane:
+    map_input_formatter = formatter(".+/(.+)/(.+)/" + first_chunk)
+    map_add_inputs = add_inputs("{path[0]}/" + second_chunk)
+    map_outputs = ["{subpath[0][3]}/bam/{subdir[0][1]}/{subdir[0][1]}_L{subdir[0][0]}_*.sorted.bam", "{path[0]}", "{subpath[0][3]}/bam/{subdir[0][1]}"]
+else:
+    map_input_formatter = formatter(".+/(.+)/" + first_chunk)
+    map_add_inputs = add_inputs("{subpath[0][2]}/fastq/{subdir[0][0]}/" + second_chunk)
+    map_outputs = ["{subpath[0][2]}/bam/{subdir[0][0]}/{subdir[0][0]}_*.sorted.bam", "{subpath[0][2]}/fastq/{subdir[0][0]}", "{subpath[0][2]}/bam/{subdir[0][0]}"]
+
+# cram: markdup writes the reference-based cram (and crai) instead of the bam
+_cram = False
+if genomon_conf.has_option("markduplicates", "cram"):
+    _cram = genomon_conf.getboolean("markduplicates", "cram")
+
+_shard_plan = False
+if genomon_conf.has_option("mutation_call", "shard_plan"):
+    _shard_plan = genomon_conf.getboolean("mutation_call", "shard_plan")
+
+_shard_num = 0
+if genomon_conf.has_option("mutation_call", "shard_number"):
+    _shard_num = genomon_conf.getint("mutation_call", "shard_number")
+
+_mutation_scratch_dir = ""
+if genomon_conf.has_option("mutation_call", "scratch_dir"):
+    _mutation_scratch_dir = genomon_conf.get("mutation_call", "scratch_dir")
+
+_local_db_dir = ""
+if genomon_conf.has_option("annotation", "local_db_dir"):
+    _local_db_dir = genomon_conf.get("annotation", "local_db_dir")
+
+_local_db_max_size = 0
+if genomon_conf.has_option("annotation", "local_db_max_size"):
+    _local_db_max_size = genomon_conf.getint("annotation", "local_db_max_size")
+
+_annovar_in_merge = False
+if genomon_conf.has_option("annotation", "annovar_in_merge"):
+    _annovar_in_merge = genomon_conf.getboolean("annotation", "annovar_in_merge")
+
+def markdup_bam(sample):
+    # the merged, duplicate-marked alignments of the sample (the cram of [bam_import] is kept as cram)
+    if sample in sample_conf.bam_import:
+        ext = ".cram" if sample_conf.bam_import[sample].endswith(".cram") else ".bam"
+    else:
+        ext = ".cram" if _cram else ".bam"
+    return run_conf.project_root + '/bam/' + sample + '/' + sample + '.markdup' + ext
+
+def bam_index(bam):
+    return bam + (".crai" if bam.endswith(".cram") else ".bai")
+
+# the reference cache for the stages reading a cram (REF_PATH and REF_CACHE of htslib)
+_ref_cache = ""
+if _cram or any(bam.endswith(".cram") for bam in sample_conf.bam_import.values()):
+    _ref_cache = run_conf.project_root + '/ref_cache'
+    if genomon_conf.has_option("REFERENCE", "ref_cache_dir") and genomon_conf.get("REFERENCE", "ref_cache_dir") != "":
+        _ref_cache = genomon_conf.get("REFERENCE", "ref_cache_dir")
+    ref_cache.populate(genomon_conf.get("REFERENCE", "ref_fasta"), _ref_cache)
 
 _debug = False
 if genomon_conf.has_section("develop"):
     if genomon_conf.has_option("develop", "debug") == True:
         _debug = genomon_conf.getboolean("develop", "debug")
 
+# downstream stages of each stage (following the order of the tasks below) for the scheduler priority
+critical_path.set_graph({"bam2fastq": [split_task.task_name],
+                         "fastq_splitter": ["bwa_align"],
+                         "fastq_pair_splitter": ["bwa_align"],
+                         "fastq_chunk_index": ["bwa_align"],
+                         "bwa_align": ["markduplicates"],
+                         "markduplicates": ["mutation_call", "sv_parse"],
+                         "mutation_call": ["mutation_merge"],
+                         "mutation_merge": ["qc_bamstats", "qc_coverage", "qc_group", "post_analysis", "post_analysis_group"],
+                         "sv_parse": ["sv_merge"],
+                         "sv_merge": ["sv_filt"],
+                         "sv_filt": ["qc_bamstats", "qc_coverage", "qc_group", "post_analysis", "post_analysis_group"],
+                         "qc_bamstats": ["qc_merge"],
+                         "qc_coverage": ["qc_merge"],
+                         "qc_merge": ["post_analysis", "post_analysis_group"],
+                         "qc_group": ["post_analysis", "post_analysis_group"],
+                         "post_analysis": ["pre_pmsignature", "paplot"],
+                         "post_analysis_group": ["pre_pmsignature", "paplot"],
+                         "pre_pmsignature": ["pmsignature"],
+                         "pmsignature": ["paplot"],
+                         "paplot": []})
+
+if genomon_conf.has_option("priority", "enable"):
+    critical_path.enable = genomon_conf.getboolean("priority", "enable")
+
+# share the results of the stages across the projects
+if genomon_conf.has_option("result_cache", "cache_dir") and genomon_conf.get("result_cache", "cache_dir") != "":
+    result_cache.cache_dir = genomon_conf.get("result_cache", "cache_dir")
+    if genomon_conf.has_option("result_cache", "max_size"):
+        result_cache.max_size = parse_memory(genomon_conf.get("result_cache", "max_size"))
+
+def markdup_cache_outputs(sample):
+    bam_prefix = run_conf.project_root + '/bam/' + sample + '/' + sample
+    return [markdup_bam(sample),
+            bam_index(markdup_bam(sample)),
+            markdup_bam(sample) + '.md5',
+            bam_prefix + '.markdup.metrics',
+            run_conf.project_root + '/fastq/' + sample + '/fastq_line_num.txt']
+
+def markdup_cache_key(sample):
+    if sample in sample_conf.fastq:
+        input_files = sample_conf.fastq[sample][0] + sample_conf.fastq[sample][1]
+        stage_tasks = [split_task, bwa_align, markduplicates]
+        sections = ["split_fastq", "bwa_mem", "markduplicates", "SOFTWARE"]
+    else:
+        input_files = sample_conf.bam_tofastq[sample].split(';')
+        stage_tasks = [bamtofastq, split_task, bwa_align, markduplicates]
+        sections = ["bam2fastq", "split_fastq", "bwa_mem", "markduplicates", "SOFTWARE"]
+    input_files = input_files + [genomon_conf.get("REFERENCE", "ref_fasta")]
+    # the read group made from the sample name is in the header of the bam
+    values = []
+    if _per_lane and "-R " not in genomon_conf.get("bwa_mem", "bwa_params"):
+        values.append("read_group\t" + sample)
+    return result_cache.get_key(stage_tasks, input_files, sections, values)
+
+def markdup_source(sample):
+    # the markdup bam in the keys of the downstream stages (the key of the markdup entry, or the
+    # fingerprint of the imported bam), so the bam is never read for the key
+    if sample == None:
+        return "None"
+    if sample in sample_conf.bam_import:
+        return file_fingerprint(sample_conf.bam_import[sample])
+    key = markdup_cache_key(sample)
+    return "markdup\t" + key if key is not None else None
+
+def parse_sv_cache_outputs(sample):
+    sv_prefix = run_conf.project_root + '/sv/' + sample + '/' + sample
+    return [sv_prefix + '.junction.clustered.bedpe.gz',
+            sv_prefix + '.junction.clustered.bedpe.gz.tbi',
+            sv_prefix + '.improper.clustered.bedpe.gz',
+            sv_prefix + '.improper.clustered.bedpe.gz.tbi']
+
+def parse_sv_cache_key(sample):
+    return result_cache.get_key([sv_parse], [], ["sv_parse", "SOFTWARE"], [markdup_source(sample)])
+
+def mutation_cache_outputs(sample):
+    mutation_prefix = run_conf.project_root + '/mutation/' + sample + '/' + sample
+    return [mutation_prefix + '.genomon_mutation.result.txt',
+            mutation_prefix + '.genomon_mutation.result.filt.txt']
+
+def mutation_cache_key(complist):
+    # the bams of the control panel are the inputs instead of the list file (which has the paths in the project)
+    values = [markdup_source(complist[0]), markdup_source(complist[1])]
+    if complist[2] != None:
+        for panel_sample in sample_conf.control_panel[complist[2]]:
+            values.append(markdup_source(panel_sample))
+    input_files = [genomon_conf.get("REFERENCE", "ref_fasta"), genomon_conf.get("REFERENCE", "interval_list")]
+    sections = ["fisher_mutation_call", "realignment_filter", "indel_filter", "breakpoint_filter", "eb_filter",
+                "hotspot", "annotation", "mutation_util", "REFERENCE", "SOFTWARE"]
+    return result_cache.get_key([mutation_call, mutation_merge], input_files, sections, values)
+
+# the markdup results are restored before the existence checks below, so the alignment of a cached sample is
+# never planned (the keys of the later stages are looked up by their tasks when they are about to run)
+if result_cache.enabled():
+    for sample in sample_conf.fastq.keys() + sample_conf.bam_tofastq.keys():
+        if os.path.exists(markdup_cache_outputs(sample)[0]): continue
+        result_cache.restore("markdup", markdup_cache_key(sample), markdup_cache_outputs(sample))
+
 # generate output list of 'linked fastq'
 linked_fastq_list = []
 for sample in sample_conf.fastq:
     if os.path.exists(run_conf.project_root + '/bam/' + sample + '/1.sorted.bam'): continue
-    if os.path.exists(run_conf.project_root + '/bam/' + sample + '/' + sample + '.markdup.bam'): continue
+    if os.path.exists(markdup_bam(sample)): continue
+
+    if _per_lane:
+        for (count, fastq_file) in enumerate(sample_conf.fastq[sample][0]):
+            fastq_prefix, ext = os.path.splitext(fastq_file)
+            lane_dir = run_conf.project_root + '/fastq/' + sample + '/' + str(count+1)
+            linked_fastq_list.append([[lane_dir + '/1_1' + ext], [lane_dir + '/1_2' + ext]])
+        continue
 
     link_fastq_arr1 = []
     link_fastq_arr2 = []
@@ -64,11 +306,17 @@ for sample in sample_conf.fastq:
 bam2fastq_output_list = []
 for sample in sample_conf.bam_tofastq:
     if os.path.exists(run_conf.project_root + '/bam/' + sample + '/1.sorted.bam'): continue
-    if os.path.exists(run_conf.project_root + '/bam/' + sample + '/' + sample + '.markdup.bam'): continue
+    if os.path.exists(markdup_bam(sample)): continue
+    if _per_lane:
+        for (count, bam) in enumerate(sample_conf.bam_tofastq[sample].split(';')):
+            lane_dir = run_conf.project_root + '/fastq/' + sample + '/' + str(count+1)
+            bam2fastq_output_list.append([[lane_dir + '/1_1.fastq'], [lane_dir + '/1_2.fastq']])
+        continue
     bam2fastq_arr1 = []
     bam2fastq_arr2 = []
-    bam2fastq_arr1.append(run_conf.project_root + '/fastq/' + sample + '/1_1.fastq')
-    bam2fastq_arr2.append(run_conf.project_root + '/fastq/' + sample + '/1_2.fastq')
+    for (count, bam) in enumerate(sample_conf.bam_tofastq[sample].split(';')):
+        bam2fastq_arr1.append(run_conf.project_root + '/fastq/' + sample + '/' + str(count+1) + '_1.fastq')
+        bam2fastq_arr2.append(run_conf.project_root + '/fastq/' + sample + '/' + str(count+1) + '_2.fastq')
     bam2fastq_output_list.append([bam2fastq_arr1,bam2fastq_arr2])
 
 # generate input list of 'mutation call'
@@ -76,8 +324,8 @@ markdup_bam_list = []
 merge_mutation_list = []
 for complist in sample_conf.mutation_call:
      if os.path.exists(run_conf.project_root + '/mutation/' + complist[0] + '/' + complist[0] + '.genomon_mutation.result.filt.txt'): continue
-     tumor_bam  = run_conf.project_root + '/bam/' + complist[0] + '/' + complist[0] + '.markdup.bam'
-     normal_bam = run_conf.project_root + '/bam/' + complist[1] + '/' + complist[1] + '.markdup.bam' if complist[1] != None else None
+     tumor_bam  = markdup_bam(complist[0])
+     normal_bam = markdup_bam(complist[1]) if complist[1] != None else None
      panel = run_conf.project_root + '/mutation/control_panel/' + complist[2] + ".control_panel.txt" if complist[2] != None else None
      markdup_bam_list.append([tumor_bam, normal_bam, panel])
 
@@ -89,14 +337,14 @@ unique_bams = []
 for complist in sample_conf.sv_detection:
     tumor_sample = complist[0]
     if tumor_sample != None:
-        all_target_bams.append(run_conf.project_root + '/bam/' + tumor_sample + '/' + tumor_sample + '.markdup.bam')
+        all_target_bams.append(markdup_bam(tumor_sample))
     normal_sample = complist[1]
     if normal_sample != None:
-        all_target_bams.append(run_conf.project_root + '/bam/' + normal_sample + '/' + normal_sample + '.markdup.bam')
+        all_target_bams.append(markdup_bam(normal_sample))
     panel_name = complist[2]
     if panel_name != None:
         for panel_sample in sample_conf.control_panel[panel_name]:
-            all_target_bams.append(run_conf.project_root + '/bam/' + panel_sample + '/' + panel_sample + '.markdup.bam')
+            all_target_bams.append(markdup_bam(panel_sample))
     unique_bams = list(set(all_target_bams))       
     
 for bam in unique_bams:
@@ -131,15 +379,17 @@ for complist in sample_conf.sv_detection:
 qc_bamstats_list = []
 qc_coverage_list = []
 qc_merge_list = []
+qc_group_list = []
 for sample in sample_conf.qc:
     if os.path.exists(run_conf.project_root + '/qc/' + sample + '/' + sample + '.genomonQC.result.txt'): continue
+    qc_group_list.append(markdup_bam(sample))
     qc_merge_list.append(
         [run_conf.project_root + '/qc/' + sample + '/' + sample + '.bamstats',
          run_conf.project_root + '/qc/' + sample + '/' + sample + '.coverage'])
     if not os.path.exists(run_conf.project_root + '/qc/' + sample + '/' + sample + '.bamstats'):
-        qc_bamstats_list.append(run_conf.project_root + '/bam/' + sample +'/'+ sample +'.markdup.bam')
+        qc_bamstats_list.append(markdup_bam(sample))
     if not os.path.exists(run_conf.project_root + '/qc/' + sample + '/' + sample + '.coverage'):
-        qc_coverage_list.append(run_conf.project_root + '/bam/' + sample +'/'+ sample +'.markdup.bam')
+        qc_coverage_list.append(markdup_bam(sample))
 
 ### 
 # input/output lists for post-analysis
@@ -171,6 +421,13 @@ if pa_outputs_qc["run_pa"] == True:
     for sample in sample_conf.qc:
         pa_inputs_qc.append(run_conf.project_root + '/qc/' + sample + '/' + sample + '.genomonQC.result.txt')
 
+# generate input/output list of 'post analysis group'
+pa_inputs_group = pa_inputs_mutation + pa_inputs_sv + pa_inputs_qc
+pa_outputs_group = []
+for pa_outputs in [pa_outputs_mutation, pa_outputs_sv, pa_outputs_qc]:
+    if pa_outputs["run_pa"] == True:
+        pa_outputs_group.extend(pa_outputs["outputs"])
+
 ### 
 # input/output lists for paplot
 ###
@@ -301,10 +558,10 @@ if not os.path.isdir(run_conf.project_root + '/config'): os.mkdir(run_conf.proje
 
 for outputfiles in (bam2fastq_output_list, linked_fastq_list):
     for outputfile in outputfiles:
-        sample = os.path.basename(os.path.dirname(outputfile[0][0]))
-        fastq_dir = run_conf.project_root + '/fastq/' + sample
+        sample = fastq_sample(outputfile[0][0])
+        fastq_dir = os.path.dirname(outputfile[0][0])
         bam_dir = run_conf.project_root + '/bam/' + sample
-        if not os.path.isdir(fastq_dir): os.mkdir(fastq_dir)
+        if not os.path.isdir(fastq_dir): os.makedirs(fastq_dir)
         if not os.path.isdir(bam_dir): os.mkdir(bam_dir)
 
 for target_sample_dict in (sample_conf.bam_import, sample_conf.fastq, sample_conf.bam_tofastq):
@@ -328,7 +585,7 @@ for complist in sample_conf.mutation_call:
         control_panel_file = run_conf.project_root + '/mutation/control_panel/' + control_panel_name + ".control_panel.txt"
         with open(control_panel_file,  "w") as out_handle:
             for panel_sample in sample_conf.control_panel[control_panel_name]:
-                out_handle.write(run_conf.project_root + '/bam/' + panel_sample + '/' + panel_sample + '.markdup.bam' + "\n")
+                out_handle.write(markdup_bam(panel_sample) + "\n")
 
 # make SV configuration file
 for complist in sample_conf.sv_detection:
@@ -346,42 +603,58 @@ def link_import_bam(sample):
     bam = sample_conf.bam_import[sample]
     link_dir = run_conf.project_root + '/bam/' + sample
     bam_prefix, ext = os.path.splitext(bam)
+    # .bai for bam, .crai for cram
+    index_ext = os.path.splitext(bam_index(bam))[1]
+    link_bam = markdup_bam(sample)
     
     if not os.path.isdir(link_dir): os.mkdir(link_dir)
-    if (not os.path.exists(link_dir +'/'+ sample +'.markdup.bam')) and (not os.path.exists(link_dir +'/'+ sample +'.markdup.bam.bai')): 
-        os.symlink(bam, link_dir +'/'+ sample +'.markdup.bam')
-        if (os.path.exists(bam +'.bai')):
-            os.symlink(bam +'.bai', link_dir +'/'+ sample +'.markdup.bam.bai')
-        elif (os.path.exists(bam_prefix +'.bai')):
-            os.symlink(bam_prefix +'.bai', link_dir +'/'+ sample +'.markdup.bam.bai')
+    if (not os.path.exists(link_bam)) and (not os.path.exists(bam_index(link_bam))): 
+        os.symlink(bam, link_bam)
+        if (os.path.exists(bam + index_ext)):
+            os.symlink(bam + index_ext, bam_index(link_bam))
+        elif (os.path.exists(bam_prefix + index_ext)):
+            os.symlink(bam_prefix + index_ext, bam_index(link_bam))
 
 # convert bam to fastq
 @originate(bam2fastq_output_list)
 def bam2fastq(outputfiles):
-    sample = os.path.basename(os.path.dirname(outputfiles[0][0]))
-    output_dir = run_conf.project_root + '/fastq/' + sample
+    sample = fastq_sample(outputfiles[0][0])
+    output_dir = os.path.dirname(outputfiles[0][0])
+    input_bam = sample_conf.bam_tofastq[sample]
+    if _per_lane:
+        input_bam = input_bam.split(';')[int(os.path.basename(output_dir)) - 1]
             
     arguments = {"biobambam": genomon_conf.get("SOFTWARE", "biobambam"),
                  "param": genomon_conf.get("bam2fastq", "params"),
-                 "input_bam": sample_conf.bam_tofastq[sample],
+                 "input_bam": input_bam,
                  "f1_name": outputfiles[0][0],
                  "f2_name": outputfiles[1][0],
                  "o1_name": output_dir + '/unmatched_first_output.txt',
                  "o2_name": output_dir + '/unmatched_second_output.txt',
                  "t": output_dir + '/temp.txt',
-                 "s": output_dir + '/single_end_output.txt'}
-    bamtofastq.task_exec(arguments, run_conf.project_root + '/log/' + sample, run_conf.project_root + '/script/'+ sample)
+                 "s": output_dir + '/single_end_output.txt',
+                 "output_dir": output_dir,
+                 "ref_fa": genomon_conf.get("REFERENCE", "ref_fasta")}
+    # the bams are converted by the tasks of an array job at the same time
+    max_task = len(input_bam.split(';'))
+    bamtofastq.task_exec(arguments, run_conf.project_root + '/log/' + sample, run_conf.project_root + '/script/'+ sample, max_task if max_task > 1 else 0)
 
 
 # link the input fastq to project directory
 @originate(linked_fastq_list)
 def link_input_fastq(output_file):
-    sample = os.path.basename(os.path.dirname(output_file[0][0]))
+    sample = fastq_sample(output_file[0][0])
     fastq_dir = run_conf.project_root + '/fastq/' + sample
     fastq_prefix, ext = os.path.splitext(sample_conf.fastq[sample][0][0])
     # Todo
     # 1. should compare the timestamps between input and linked file
     # 2. check md5sum ?
+    if _per_lane:
+        count = int(os.path.basename(os.path.dirname(output_file[0][0]))) - 1
+        if not os.path.exists(output_file[0][0]): os.symlink(sample_conf.fastq[sample][0][count], output_file[0][0])
+        if not os.path.exists(output_file[1][0]): os.symlink(sample_conf.fastq[sample][1][count], output_file[1][0])
+        return
+
     for (count, fastq_files) in enumerate(sample_conf.fastq[sample][0]):
         fastq_prefix, ext = os.path.splitext(fastq_files)
         if not os.path.exists(fastq_dir + '/'+str(count+1)+'_1'+ ext): os.symlink(sample_conf.fastq[sample][0][count], fastq_dir + '/'+str(count+1)+'_1'+ ext)
@@ -389,31 +662,62 @@ def link_input_fastq(output_file):
 
 
 # split fastq
-@subdivide([bam2fastq, link_input_fastq], formatter(), "{path[0]}/*_*.fastq_split", "{path[0]}")
+@subdivide([bam2fastq, link_input_fastq], formatter(), split_output_pattern, "{path[0]}")
 def split_files(input_files, output_files, target_dir):
 
-    sample_name = os.path.basename(target_dir)
+    sample_name = fastq_sample(target_dir)
 
     for oo in output_files:
         os.unlink(oo)
 
     split_lines = genomon_conf.get("split_fastq", "split_fastq_line_number")
+    if _auto_split:
+        split_lines = str(auto_split_lines(input_files[0], split_target_chunks(), _min_split_lines, _max_split_lines))
+    # the lines of a chunk used by the alignment
+    with open(target_dir + "/split_line_num.txt",  "w") as out_handle:
+        out_handle.write(split_lines+"\n")
+
+    threads = 1
+    if genomon_conf.has_option("split_fastq", "threads"):
+        threads = genomon_conf.getint("split_fastq", "threads")
+    pigz = ""
+    if genomon_conf.has_option("SOFTWARE", "pigz"):
+        pigz = genomon_conf.get("SOFTWARE", "pigz")
 
     input_prefix, ext = os.path.splitext(input_files[0][0])
     arguments = {"lines": split_lines,
                  "fastq_filter": genomon_conf.get("split_fastq", "fastq_filter"),
                  "target_dir": target_dir,
-                 "ext": ext}
-    
-    fastq_splitter.task_exec(arguments, run_conf.project_root + '/log/' + sample_name, run_conf.project_root + '/script/'+ sample_name, 2)
+                 "ext": ext,
+                 "threads": threads,
+                 "htslib": genomon_conf.get("SOFTWARE", "htslib"),
+                 "pigz": pigz}
+
+    if _virtual_chunk:
+        # only the chunk index is made, and the input fastq are kept until the alignment finishes
+        arguments["python"] = sys.executable
+        arguments["fastq_chunk"] = fastq_chunk_script
+        fastq_chunk_index.task_exec(arguments, run_conf.project_root + '/log/' + sample_name, run_conf.project_root + '/script/'+ sample_name, 2)
+
+        with open(target_dir + "/fastq_line_num.txt",  "w") as out_handle:
+            out_handle.write(str(fastq_chunk.read_index(target_dir + '/1.fastq_chunk_index')["total"])+"\n")
+        return
+
+    if _pair_split:
+        # the splitter writes the manifest and the fastq_line_num.txt, so the chunks are not read again here
+        arguments["python"] = sys.executable
+        arguments["fastq_pair_split"] = fastq_pair_split_script
+        fastq_pair_splitter.task_exec(arguments, run_conf.project_root + '/log/' + sample_name, run_conf.project_root + '/script/'+ sample_name)
+    else:
+        fastq_splitter.task_exec(arguments, run_conf.project_root + '/log/' + sample_name, run_conf.project_root + '/script/'+ sample_name, 2)
    
-    file_list = glob.glob(target_dir + '/1_*.fastq_split')
-    file_list.sort()
-    last_file_lines = sum(1 for line in open(file_list[-1]))
-    all_line_num = ((len(file_list)-1)*int(split_lines)) + last_file_lines
+        file_list = glob.glob(target_dir + '/1_*.fastq_split')
+        file_list.sort()
+        last_file_lines = sum(1 for line in open(file_list[-1]))
+        all_line_num = ((len(file_list)-1)*int(split_lines)) + last_file_lines
     
-    with open(target_dir + "/fastq_line_num.txt",  "w") as out_handle:
-        out_handle.write(str(all_line_num)+"\n")
+        with open(target_dir + "/fastq_line_num.txt",  "w") as out_handle:
+            out_handle.write(str(all_line_num)+"\n")
     
     for input_fastq in input_files[0]:
         os.unlink(input_fastq)
@@ -422,56 +726,127 @@ def split_files(input_files, output_files, target_dir):
 
 
 #bwa
-@subdivide(split_files, formatter(".+/(.+)/1_0000.fastq_split"), add_inputs("{subpath[0][2]}/fastq/{subdir[0][0]}/2_0000.fastq_split"), "{subpath[0][2]}/bam/{subdir[0][0]}/{subdir[0][0]}_*.sorted.bam", "{subpath[0][2]}/fastq/{subdir[0][0]}", "{subpath[0][2]}/bam/{subdir[0][0]}")
+@subdivide(split_files, map_input_formatter, map_add_inputs, *map_outputs)
 def map_dna_sequence(input_files, output_files, input_dir, output_dir):
 
     sample_name = os.path.basename(output_dir)
+    # the prefix of the sorted bams of the chunks
+    chunk_prefix = sample_name
+    read_group = ""
+    if _per_lane:
+        lane = os.path.basename(input_dir)
+        chunk_prefix = sample_name + '_L' + lane
+        if "-R " not in genomon_conf.get("bwa_mem", "bwa_params"):
+            read_group = "-R '@RG\\tID:" + sample_name + ".L" + lane + "\\tSM:" + sample_name + "\\tLB:" + sample_name + "\\tPU:L" + lane + "'"
 
     all_line_num = 0
     with open(input_dir + "/fastq_line_num.txt") as in_handle:
         tmp_num = in_handle.read()
         all_line_num = int(tmp_num)
     split_lines = genomon_conf.get("split_fastq", "split_fastq_line_number")
+    if os.path.exists(input_dir + "/split_line_num.txt"):
+        with open(input_dir + "/split_line_num.txt") as in_handle:
+            split_lines = in_handle.read().strip()
 
     ans_quotient = all_line_num / int(split_lines)
     ans_remainder = all_line_num % int(split_lines)
     max_task_id = ans_quotient if ans_remainder == 0 else ans_quotient + 1
+    if max_task_id == 0:
+        raise RuntimeError("No reads to align in " + input_dir)
+
+    stream_sort = False
+    if genomon_conf.has_option("bwa_mem", "stream_sort"):
+        stream_sort = genomon_conf.getboolean("bwa_mem", "stream_sort")
+
+    sort_tmp_dir = ""
+    if genomon_conf.has_option("bwa_mem", "sort_tmp_dir"):
+        sort_tmp_dir = genomon_conf.get("bwa_mem", "sort_tmp_dir")
+
+    # the bwa index is read from ref_fasta (none), copied to the local disk (local) or loaded into the shared memory (shm)
+    index_stage = "none"
+    if genomon_conf.has_option("bwa_mem", "index_stage"):
+        index_stage = genomon_conf.get("bwa_mem", "index_stage")
+    if index_stage not in ("none", "local", "shm"):
+        raise ValueError("index_stage of [bwa_mem] should be either of none, local or shm: " + index_stage)
+    local_index_dir = "/tmp/genomon_bwa_index"
+    if genomon_conf.has_option("bwa_mem", "local_index_dir") and genomon_conf.get("bwa_mem", "local_index_dir") != "":
+        local_index_dir = genomon_conf.get("bwa_mem", "local_index_dir")
+    chunks_per_job = 1
+    if genomon_conf.has_option("bwa_mem", "chunks_per_job"):
+        chunks_per_job = max(1, genomon_conf.getint("bwa_mem", "chunks_per_job"))
     
     arguments = {"input_dir": input_dir,
                  "output_dir": output_dir,
-                 "sample_name": sample_name,
+                 "sample_name": chunk_prefix,
                  "bwa": genomon_conf.get("SOFTWARE", "bwa"),
                  "bwa_params": genomon_conf.get("bwa_mem", "bwa_params"),
+                 "read_group": read_group,
+                 "sort_threads": get_thread_num(bwa_align.qsub_option, 2),
                  "ref_fa":genomon_conf.get("REFERENCE", "ref_fasta"),
-                 "biobambam": genomon_conf.get("SOFTWARE", "biobambam")}
-
-    bwa_align.task_exec(arguments, run_conf.project_root + '/log/' + sample_name , run_conf.project_root + '/script/' + sample_name, max_task_id) 
+                 "biobambam": genomon_conf.get("SOFTWARE", "biobambam"),
+                 "stream_sort": stream_sort,
+                 "sort_tmp_dir": sort_tmp_dir,
+                 "index_stage": index_stage,
+                 "local_index_dir": local_index_dir,
+                 "chunks_per_job": chunks_per_job,
+                 "chunk_num": max_task_id,
+                 "virtual_chunk": _virtual_chunk,
+                 "python": sys.executable,
+                 "fastq_chunk": fastq_chunk_script}
+
+    # a task aligns chunks_per_job chunks
+    bwa_align.task_exec(arguments, run_conf.project_root + '/log/' + sample_name , run_conf.project_root + '/script/' + sample_name, (max_task_id + chunks_per_job - 1) / chunks_per_job) 
+
+    if _virtual_chunk:
+        # the fastq in the fastq directory (links, bam2fastq outputs and decompressed files) are no longer needed
+        for index_file in (input_dir + '/1.fastq_chunk_index', input_dir + '/2.fastq_chunk_index'):
+            index = fastq_chunk.read_index(index_file)
+            for path in set(index["inputs"] + [path for (path, file_type) in index["files"]]):
+                if os.path.dirname(os.path.abspath(path)) == os.path.abspath(input_dir) and os.path.lexists(path):
+                    os.unlink(path)
+            os.unlink(index_file)
 
     for task_id in range(max_task_id):
         num = str(task_id).zfill(4)
-        os.unlink(input_dir +'/1_'+str(num)+'.fastq_split')
-        os.unlink(input_dir +'/2_'+str(num)+'.fastq_split')
-        os.unlink(output_dir+'/'+sample_name+'_'+str(num)+'.bwa.sam')
+        if not _virtual_chunk:
+            os.unlink(input_dir +'/1_'+str(num)+'.fastq_split')
+            os.unlink(input_dir +'/2_'+str(num)+'.fastq_split')
+        if os.path.exists(output_dir+'/'+chunk_prefix+'_'+str(num)+'.bwa.sam'):
+            os.unlink(output_dir+'/'+chunk_prefix+'_'+str(num)+'.bwa.sam')
 
 
 # merge sorted bams into one and mark duplicate reads with biobambam
-@collate(map_dna_sequence, formatter(), "{subpath[0][2]}/bam/{subdir[0][0]}/{subdir[0][0]}.markdup.bam", "{subpath[0][2]}/bam/{subdir[0][0]}")
+@collate(map_dna_sequence, formatter(), "{subpath[0][2]}/bam/{subdir[0][0]}/{subdir[0][0]}.markdup" + (".cram" if _cram else ".bam"), "{subpath[0][2]}/bam/{subdir[0][0]}")
 def markdup(input_files, output_file, output_dir):
 
     sample_name = os.path.basename(output_dir)
 
     output_prefix, ext = os.path.splitext(output_file)
 
-    input_bam_files = ""
-    for input_file in input_files:
-        input_bam_files = input_bam_files + " I=" + input_file
+    fan_in = 0
+    if genomon_conf.has_option("markduplicates", "merge_fan_in"):
+        fan_in = genomon_conf.getint("markduplicates", "merge_fan_in")
+
+    if _per_lane:
+        # the reads of the sample are the sum of the lanes
+        all_line_num = 0
+        for line_num_file in glob.glob(run_conf.project_root + '/fastq/' + sample_name + '/*/fastq_line_num.txt'):
+            with open(line_num_file) as in_handle:
+                all_line_num += int(in_handle.read())
+        with open(run_conf.project_root + '/fastq/' + sample_name + '/fastq_line_num.txt',  "w") as out_handle:
+            out_handle.write(str(all_line_num)+"\n")
 
     arguments = {"biobambam": genomon_conf.get("SOFTWARE", "biobambam"),
                  "out_prefix": output_prefix,
-                 "input_bam_files": input_bam_files,
-                 "out_bam": output_file}
+                 "input_bams": ' '.join(input_files),
+                 "fan_in": fan_in,
+                 "mark_threads": get_thread_num(markduplicates.qsub_option, 2),
+                 "cram": _cram,
+                 "samtools": genomon_conf.get("SOFTWARE", "samtools"),
+                 "ref_fa": genomon_conf.get("REFERENCE", "ref_fasta")}
 
     markduplicates.task_exec(arguments, run_conf.project_root + '/log/' + sample_name , run_conf.project_root + '/script/'+ sample_name)
+    result_cache.store("markdup", markdup_cache_key(sample_name), markdup_cache_outputs(sample_name))
 
     for input_file in input_files:
         os.unlink(input_file)
@@ -486,6 +861,10 @@ def identify_mutations(input_file, output_file, output_dir):
 
     sample_name = os.path.basename(output_dir)
 
+    for complist in sample_conf.mutation_call:
+        if complist[0] == sample_name and result_cache.restore("mutation_call", mutation_cache_key(complist), mutation_cache_outputs(sample_name)):
+            return
+
     active_inhouse_normal_flag = False
     if genomon_conf.has_option("annotation", "active_inhouse_normal_flag"):
         active_inhouse_normal_flag = genomon_conf.get("annotation", "active_inhouse_normal_flag")
@@ -510,6 +889,17 @@ def identify_mutations(input_file, output_file, output_dir):
     if genomon_conf.has_option("REFERENCE", "HGMD_tabix_db"):
         HGMD_tabix_db = genomon_conf.get("REFERENCE", "HGMD_tabix_db")
 
+    # the tasks of the mutation call are the shards of the interval list balanced by the coverage
+    # (the hotspot database is split along the lines of the interval list, so the hotspot call keeps the lines)
+    interval_list = genomon_conf.get("REFERENCE", "interval_list")
+    region_list = interval_list
+    if _shard_plan and not genomon_conf.getboolean("hotspot", "active_hotspot_flag"):
+        region_list = output_dir + '/' + sample_name + '.shard_manifest.txt'
+        shard_bams = [bam for bam in input_file[0:2] if bam != None]
+        max_task_id = shard_planner.plan_shards(region_list, interval_list, shard_bams, genomon_conf.get("REFERENCE", "ref_fasta"), _shard_num)
+    else:
+        max_task_id = sum(1 for line in open(region_list))
+
     arguments = {
         # fisher mutation
         "fisher": genomon_conf.get("SOFTWARE", "fisher"),
@@ -550,8 +940,10 @@ def identify_mutations(input_file, output_file, output_dir):
         "ExAC_database":genomon_conf.get("REFERENCE", "ExAC_tabix_db"),
         "active_HGMD_flag": active_HGMD_flag,
         "HGMD_database": HGMD_tabix_db,
-        # annovar
-        "active_annovar_flag": genomon_conf.get("annotation", "active_annovar_flag"),
+        "local_db_dir": _local_db_dir,
+        "local_db_max_size": _local_db_max_size,
+        # annovar (run by mutation_merge with annovar_in_merge)
+        "active_annovar_flag": "False" if _annovar_in_merge else genomon_conf.get("annotation", "active_annovar_flag"),
         "annovar": genomon_conf.get("SOFTWARE", "annovar"),
         "annovar_database": genomon_conf.get("annotation", "annovar_database"),
         "table_annovar_params": genomon_conf.get("annotation", "table_annovar_params"),
@@ -561,16 +953,15 @@ def identify_mutations(input_file, output_file, output_dir):
         "pythonpath": genomon_conf.get("ENV", "PYTHONPATH"),   
         "ld_library_path": genomon_conf.get("ENV", "LD_LIBRARY_PATH"),
         "ref_fa":genomon_conf.get("REFERENCE", "ref_fasta"),
-        "interval_list": genomon_conf.get("REFERENCE", "interval_list"),
+        "region_list": region_list,
+        "ref_cache": _ref_cache,
+        "scratch_dir": _mutation_scratch_dir,
         "disease_bam": input_file[0],
         "control_bam": input_file[1],
         "out_prefix": output_dir + '/' + sample_name,
         "samtools": genomon_conf.get("SOFTWARE", "samtools"),
         "blat": genomon_conf.get("SOFTWARE", "blat")}
 
-    interval_list = genomon_conf.get("REFERENCE", "interval_list")
-    max_task_id = sum(1 for line in open(interval_list))
-
     mutation_call.task_exec(arguments, run_conf.project_root + '/log/' + sample_name, run_conf.project_root + '/script/' + sample_name, max_task_id)
     
     arguments = {
@@ -580,6 +971,10 @@ def identify_mutations(input_file, output_file, output_dir):
         "control_bam": input_file[1],
         "control_bam_list": input_file[2],
         "active_annovar_flag": genomon_conf.get("annotation", "active_annovar_flag"),
+        "annovar_in_merge": _annovar_in_merge,
+        "annovar": genomon_conf.get("SOFTWARE", "annovar"),
+        "annovar_database": genomon_conf.get("annotation", "annovar_database"),
+        "table_annovar_params": genomon_conf.get("annotation", "table_annovar_params"),
         "annovar_buildver": genomon_conf.get("annotation", "annovar_buildver"),
         "active_HGVD_2013_flag": genomon_conf.get("annotation", "active_HGVD_2013_flag"),
         "active_HGVD_2016_flag": genomon_conf.get("annotation", "active_HGVD_2016_flag"),
@@ -600,13 +995,23 @@ def identify_mutations(input_file, output_file, output_dir):
         "out_prefix": output_dir + '/' + sample_name}
 
     mutation_merge.task_exec(arguments, run_conf.project_root + '/log/' + sample_name, run_conf.project_root + '/script/' + sample_name)
+    for complist in sample_conf.mutation_call:
+        if complist[0] == sample_name:
+            result_cache.store("mutation_call", mutation_cache_key(complist), mutation_cache_outputs(sample_name))
 
     annovar_buildver = genomon_conf.get("annotation", "annovar_buildver"),
     for task_id in range(1,(max_task_id + 1)):
         input_file = output_dir+'/'+sample_name+'_mutations_candidate.'+str(task_id)+'.'+annovar_buildver[0]+'_multianno.txt'
         os.unlink(input_file)
+    if _annovar_in_merge:
+        for input_file in [output_dir+'/'+sample_name+'_mutations_candidate.txt',
+                           output_dir+'/'+sample_name+'_mutations_candidate.'+annovar_buildver[0]+'_multianno.txt']:
+            if os.path.exists(input_file):
+                os.unlink(input_file)
 
+    # the intermediate results in the scratch directory are removed by the tasks
     for task_id in range(1,(max_task_id + 1)):
+        if _mutation_scratch_dir != "": break
         if os.path.exists(output_dir+'/'+sample_name+'.fisher_mutations.'+str(task_id)+'.txt'):
             os.unlink(output_dir+'/'+sample_name+'.fisher_mutations.'+str(task_id)+'.txt')
         if os.path.exists(output_dir+'/'+sample_name+'.hotspot_mutations.'+str(task_id)+'.txt'):
@@ -646,8 +1051,12 @@ def parse_sv(input_file, output_file):
     if not os.path.isdir(dir_name): os.mkdir(dir_name)
     sample_name = os.path.basename(dir_name)
 
+    if result_cache.restore("sv_parse", parse_sv_cache_key(sample_name), parse_sv_cache_outputs(sample_name)):
+        return
+
     arguments = {"genomon_sv": genomon_conf.get("SOFTWARE", "genomon_sv"),
                  "input_bam": input_file,
+                 "ref_cache": _ref_cache,
                  "output_prefix": output_file.replace(".junction.clustered.bedpe.gz", ""),
                  "param": genomon_conf.get("sv_parse", "params"),
                  "pythonhome": genomon_conf.get("ENV", "PYTHONHOME"),
@@ -656,6 +1065,7 @@ def parse_sv(input_file, output_file):
                  "htslib": genomon_conf.get("SOFTWARE", "htslib")}
 
     sv_parse.task_exec(arguments, run_conf.project_root + '/log/' + sample_name , run_conf.project_root + '/script/' + sample_name)
+    result_cache.store("sv_parse", parse_sv_cache_key(sample_name), parse_sv_cache_outputs(sample_name))
 
 
 # merge SV
@@ -690,7 +1100,7 @@ def filt_sv(input_files,  output_file):
         if sample_name == complist[0]:
 
             if complist[1] != None:
-                filt_param = filt_param + " --matched_control_bam " + run_conf.project_root + "/bam/" + complist[1] + '/' + complist[1] + ".markdup.bam"
+                filt_param = filt_param + " --matched_control_bam " + markdup_bam(complist[1])
 
             if complist[2] != None:
                 filt_param = filt_param + " --non_matched_control_junction " + run_conf.project_root +"/sv/non_matched_control_panel/"+ complist[2] +".merged.junction.control.bedpe.gz"
@@ -702,7 +1112,8 @@ def filt_sv(input_files,  output_file):
     filt_param = filt_param.lstrip(' ') + ' ' + genomon_conf.get("sv_filt", "params")
 
     arguments = {"genomon_sv": genomon_conf.get("SOFTWARE", "genomon_sv"),
-                 "input_bam": run_conf.project_root + "/bam/" + sample_name + '/' + sample_name + ".markdup.bam",
+                 "input_bam": markdup_bam(sample_name),
+                 "ref_cache": _ref_cache,
                  "output_prefix": run_conf.project_root + "/sv/" + sample_name + '/' + sample_name,
                  "reference_genome": genomon_conf.get("REFERENCE", "ref_fasta"),
                  "param": filt_param,
@@ -719,6 +1130,54 @@ def filt_sv(input_files,  output_file):
 
 
 # qc
+def qc_bamstats_arguments(input_file, output_file):
+    return {"pythonhome": genomon_conf.get("ENV", "PYTHONHOME"),
+            "pythonpath": genomon_conf.get("ENV", "PYTHONPATH"),
+            "genomon_qc": genomon_conf.get("SOFTWARE", "genomon_qc"),
+            "bamstats": genomon_conf.get("SOFTWARE", "bamstats"),
+            "perl5lib": genomon_conf.get("ENV", "PERL5LIB"),
+            "input_file": input_file,
+            "ref_cache": _ref_cache,
+            "output_file": output_file}
+
+
+def qc_coverage_arguments(input_file, output_file):
+    data_type = "exome"
+    if genomon_conf.get("qc_coverage", "wgs_flag") == "True":
+        data_type = "wgs"
+
+    return {"data_type": data_type,
+            "pythonhome": genomon_conf.get("ENV", "PYTHONHOME"),
+            "pythonpath": genomon_conf.get("ENV", "PYTHONPATH"),
+            "genomon_qc": genomon_conf.get("SOFTWARE", "genomon_qc"),
+            "coverage_text": genomon_conf.get("qc_coverage", "coverage"),
+            "i_bed_lines": genomon_conf.get("qc_coverage", "wgs_i_bed_lines"),
+            "i_bed_width": genomon_conf.get("qc_coverage", "wgs_i_bed_width"),
+            "incl_bed_width":genomon_conf.get("qc_coverage", "wgs_incl_bed_width"),
+            "genome_size_file": genomon_conf.get("REFERENCE", "genome_size"),
+            "gaptxt": genomon_conf.get("REFERENCE", "gaptxt"),
+            "bait_file": genomon_conf.get("REFERENCE", "bait_file"),
+            "samtools_params": genomon_conf.get("qc_coverage", "samtools_params"),
+            "bedtools": genomon_conf.get("SOFTWARE", "bedtools"),
+            "samtools": genomon_conf.get("SOFTWARE", "samtools"),
+            "ld_library_path": genomon_conf.get("ENV", "LD_LIBRARY_PATH"),
+            "input_file": input_file,
+            "ref_cache": _ref_cache,
+            "output_file": output_file}
+
+
+def qc_merge_arguments(bamstats_file, coverage_file, output_file, sample_name):
+    return {"pythonhome": genomon_conf.get("ENV", "PYTHONHOME"),
+            "pythonpath": genomon_conf.get("ENV", "PYTHONPATH"),
+            "genomon_qc": genomon_conf.get("SOFTWARE", "genomon_qc"),
+            "bamstats_file": bamstats_file,
+            "coverage_file": coverage_file,
+            "output_file": output_file,
+            "meta": get_meta_info(["genomon_pipeline"]),
+            "fastq_line_num_file": run_conf.project_root +'/fastq/'+ sample_name +'/fastq_line_num.txt'}
+
+
+@active_if(not _group_qc)
 @follows( link_import_bam )
 @follows( markdup )
 @follows( filt_sv )
@@ -728,17 +1187,12 @@ def bam_stats(input_file, output_file):
     dir_name = os.path.dirname(output_file)
     sample_name = os.path.basename(dir_name)
     
-    arguments = {"pythonhome": genomon_conf.get("ENV", "PYTHONHOME"),
-                 "pythonpath": genomon_conf.get("ENV", "PYTHONPATH"),
-                 "genomon_qc": genomon_conf.get("SOFTWARE", "genomon_qc"),
-                 "bamstats": genomon_conf.get("SOFTWARE", "bamstats"),
-                 "perl5lib": genomon_conf.get("ENV", "PERL5LIB"),
-                 "input_file": input_file,
-                 "output_file": output_file}
+    arguments = qc_bamstats_arguments(input_file, output_file)
     
     r_qc_bamstats.task_exec(arguments, run_conf.project_root + '/log/' + sample_name, run_conf.project_root + '/script/' + sample_name)
 
 
+@active_if(not _group_qc)
 @follows( link_import_bam )
 @follows( markdup )
 @follows( filt_sv )
@@ -748,30 +1202,11 @@ def coverage(input_file, output_file):
     dir_name = os.path.dirname(output_file)
     sample_name = os.path.basename(dir_name)
     
-    data_type = "exome"
-    if genomon_conf.get("qc_coverage", "wgs_flag") == "True":
-        data_type = "wgs"
-
-    arguments = {"data_type": data_type,
-                 "pythonhome": genomon_conf.get("ENV", "PYTHONHOME"),
-                 "pythonpath": genomon_conf.get("ENV", "PYTHONPATH"),
-                 "genomon_qc": genomon_conf.get("SOFTWARE", "genomon_qc"),
-                 "coverage_text": genomon_conf.get("qc_coverage", "coverage"),
-                 "i_bed_lines": genomon_conf.get("qc_coverage", "wgs_i_bed_lines"),
-                 "i_bed_width": genomon_conf.get("qc_coverage", "wgs_i_bed_width"),
-                 "incl_bed_width":genomon_conf.get("qc_coverage", "wgs_incl_bed_width"),
-                 "genome_size_file": genomon_conf.get("REFERENCE", "genome_size"),
-                 "gaptxt": genomon_conf.get("REFERENCE", "gaptxt"),
-                 "bait_file": genomon_conf.get("REFERENCE", "bait_file"),
-                 "samtools_params": genomon_conf.get("qc_coverage", "samtools_params"),
-                 "bedtools": genomon_conf.get("SOFTWARE", "bedtools"),
-                 "samtools": genomon_conf.get("SOFTWARE", "samtools"),
-                 "ld_library_path": genomon_conf.get("ENV", "LD_LIBRARY_PATH"),
-                 "input_file": input_file,
-                 "output_file": output_file}
+    arguments = qc_coverage_arguments(input_file, output_file)
 
     r_qc_coverage.task_exec(arguments, run_conf.project_root + '/log/' + sample_name , run_conf.project_root + '/script/' + sample_name)
 
+@active_if(not _group_qc)
 @follows( bam_stats )
 @follows( coverage )
 @collate(qc_merge_list, formatter(), "{subpath[0][2]}/qc/{subdir[0][0]}/{subdir[0][0]}.genomonQC.result.txt")
@@ -780,100 +1215,120 @@ def merge_qc(input_files, output_file):
     dir_name = os.path.dirname(output_file)
     sample_name = os.path.basename(dir_name)
     
-    arguments = {"pythonhome": genomon_conf.get("ENV", "PYTHONHOME"),
-                 "pythonpath": genomon_conf.get("ENV", "PYTHONPATH"),
-                 "genomon_qc": genomon_conf.get("SOFTWARE", "genomon_qc"),
-                 "bamstats_file": input_files[0][0],
-                 "coverage_file": input_files[0][1],
-                 "output_file": output_file,
-                 "meta": get_meta_info(["genomon_pipeline"]),
-                 "fastq_line_num_file": run_conf.project_root +'/fastq/'+ sample_name +'/fastq_line_num.txt'}
+    arguments = qc_merge_arguments(input_files[0][0], input_files[0][1], output_file, sample_name)
     
     r_qc_merge.task_exec(arguments, run_conf.project_root + '/log/' + sample_name, run_conf.project_root + '/script/' + sample_name)
 
+# bamstats, coverage and merge of a sample in one job
+@active_if(_group_qc)
+@follows( link_import_bam )
+@follows( markdup )
+@follows( filt_sv )
+@follows( identify_mutations )
+@transform(qc_group_list, formatter(), "{subpath[0][2]}/qc/{subdir[0][0]}/{subdir[0][0]}.genomonQC.result.txt")
+def group_qc(input_file, output_file):
+
+    dir_name = os.path.dirname(output_file)
+    sample_name = os.path.basename(dir_name)
+    bamstats_file = dir_name + '/' + sample_name + '.bamstats'
+    coverage_file = dir_name + '/' + sample_name + '.coverage'
+
+    steps = []
+    if not os.path.exists(bamstats_file):
+        steps.append((r_qc_bamstats, qc_bamstats_arguments(input_file, bamstats_file)))
+    if not os.path.exists(coverage_file):
+        steps.append((r_qc_coverage, qc_coverage_arguments(input_file, coverage_file)))
+    steps.append((r_qc_merge, qc_merge_arguments(bamstats_file, coverage_file, output_file, sample_name)))
+
+    qc_group.group_exec(steps, run_conf.project_root + '/log/' + sample_name, run_conf.project_root + '/script/' + sample_name, dir_name + '/' + sample_name)
+
 #####################
 # post analysis stage
+def post_analysis_arguments(mode, input_file_cases):
+    return {"pythonhome": genomon_conf.get("ENV", "PYTHONHOME"),
+            "ld_library_path": genomon_conf.get("ENV", "LD_LIBRARY_PATH"),
+            "pythonpath": genomon_conf.get("ENV", "PYTHONPATH"),
+            "genomon_pa":  genomon_conf.get("SOFTWARE", "genomon_pa"),
+            "mode": mode,
+            "genomon_root": run_conf.project_root,
+            "output_dir": run_conf.project_root + "/post_analysis/" + sample_conf_name,
+            "sample_sheet": os.path.abspath(run_conf.sample_conf_file),
+            "config_file": genomon_conf.get("post_analysis", "config_file"),
+            "samtools": genomon_conf.get("SOFTWARE", "samtools"),
+            "bedtools": genomon_conf.get("SOFTWARE", "bedtools"),
+            "input_file_case1": input_file_cases[0],
+            "input_file_case2": input_file_cases[1],
+            "input_file_case3": input_file_cases[2],
+            "input_file_case4": input_file_cases[3],
+           }
+
+
+def post_analysis_cases(pa_outputs):
+    return [",".join(pa_outputs[case]["samples"]) for case in ["case1", "case2", "case3", "case4"]]
+
+
 @active_if(genomon_conf.getboolean("post_analysis", "enable"))
+@active_if(not _group_post_analysis)
 @active_if(len(pa_inputs_mutation) > 0)
 @follows(filt_sv)
 @follows(identify_mutations)
 @collate(pa_inputs_mutation, formatter(), pa_outputs_mutation["outputs"])
 def post_analysis_mutation(input_files, output_file):
         
-    arguments = {"pythonhome": genomon_conf.get("ENV", "PYTHONHOME"),
-                 "ld_library_path": genomon_conf.get("ENV", "LD_LIBRARY_PATH"),
-                 "pythonpath": genomon_conf.get("ENV", "PYTHONPATH"),
-                 "genomon_pa":  genomon_conf.get("SOFTWARE", "genomon_pa"),
-                 "mode": "mutation",
-                 "genomon_root": run_conf.project_root,
-                 "output_dir": run_conf.project_root + "/post_analysis/" + sample_conf_name,
-                 "sample_sheet": os.path.abspath(run_conf.sample_conf_file),
-                 "config_file": genomon_conf.get("post_analysis", "config_file"),
-                 "samtools": genomon_conf.get("SOFTWARE", "samtools"),
-                 "bedtools": genomon_conf.get("SOFTWARE", "bedtools"),
-                 "input_file_case1": ",".join(pa_outputs_mutation["case1"]["samples"]),
-                 "input_file_case2": ",".join(pa_outputs_mutation["case2"]["samples"]),
-                 "input_file_case3": ",".join(pa_outputs_mutation["case3"]["samples"]),
-                 "input_file_case4": ",".join(pa_outputs_mutation["case4"]["samples"]),
-                }
+    arguments = post_analysis_arguments("mutation", post_analysis_cases(pa_outputs_mutation))
 
     r_post_analysis.task_exec(arguments, run_conf.project_root + '/log/post_analysis', run_conf.project_root + '/script/post_analysis')
     
 @active_if(genomon_conf.getboolean("post_analysis", "enable"))
+@active_if(not _group_post_analysis)
 @active_if(len(pa_inputs_sv) > 0)
 @follows(filt_sv)
 @follows(identify_mutations)
 @collate(pa_inputs_sv, formatter(), pa_outputs_sv["outputs"])
 def post_analysis_sv(input_files, output_file):
 
-    arguments = {"pythonhome": genomon_conf.get("ENV", "PYTHONHOME"),
-                 "ld_library_path": genomon_conf.get("ENV", "LD_LIBRARY_PATH"),
-                 "pythonpath": genomon_conf.get("ENV", "PYTHONPATH"),
-                 "genomon_pa":  genomon_conf.get("SOFTWARE", "genomon_pa"),
-                 "mode": "sv",
-                 "genomon_root": run_conf.project_root,
-                 "output_dir": run_conf.project_root + "/post_analysis/" + sample_conf_name,
-                 "sample_sheet": os.path.abspath(run_conf.sample_conf_file),
-                 "config_file": genomon_conf.get("post_analysis", "config_file"),
-                 "samtools": genomon_conf.get("SOFTWARE", "samtools"),
-                 "bedtools": genomon_conf.get("SOFTWARE", "bedtools"),
-                 "input_file_case1": ",".join(pa_outputs_sv["case1"]["samples"]),
-                 "input_file_case2": ",".join(pa_outputs_sv["case2"]["samples"]),
-                 "input_file_case3": ",".join(pa_outputs_sv["case3"]["samples"]),
-                 "input_file_case4": ",".join(pa_outputs_sv["case4"]["samples"]),
-                }
+    arguments = post_analysis_arguments("sv", post_analysis_cases(pa_outputs_sv))
                  
     r_post_analysis.task_exec(arguments, run_conf.project_root + '/log/post_analysis', run_conf.project_root + '/script/post_analysis')
 
 @active_if(genomon_conf.getboolean("post_analysis", "enable"))
+@active_if(not _group_post_analysis)
 @active_if(len(pa_inputs_qc) > 0)
 @follows(merge_qc)
+@follows(group_qc)
 @collate(pa_inputs_qc, formatter(), pa_outputs_qc["outputs"])
 def post_analysis_qc(input_files, output_file):
 
-    arguments = {"pythonhome": genomon_conf.get("ENV", "PYTHONHOME"),
-                 "ld_library_path": genomon_conf.get("ENV", "LD_LIBRARY_PATH"),
-                 "pythonpath": genomon_conf.get("ENV", "PYTHONPATH"),
-                 "genomon_pa":  genomon_conf.get("SOFTWARE", "genomon_pa"),
-                 "mode": "qc",
-                 "genomon_root": run_conf.project_root,
-                 "output_dir": run_conf.project_root + "/post_analysis/" + sample_conf_name,
-                 "sample_sheet": os.path.abspath(run_conf.sample_conf_file),
-                 "config_file": genomon_conf.get("post_analysis", "config_file"),
-                 "samtools": genomon_conf.get("SOFTWARE", "samtools"),
-                 "bedtools": genomon_conf.get("SOFTWARE", "bedtools"),
-                 "input_file_case1": ",".join(sample_conf.qc),
-                 "input_file_case2": "",
-                 "input_file_case3": "",
-                 "input_file_case4": "",
-                }
+    arguments = post_analysis_arguments("qc", [",".join(sample_conf.qc), "", "", ""])
                  
     r_post_analysis.task_exec(arguments, run_conf.project_root + '/log/post_analysis', run_conf.project_root + '/script/post_analysis')
+
+# post analysis of every mode in one job
+@active_if(genomon_conf.getboolean("post_analysis", "enable"))
+@active_if(_group_post_analysis)
+@active_if(len(pa_inputs_group) > 0)
+@follows(filt_sv)
+@follows(identify_mutations)
+@follows(merge_qc)
+@follows(group_qc)
+@collate(pa_inputs_group, formatter(), pa_outputs_group)
+def group_post_analysis(input_files, output_file):
+
+    steps = []
+    if len(pa_inputs_mutation) > 0:
+        steps.append((r_post_analysis, post_analysis_arguments("mutation", post_analysis_cases(pa_outputs_mutation))))
+    if len(pa_inputs_sv) > 0:
+        steps.append((r_post_analysis, post_analysis_arguments("sv", post_analysis_cases(pa_outputs_sv))))
+    if len(pa_inputs_qc) > 0:
+        steps.append((r_post_analysis, post_analysis_arguments("qc", [",".join(sample_conf.qc), "", "", ""])))
+
+    post_analysis_group.group_exec(steps, run_conf.project_root + '/log/post_analysis', run_conf.project_root + '/script/post_analysis', run_conf.project_root + '/post_analysis/' + sample_conf_name)
     
 @active_if(genomon_conf.getboolean("post_analysis", "enable"))
 @active_if(genomon_conf.getboolean("pmsignature_ind", "enable") or genomon_conf.getboolean("pmsignature_full", "enable"))
 @active_if(len(pmsignature_inputs) > 0)
 @follows(post_analysis_mutation)
+@follows(group_post_analysis)
 @collate(pmsignature_inputs, formatter(), run_conf.project_root + '/pmsignature/' + sample_conf_name + "/mutation.cut.txt")
 def pre_pmsignature(input_files, output_file):
         
@@ -948,6 +1403,7 @@ def pmsignature_full(input_file, output_file):
 @active_if(len(paplot_inputs) > 0)
 @follows(post_analysis_sv)
 @follows(post_analysis_qc)
+@follows(group_post_analysis)
 @follows(pmsignature_ind)
 @follows(pmsignature_full)
 @collate(paplot_inputs, formatter(), run_conf.project_root + '/paplot/' + sample_conf_name + '/index.html')
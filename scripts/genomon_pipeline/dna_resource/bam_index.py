@@ -22,5 +22,5 @@ set -o pipefail
 {samtools} index {input_bam}
 """
 
-    def __init__(self, qsub_option, script_dir):
-        super(Bam_index, self).__init__(qsub_option, script_dir)
+    def __init__(self, qsub_option, script_dir, conf_section = None):
+        super(Bam_index, self).__init__(qsub_option, script_dir, conf_section)
@@ -21,48 +21,46 @@ set -o pipefail
 
 bams=( `echo "{input_bam}" | tr -s ';' ' '`)
 
+# a cram is decoded with the reference given explicitly
+input_format() {{
+    if [ "${{1##*.}}" = "cram" ]; then
+        echo "inputformat=cram reference={ref_fa}"
+    fi
+}}
+
 if [ ${{#bams[@]}} -eq 1 ]; then
     bam=${{bams[0]}}
     echo $bam
-    {biobambam}/bamtofastq {param} filename=${{bam}} F={f1_name} F2={f2_name} T={t} S={s} O={o1_name} O2={o2_name} || exit $?    
+    {biobambam}/bamtofastq {param} `input_format ${{bam}}` filename=${{bam}} F={f1_name} F2={f2_name} T={t} S={s} O={o1_name} O2={o2_name} || exit $?    
 
 else
-    echo -n > {f1_name}
-    echo -n > {f2_name}
-    echo -n > {t}
-    echo -n > {s}
-    echo -n > {o1_name}
-    echo -n > {o2_name}
-
-    for bam in ${{bams[@]}}; do
+    # the bam of a task is converted into its own fastq ({{task id}}_1.fastq and {{task id}}_2.fastq),
+    # which the splitter reads in order
+    convert() {{
+        bam=${{bams[`expr $1 - 1`]}}
         echo $bam
-        {biobambam}/bamtofastq {param} filename=${{bam}} F={f1_name}.tmp F2={f2_name}.tmp T={t}.tmp S={s}.tmp O={o1_name}.tmp O2={o2_name}.tmp || exit $?
-        cat {f1_name}.tmp >> {f1_name} || exit $?
-        cat {f2_name}.tmp >> {f2_name} || exit $?
-        if [ -s {t}.tmp ]; then
-            cat {t}.tmp >> {t} || exit $?
-        fi
-        if [ -s {s}.tmp ]; then
-            cat {s}.tmp >> {s} || exit $?
-        fi
-        if [ -s {o1_name}.tmp ]; then
-            cat {o1_name}.tmp >> {o1_name} || exit $?
-        fi
-        if [ -s {o2_name}.tmp ]; then
-            cat {o2_name}.tmp >> {o2_name} || exit $?
-        fi
-        rm {f1_name}.tmp
-        rm {f2_name}.tmp
-        rm {t}.tmp
-        rm {s}.tmp
-        rm {o1_name}.tmp
-        rm {o2_name}.tmp
-    done
+        {biobambam}/bamtofastq {param} `input_format ${{bam}}` filename=${{bam}} F={output_dir}/$1_1.fastq F2={output_dir}/$1_2.fastq T={output_dir}/$1_temp.txt S={output_dir}/$1_single_end_output.txt O={output_dir}/$1_unmatched_first_output.txt O2={output_dir}/$1_unmatched_second_output.txt
+    }}
+
+    if [ "_${{SGE_TASK_ID}}" != "_undefined" -a "_${{SGE_TASK_ID}}" != "_" ]; then
+        # a task of the array job
+        convert ${{SGE_TASK_ID}} || exit $?
+    else
+        # a single job (rna) converts the bams in order into one fastq
+        : > {f1_name} || exit $?
+        : > {f2_name} || exit $?
+        for i in `seq 1 ${{#bams[@]}}`; do
+            convert ${{i}} || exit $?
+            cat {output_dir}/${{i}}_1.fastq >> {f1_name} || exit $?
+            cat {output_dir}/${{i}}_2.fastq >> {f2_name} || exit $?
+            rm -f {output_dir}/${{i}}_1.fastq {output_dir}/${{i}}_2.fastq
+        done
+    fi
 fi
 
 """
 
-    def __init__(self, qsub_option, script_dir):
-        super(Bam2Fastq, self).__init__(qsub_option, script_dir)
+    def __init__(self, qsub_option, script_dir, conf_section = None):
+        super(Bam2Fastq, self).__init__(qsub_option, script_dir, conf_section)
 
 
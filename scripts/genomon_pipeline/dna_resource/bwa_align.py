@@ -19,16 +19,132 @@ date                    # print date
 set -xv
 set -o pipefail
 
-tmp_num=`expr ${{SGE_TASK_ID}} - 1`
-num=`printf "%04d" ${{tmp_num}}`
+# a task aligns {chunks_per_job} chunks with the same loaded index
+tmp_task=`expr ${{SGE_TASK_ID}} - 1`
+first_chunk=`expr ${{tmp_task}} \\* {chunks_per_job}`
+last_chunk=`expr ${{first_chunk}} + {chunks_per_job} - 1`
+if [ ${{last_chunk}} -ge {chunk_num} ]; then
+    last_chunk=`expr {chunk_num} - 1`
+fi
 
-{bwa} mem {bwa_params} {ref_fa} {input_dir}/1_${{num}}.fastq_split {input_dir}/2_${{num}}.fastq_split > {output_dir}/{sample_name}_${{num}}.bwa.sam || exit $?
+index_key=`echo {ref_fa} | md5sum | cut -c 1-16`
+# every task using the index in the shared memory has an entry (its pid) in shm_users
+shm_users=/dev/shm/genomon_bwa_${{index_key}}.users
+shm_lock=/dev/shm/genomon_bwa_${{index_key}}.lock
+shm_loaded=""
+chunk_dir=""
+reader1=""
+reader2=""
 
-{biobambam}/bamsort index=1 level=1 inputthreads=2 outputthreads=2 calmdnm=1 calmdnmrecompindentonly=1 calmdnmreference={ref_fa} tmpfile={output_dir}/{sample_name}_${{num}}.sorted.bam.tmp inputformat=sam indexfilename={output_dir}/{sample_name}_${{num}}.sorted.bam.bai I={output_dir}/{sample_name}_${{num}}.bwa.sam O={output_dir}/{sample_name}_${{num}}.sorted.bam
+# the entries of the tasks killed without the trap (SIGKILL by the scheduler) are removed by the next task
+drop_stale_users() {{
+    for user in `ls ${{shm_users}}`; do
+        if ! kill -0 ${{user}} 2> /dev/null; then
+            rm -f ${{shm_users}}/${{user}}
+        fi
+    done
+}}
 
-"""
+cleanup() {{
+    if [ "_${{reader1}}" != "_" ]; then
+        kill ${{reader1}} ${{reader2}} 2> /dev/null
+    fi
+    if [ "_${{chunk_dir}}" != "_" ]; then
+        rm -rf ${{chunk_dir}}
+    fi
+    # the index in the shared memory is dropped by the last task on the node
+    if [ "_${{shm_loaded}}" != "_" ]; then
+        (
+            flock 9
+            rm -f ${{shm_users}}/$$
+            drop_stale_users
+            if [ -z "`ls -A ${{shm_users}}`" ]; then
+                {bwa} shm -d
+            fi
+        ) 9> ${{shm_lock}}
+    fi
+}}
+trap cleanup EXIT
+
+bwa_ref={ref_fa}
+if [ _{index_stage} = "_local" ]; then
+    # the index is copied once to the local disk of the node
+    index_dir={local_index_dir}/${{index_key}}
+    mkdir -p ${{index_dir}} || exit $?
+    (
+        flock 9
+        for ext in amb ann bwt pac sa alt; do
+            if [ ${{ext}} = "alt" -a ! -f {ref_fa}.alt ]; then
+                # bwa mem is alt-aware only with the .alt file next to the index
+                rm -f ${{index_dir}}/ref.alt
+                continue
+            fi
+            if [ ! -f ${{index_dir}}/ref.${{ext}} -o {ref_fa}.${{ext}} -nt ${{index_dir}}/ref.${{ext}} ]; then
+                cp {ref_fa}.${{ext}} ${{index_dir}}/ref.${{ext}}.tmp && mv ${{index_dir}}/ref.${{ext}}.tmp ${{index_dir}}/ref.${{ext}} || exit 1
+            fi
+        done
+    ) 9> ${{index_dir}}/.lock || exit $?
+    bwa_ref=${{index_dir}}/ref
+elif [ _{index_stage} = "_shm" ]; then
+    # the index is loaded once into the shared memory of the node (bwa mem finds it by the name of ref_fasta)
+    (
+        flock 9
+        mkdir -p ${{shm_users}} || exit 1
+        drop_stale_users
+        if ! {bwa} shm -l 2> /dev/null | cut -f 1 | grep -qx `basename {ref_fa}`; then
+            {bwa} shm {ref_fa} || exit 1
+        fi
+        echo ${{JOB_ID}}.${{SGE_TASK_ID}} > ${{shm_users}}/$$
+    ) 9> ${{shm_lock}} || exit $?
+    shm_loaded=True
+fi
+
+for tmp_num in `seq ${{first_chunk}} ${{last_chunk}}`; do
+    num=`printf "%04d" ${{tmp_num}}`
+
+    fastq1={input_dir}/1_${{num}}.fastq_split
+    fastq2={input_dir}/2_${{num}}.fastq_split
+    if [ _{virtual_chunk} = "_True" ]; then
+        # the chunk is read from the original fastq at the offset in the chunk index (no split files)
+        chunk_dir=`mktemp -d {output_dir}/{sample_name}_${{num}}.chunk.XXXXXX` || exit $?
+        fastq1=${{chunk_dir}}/1.fastq
+        fastq2=${{chunk_dir}}/2.fastq
+        mkfifo ${{fastq1}} ${{fastq2}} || exit $?
+        {python} {fastq_chunk} read {input_dir}/1.fastq_chunk_index ${{tmp_num}} > ${{fastq1}} &
+        reader1=$!
+        {python} {fastq_chunk} read {input_dir}/2.fastq_chunk_index ${{tmp_num}} > ${{fastq2}} &
+        reader2=$!
+    fi
+
+    if [ _{stream_sort} = "_True" ]; then
+        # bwa mem is piped into bamsort without the intermediate sam (pipefail catches the failure of bwa mem)
+        sort_tmp_dir={sort_tmp_dir}
+        if [ "_${{sort_tmp_dir}}" = "_" ]; then
+            sort_tmp_dir={output_dir}
+        fi
+        mkdir -p ${{sort_tmp_dir}} || exit $?
 
-    def __init__(self, qsub_option, script_dir):
-        super(Bwa_align, self).__init__(qsub_option, script_dir)
+        {bwa} mem {bwa_params} {read_group} ${{bwa_ref}} ${{fastq1}} ${{fastq2}} | \\
+        {biobambam}/bamsort index=1 level=1 inputthreads={sort_threads} outputthreads={sort_threads} calmdnm=1 calmdnmrecompindentonly=1 calmdnmreference={ref_fa} tmpfile=${{sort_tmp_dir}}/{sample_name}_${{num}}.sorted.bam.tmp inputformat=sam indexfilename={output_dir}/{sample_name}_${{num}}.sorted.bam.bai O={output_dir}/{sample_name}_${{num}}.sorted.bam || exit $?
+    else
+        {bwa} mem {bwa_params} {read_group} ${{bwa_ref}} ${{fastq1}} ${{fastq2}} > {output_dir}/{sample_name}_${{num}}.bwa.sam || exit $?
+
+        {biobambam}/bamsort index=1 level=1 inputthreads={sort_threads} outputthreads={sort_threads} calmdnm=1 calmdnmrecompindentonly=1 calmdnmreference={ref_fa} tmpfile={output_dir}/{sample_name}_${{num}}.sorted.bam.tmp inputformat=sam indexfilename={output_dir}/{sample_name}_${{num}}.sorted.bam.bai I={output_dir}/{sample_name}_${{num}}.bwa.sam O={output_dir}/{sample_name}_${{num}}.sorted.bam || exit $?
+    fi
+
+    if [ _{virtual_chunk} = "_True" ]; then
+        # the readers fail when the chunk does not match the index
+        wait ${{reader1}} || exit $?
+        wait ${{reader2}} || exit $?
+        reader1=""
+        reader2=""
+        rm -rf ${{chunk_dir}}
+        chunk_dir=""
+    fi
+done
+
+"""
 
+    def __init__(self, qsub_option, script_dir, conf_section = None):
+        super(Bwa_align, self).__init__(qsub_option, script_dir, conf_section)
 
@@ -0,0 +1,49 @@
+#! /usr/bin/env python
+
+from genomon_pipeline.stage_task import *
+
+class Fastq_chunk_index(Stage_task):
+
+    task_name = "fastq_chunk_index"
+
+    script_template = """
+#!/bin/bash
+#
+# Set SGE
+#
+#$ -S /bin/bash         # set shell in UGE
+#$ -cwd                 # execute at the submitted dir
+pwd                     # print current working directory
+hostname                # print hostname
+date                    # print date
+set -xv
+set -o pipefail
+
+to_val=`ls {target_dir}/*_${{SGE_TASK_ID}}{ext} | wc -l`
+input_files=""
+for i in `seq 1 ${{to_val}}`; do
+    input_files="${{input_files}} {target_dir}/${{i}}_${{SGE_TASK_ID}}{ext}"
+done    
+
+# the gzip fastq without BGZF blocks is recompressed once to BGZF (decompressed to a plain fastq only without bgzip)
+index_options="--threads {threads}"
+if [ -x {htslib}/bgzip ]; then
+    index_options="${{index_options}} --bgzip {htslib}/bgzip"
+else
+    index_options="${{index_options}} --spill_plain"
+fi
+if [ "_{pigz}" != "_" ]; then
+    index_options="${{index_options}} --pigz {pigz}"
+fi
+
+if [ "_{fastq_filter}" = "_True" ]; then
+    {python} {fastq_chunk} index --lines {lines} --fastq_filter ${{index_options}} {target_dir}/${{SGE_TASK_ID}}.fastq_chunk_index $input_files || exit $?
+else
+    {python} {fastq_chunk} index --lines {lines} ${{index_options}} {target_dir}/${{SGE_TASK_ID}}.fastq_chunk_index $input_files || exit $?
+fi
+
+"""
+
+    def __init__(self, qsub_option, script_dir, conf_section = None):
+        super(Fastq_chunk_index, self).__init__(qsub_option, script_dir, conf_section)
+
@@ -0,0 +1,53 @@
+#! /usr/bin/env python
+
+from genomon_pipeline.stage_task import *
+from genomon_pipeline.dna_resource.fastq_splitter import read_command_template
+
+class Fastq_pair_splitter(Stage_task):
+
+    task_name = "fastq_pair_splitter"
+
+    script_template = """
+#!/bin/bash
+#
+# Set SGE
+#
+#$ -S /bin/bash         # set shell in UGE
+#$ -cwd                 # execute at the submitted dir
+pwd                     # print current working directory
+hostname                # print hostname
+date                    # print date
+set -xv
+set -o pipefail
+
+to_val=`ls {target_dir}/*_1{ext} | wc -l`
+input_files1=""
+input_files2=""
+for i in `seq 1 ${{to_val}}`; do
+    input_files1="${{input_files1}} {target_dir}/${{i}}_1{ext}"
+    input_files2="${{input_files2}} {target_dir}/${{i}}_2{ext}"
+done
+""" + read_command_template + """
+# read 1 and read 2 are read in lockstep through the fifos
+fifo_dir=`mktemp -d {target_dir}/fastq_pair_split.XXXXXX` || exit $?
+mkfifo ${{fifo_dir}}/1.fastq ${{fifo_dir}}/2.fastq || exit $?
+${{read_command}} $input_files1 > ${{fifo_dir}}/1.fastq &
+reader1=$!
+${{read_command}} $input_files2 > ${{fifo_dir}}/2.fastq &
+reader2=$!
+trap "kill ${{reader1}} ${{reader2}} 2> /dev/null; rm -rf ${{fifo_dir}}" EXIT
+
+if [ "_{fastq_filter}" = "_True" ]; then
+    {python} {fastq_pair_split} --lines {lines} --fastq_filter {target_dir} ${{fifo_dir}}/1.fastq ${{fifo_dir}}/2.fastq || exit $?
+else
+    {python} {fastq_pair_split} --lines {lines} {target_dir} ${{fifo_dir}}/1.fastq ${{fifo_dir}}/2.fastq || exit $?
+fi
+
+wait ${{reader1}} || exit $?
+wait ${{reader2}} || exit $?
+
+"""
+
+    def __init__(self, qsub_option, script_dir, conf_section = None):
+        super(Fastq_pair_splitter, self).__init__(qsub_option, script_dir, conf_section)
+
@@ -1,7 +1,71 @@
 #! /usr/bin/env python
 
+import os
+import zlib
 from genomon_pipeline.stage_task import *
 
+sample_size = 4 * 1024 * 1024
+
+# shell function reading the input fastq of the splitters (${read_command} file ...)
+read_command_template = """
+# decompress the files in order into one stream
+# BGZF files are decompressed by the threads of bgzip, the other gzip files by pigz
+decompress() {{
+    for input_file in "$@"; do
+        if [ {threads} -gt 1 -a -x {htslib}/bgzip -a "`head -c 16 ${{input_file}} | tail -c 4 | od -An -tx1 | tr -d ' '`" = "42430200" ]; then
+            {htslib}/bgzip -@ {threads} -dc ${{input_file}} || return $?
+        elif [ {threads} -gt 1 -a "_{pigz}" != "_" ]; then
+            {pigz} -p {threads} -dc ${{input_file}} || return $?
+        else
+            gzip -dc ${{input_file}} || return $?
+        fi
+    done
+}}
+
+if [ "_{ext}" = "_.gz" ]; then
+    read_command=decompress
+else
+    read_command=cat
+fi
+"""
+
+def estimate_line_num(input_files):
+    """
+    estimate the lines of the fastq from the file sizes and the lines in the first block of each file
+    """
+    line_num = 0
+    for input_file in input_files:
+        file_size = os.path.getsize(input_file)
+        if file_size == 0: continue
+        with open(input_file, 'rb') as in_handle:
+            block = in_handle.read(sample_size)
+        if block[0:2] == b'\x1f\x8b':
+            # lines per compressed byte (a decompressor is restarted at the member boundaries of BGZF)
+            lines = 0
+            data = block
+            while data:
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                try:
+                    lines += decompressor.decompress(data).count(b'\n')
+                except zlib.error:
+                    break
+                data = decompressor.unused_data
+        else:
+            lines = block.count(b'\n')
+        line_num += int(lines * float(file_size) / len(block))
+    return line_num
+
+
+def auto_split_lines(input_files, target_chunks, min_lines, max_lines):
+    """
+    lines of a chunk (a multiple of 4) for splitting the fastq into about target_chunks chunks
+    """
+    line_num = estimate_line_num(input_files)
+    lines = (line_num + target_chunks - 1) / target_chunks
+    lines = max(min_lines, min(max_lines, lines))
+    return max(4, (lines + 3) / 4 * 4)
+
+
 class Fastq_splitter(Stage_task):
 
     task_name = "fastq_splitter"
@@ -24,20 +88,11 @@ input_files=""
 for i in `seq 1 ${{to_val}}`; do
     input_files="${{input_files}} {target_dir}/${{i}}_${{SGE_TASK_ID}}{ext}"
 done    
-
+""" + read_command_template + """
 if [ "_{fastq_filter}" = "_True" ]; then
-
-    if [ "_{ext}" = "_.gz" ]; then
-        gzip -dc $input_files | grep -A 3 '^@.* [^:]*:N:[^:]*:' | grep -v '^--$' | split -a 4 -d -l {lines} - {target_dir}/${{SGE_TASK_ID}}_ || exit $?
-    else
-        cat $input_files | grep -A 3 '^@.* [^:]*:N:[^:]*:' | grep -v '^--$' | split -a 4 -d -l {lines} - {target_dir}/${{SGE_TASK_ID}}_ || exit $?
-    fi
+    ${{read_command}} $input_files | grep -A 3 '^@.* [^:]*:N:[^:]*:' | grep -v '^--$' | split -a 4 -d -l {lines} - {target_dir}/${{SGE_TASK_ID}}_ || exit $?
 else
-    if [ "_{ext}" = "_.gz" ]; then
-        gzip -dc $input_files | split -a 4 -d -l {lines} - {target_dir}/${{SGE_TASK_ID}}_ || exit $?
-    else
-        cat $input_files | split -a 4 -d -l {lines} - {target_dir}/${{SGE_TASK_ID}}_ || exit $?
-    fi
+    ${{read_command}} $input_files | split -a 4 -d -l {lines} - {target_dir}/${{SGE_TASK_ID}}_ || exit $?
 fi
 
 ls -1 {target_dir}/${{SGE_TASK_ID}}_[0-9][0-9][0-9][0-9] | while read filename; do
@@ -47,7 +102,7 @@ done
 
 """
 
-    def __init__(self, qsub_option, script_dir):
-        super(Fastq_splitter, self).__init__(qsub_option, script_dir)
+    def __init__(self, qsub_option, script_dir, conf_section = None):
+        super(Fastq_splitter, self).__init__(qsub_option, script_dir, conf_section)
 
 
@@ -19,12 +19,59 @@ date                    # print date
 set -xv
 set -o pipefail
 
-{biobambam}/bammarkduplicates M={out_prefix}.metrics tmpfile={out_prefix}.tmp markthreads=2 rewritebam=1 rewritebamlevel=1 index=1 md5=1 {input_bam_files} O={out_bam}
+inputs=( {input_bams} )
+
+# hierarchical merge: the chunk bams are merged by fan_in bams at a time until fan_in bams are left,
+# so bammarkduplicates does not open hundreds of bams at once
+level=0
+while [ {fan_in} -gt 1 -a ${{#inputs[@]}} -gt {fan_in} ]; do
+    merged=()
+    for ((i = 0; i < ${{#inputs[@]}}; i += {fan_in})); do
+        merged_bam={out_prefix}.merge_${{level}}_${{i}}.bam
+        merge_inputs=""
+        for input_bam in "${{inputs[@]:i:{fan_in}}}"; do
+            merge_inputs="${{merge_inputs}} I=${{input_bam}}"
+        done
+        {biobambam}/bammerge ${{merge_inputs}} level=1 tmpfile=${{merged_bam}}.tmp > ${{merged_bam}} || exit $?
+        merged+=(${{merged_bam}})
+    done
+    # the merged bams of the previous level (the chunk bams are removed by the pipeline)
+    if [ ${{level}} -gt 0 ]; then
+        rm -f "${{inputs[@]}}"
+    fi
+    inputs=("${{merged[@]}}")
+    level=`expr ${{level}} + 1`
+done
+
+input_bam_files=""
+for input_bam in "${{inputs[@]}}"; do
+    input_bam_files="${{input_bam_files}} I=${{input_bam}}"
+done
+
+if [ _{cram} = "_True" ]; then
+    # the marked reads are streamed uncompressed into the cram writer without the intermediate bam
+    {biobambam}/bammarkduplicates M={out_prefix}.metrics tmpfile={out_prefix}.tmp markthreads={mark_threads} rewritebam=1 rewritebamlevel=1 level=0 ${{input_bam_files}} | \
+    {samtools} view -@ {mark_threads} -C -T {ref_fa} -o {out_prefix}.cram.tmp - || exit $?
+
+    # the reference is written in the UR of the @SQ lines, so the readers of the cram find it without any option
+    # (reheader rewrites only the header and copies the containers)
+    {samtools} view -H {out_prefix}.cram.tmp | awk -v ur="UR:file:{ref_fa}" '/^@SQ/ && !/\tUR:/ {{print $0 "\t" ur; next}} {{print}}' > {out_prefix}.cram.header || exit $?
+    {samtools} reheader {out_prefix}.cram.header {out_prefix}.cram.tmp > {out_prefix}.cram || exit $?
+    rm -f {out_prefix}.cram.tmp {out_prefix}.cram.header
+    {samtools} index {out_prefix}.cram || exit $?
+    md5sum {out_prefix}.cram | cut -d ' ' -f 1 > {out_prefix}.cram.md5 || exit $?
+else
+    {biobambam}/bammarkduplicates M={out_prefix}.metrics tmpfile={out_prefix}.tmp markthreads={mark_threads} rewritebam=1 rewritebamlevel=1 index=1 md5=1 ${{input_bam_files}} O={out_prefix}.bam || exit $?
+fi
+
+if [ ${{level}} -gt 0 ]; then
+    rm -f "${{inputs[@]}}"
+fi
 
 
 """
 
-    def __init__(self, qsub_option, script_dir):
-        super(Markduplicates, self).__init__(qsub_option, script_dir)
+    def __init__(self, qsub_option, script_dir, conf_section = None):
+        super(Markduplicates, self).__init__(qsub_option, script_dir, conf_section)
 
 
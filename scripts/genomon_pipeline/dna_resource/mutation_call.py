@@ -23,90 +23,154 @@ samtools_home={samtools}
 export PATH=${{samtools_home%/*}}:$PYTHONHOME/bin:$PATH
 export LD_LIBRARY_PATH={ld_library_path}
 export PYTHONPATH={pythonpath}
+""" + cram_reference_template + """
+# a line of the interval list, or a shard of the shard manifest (span<TAB>regions<TAB>cost)
+SHARD=`head -n $SGE_TASK_ID {region_list} | tail -n 1`
+REGION=`echo "${{SHARD}}" | cut -f 1`
+REGIONS=`echo "${{SHARD}}" | cut -f 2 | tr "," " "`
+
+# the intermediate results of the filters are written to the scratch directory of the node (or next to the result)
+work_prefix={out_prefix}
+if [ "_{scratch_dir}" != "_" ]; then
+    mkdir -p {scratch_dir} || exit $?
+    work_dir=`mktemp -d {scratch_dir}/mutation_call.XXXXXX` || exit $?
+    trap "rm -rf ${{work_dir}}" EXIT
+    work_prefix=${{work_dir}}/`basename {out_prefix}`
+fi
 
-REGION=`head -n $SGE_TASK_ID {interval_list} | tail -n 1`
+call_fisher() {{
+    # the results of the regions of a shard are concatenated in the order of the regions
+    : > ${{work_prefix}}.fisher_mutations.${{SGE_TASK_ID}}.txt || return $?
+    for region in ${{REGIONS}}; do
+        {fisher} "$@" -R ${{region}} -o ${{work_prefix}}.fisher_mutations.${{SGE_TASK_ID}}.region.txt || return $?
+        cat ${{work_prefix}}.fisher_mutations.${{SGE_TASK_ID}}.region.txt >> ${{work_prefix}}.fisher_mutations.${{SGE_TASK_ID}}.txt || return $?
+    done
+    rm -f ${{work_prefix}}.fisher_mutations.${{SGE_TASK_ID}}.region.txt
+}}
 
 if [ _{control_bam} = "_None" ]; then 
-    {fisher} single -R ${{REGION}} -o {out_prefix}.fisher_mutations.${{SGE_TASK_ID}}.txt --ref_fa {ref_fa} -1 {disease_bam} --samtools_path {samtools} {fisher_single_params} || exit $?
+    call_fisher single --ref_fa {ref_fa} -1 {disease_bam} --samtools_path {samtools} {fisher_single_params} || exit $?
 
-    {mutfilter} realignment --target_mutation_file {out_prefix}.fisher_mutations.${{SGE_TASK_ID}}.txt -1 {disease_bam} --output {out_prefix}.realignment_mutations.${{SGE_TASK_ID}}.txt --ref_genome {ref_fa} --blat_path {blat} {realignment_params} || exit $?
+    {mutfilter} realignment --target_mutation_file ${{work_prefix}}.fisher_mutations.${{SGE_TASK_ID}}.txt -1 {disease_bam} --output ${{work_prefix}}.realignment_mutations.${{SGE_TASK_ID}}.txt --ref_genome {ref_fa} --blat_path {blat} {realignment_params} || exit $?
 
-    {mutfilter} simplerepeat --target_mutation_file {out_prefix}.realignment_mutations.${{SGE_TASK_ID}}.txt --output {out_prefix}.simplerepeat_mutations.${{SGE_TASK_ID}}.txt --simple_repeat_db {simple_repeat_db} || exit $?
+    {mutfilter} simplerepeat --target_mutation_file ${{work_prefix}}.realignment_mutations.${{SGE_TASK_ID}}.txt --output ${{work_prefix}}.simplerepeat_mutations.${{SGE_TASK_ID}}.txt --simple_repeat_db {simple_repeat_db} || exit $?
 
 else
-    {fisher} comparison -R ${{REGION}} -o {out_prefix}.fisher_mutations.${{SGE_TASK_ID}}.txt --ref_fa {ref_fa} -2 {control_bam} -1 {disease_bam} --samtools_path {samtools} {fisher_pair_params} || exit $?
+    call_fisher comparison --ref_fa {ref_fa} -2 {control_bam} -1 {disease_bam} --samtools_path {samtools} {fisher_pair_params} || exit $?
 
-    realignment_input={out_prefix}.fisher_mutations.${{SGE_TASK_ID}}.txt
+    realignment_input=${{work_prefix}}.fisher_mutations.${{SGE_TASK_ID}}.txt
 
     if [ _{active_hotspot_flag} = "_True" ]; then 
 
-        {hotspot} {hotspot_params} {disease_bam} {control_bam} {out_prefix}.hotspot_mutations.${{SGE_TASK_ID}}.txt {hotspot_database}.${{SGE_TASK_ID}} || exit $?
+        {hotspot} {hotspot_params} {disease_bam} {control_bam} ${{work_prefix}}.hotspot_mutations.${{SGE_TASK_ID}}.txt {hotspot_database}.${{SGE_TASK_ID}} || exit $?
 
-        {mutil} merge_hotspot -i {out_prefix}.hotspot_mutations.${{SGE_TASK_ID}}.txt -f {out_prefix}.fisher_mutations.${{SGE_TASK_ID}}.txt -o {out_prefix}.fisher_hotspot_mutations.${{SGE_TASK_ID}}.txt --hotspot_header || exit $?
+        {mutil} merge_hotspot -i ${{work_prefix}}.hotspot_mutations.${{SGE_TASK_ID}}.txt -f ${{work_prefix}}.fisher_mutations.${{SGE_TASK_ID}}.txt -o ${{work_prefix}}.fisher_hotspot_mutations.${{SGE_TASK_ID}}.txt --hotspot_header || exit $?
 
-        realignment_input={out_prefix}.fisher_hotspot_mutations.${{SGE_TASK_ID}}.txt
+        realignment_input=${{work_prefix}}.fisher_hotspot_mutations.${{SGE_TASK_ID}}.txt
 
     fi
 
-    {mutfilter} realignment --target_mutation_file ${{realignment_input}} -1 {disease_bam} -2 {control_bam} --output {out_prefix}.realignment_mutations.${{SGE_TASK_ID}}.txt --ref_genome {ref_fa} --blat_path {blat} {realignment_params} || exit $?
+    {mutfilter} realignment --target_mutation_file ${{realignment_input}} -1 {disease_bam} -2 {control_bam} --output ${{work_prefix}}.realignment_mutations.${{SGE_TASK_ID}}.txt --ref_genome {ref_fa} --blat_path {blat} {realignment_params} || exit $?
 
-    {mutfilter} indel --target_mutation_file {out_prefix}.realignment_mutations.${{SGE_TASK_ID}}.txt -2 {control_bam} --output {out_prefix}.indel_mutations.${{SGE_TASK_ID}}.txt --samtools_path {samtools} {indel_params} || exit $?
+    {mutfilter} indel --target_mutation_file ${{work_prefix}}.realignment_mutations.${{SGE_TASK_ID}}.txt -2 {control_bam} --output ${{work_prefix}}.indel_mutations.${{SGE_TASK_ID}}.txt --samtools_path {samtools} {indel_params} || exit $?
 
-    {mutfilter} breakpoint --target_mutation_file {out_prefix}.indel_mutations.${{SGE_TASK_ID}}.txt -2 {control_bam} --output {out_prefix}.breakpoint_mutations.${{SGE_TASK_ID}}.txt {breakpoint_params} || exit $?
+    {mutfilter} breakpoint --target_mutation_file ${{work_prefix}}.indel_mutations.${{SGE_TASK_ID}}.txt -2 {control_bam} --output ${{work_prefix}}.breakpoint_mutations.${{SGE_TASK_ID}}.txt {breakpoint_params} || exit $?
 
-    {mutfilter} simplerepeat --target_mutation_file {out_prefix}.breakpoint_mutations.${{SGE_TASK_ID}}.txt --output {out_prefix}.simplerepeat_mutations.${{SGE_TASK_ID}}.txt --simple_repeat_db {simple_repeat_db} || exit $?
+    {mutfilter} simplerepeat --target_mutation_file ${{work_prefix}}.breakpoint_mutations.${{SGE_TASK_ID}}.txt --output ${{work_prefix}}.simplerepeat_mutations.${{SGE_TASK_ID}}.txt --simple_repeat_db {simple_repeat_db} || exit $?
 fi
 
 if [ _{control_bam_list} != "_None" ]; then 
-    {EBFilter} --loption --region ${{REGION}} -f anno -q {eb_map_quality} -Q {eb_base_quality} --ff {filter_flags} {out_prefix}.simplerepeat_mutations.${{SGE_TASK_ID}}.txt {disease_bam} {control_bam_list} {out_prefix}.ebfilter_mutations.${{SGE_TASK_ID}}.txt || exit $?
+    {EBFilter} --loption --region ${{REGION}} -f anno -q {eb_map_quality} -Q {eb_base_quality} --ff {filter_flags} ${{work_prefix}}.simplerepeat_mutations.${{SGE_TASK_ID}}.txt {disease_bam} {control_bam_list} ${{work_prefix}}.ebfilter_mutations.${{SGE_TASK_ID}}.txt || exit $?
+    anno_input=${{work_prefix}}.ebfilter_mutations.${{SGE_TASK_ID}}.txt
 else
-    cp {out_prefix}.simplerepeat_mutations.${{SGE_TASK_ID}}.txt {out_prefix}.ebfilter_mutations.${{SGE_TASK_ID}}.txt
+    anno_input=${{work_prefix}}.simplerepeat_mutations.${{SGE_TASK_ID}}.txt
 fi
 
+# the annotation databases are copied once to the local disk of the node and shared by the tasks on the node
+# (the least recently used databases are removed over local_db_max_size [GB])
+stage_database() {{
+    local db_dir={local_db_dir}/`echo $1 | md5sum | cut -c 1-16`
+    local name=`basename $1`
+
+    # the shared lock keeps the database from the eviction until the annotation ends (annotate closes staged_fd)
+    mkdir -p {local_db_dir} || return $?
+    exec {{staged_fd}}>> ${{db_dir}}.lock || return $?
+    flock -s ${{staged_fd}} || {{ exec {{staged_fd}}>&-; return 1; }}
+    (
+        flock 9
+        mkdir -p ${{db_dir}} || exit 1
+        for ext in "" .tbi; do
+            if [ ! -f ${{db_dir}}/${{name}}${{ext}} -o $1${{ext}} -nt ${{db_dir}}/${{name}}${{ext}} ]; then
+                cp $1${{ext}} ${{db_dir}}/${{name}}${{ext}}.tmp && mv ${{db_dir}}/${{name}}${{ext}}.tmp ${{db_dir}}/${{name}}${{ext}} || exit 1
+            fi
+        done
+        touch ${{db_dir}}
+    ) 9> ${{db_dir}}.stage.lock || {{ exec {{staged_fd}}>&-; return 1; }}
+
+    if [ {local_db_max_size} -gt 0 ]; then
+        for old_dir in `ls -dtr {local_db_dir}/*/`; do
+            if [ `du -smL {local_db_dir} | cut -f 1` -le `expr {local_db_max_size} \* 1024` ]; then
+                break
+            fi
+            old_dir=${{old_dir%/}}
+            flock -n -x ${{old_dir}}.lock rm -rf ${{old_dir}}
+        done
+    fi
+
+    staged_database=${{db_dir}}/${{name}}
+}}
+
+# only the enabled annotations are chained (a disabled annotation is skipped without a copy of the mutations)
+annotate() {{
+    local database=$2
+    local status
+    if [ "_{local_db_dir}" != "_" ]; then
+        stage_database ${{database}} || return $?
+        database=${{staged_database}}
+    fi
+    {mutanno} mutation -t ${{anno_input}} -o ${{work_prefix}}.$1.${{SGE_TASK_ID}}.txt -d ${{database}} "${{@:3}}"
+    status=$?
+    if [ "_{local_db_dir}" != "_" ]; then
+        exec {{staged_fd}}>&-
+    fi
+    if [ ${{status}} -ne 0 ]; then
+        return ${{status}}
+    fi
+    anno_input=${{work_prefix}}.$1.${{SGE_TASK_ID}}.txt
+}}
+
 if [ _{active_inhouse_normal_flag} = "_True" ]; then 
-    {mutanno} mutation -t {out_prefix}.ebfilter_mutations.${{SGE_TASK_ID}}.txt -o {out_prefix}.inhouse_normal.${{SGE_TASK_ID}}.txt -d {inhouse_normal_database} || exit $?
-else
-    cp {out_prefix}.ebfilter_mutations.${{SGE_TASK_ID}}.txt {out_prefix}.inhouse_normal.${{SGE_TASK_ID}}.txt
+    annotate inhouse_normal {inhouse_normal_database} || exit $?
 fi
 
 if [ _{active_inhouse_tumor_flag} = "_True" ]; then 
-    {mutanno} mutation -t {out_prefix}.inhouse_normal.${{SGE_TASK_ID}}.txt -o {out_prefix}.inhouse_tumor.${{SGE_TASK_ID}}.txt -d {inhouse_tumor_database} || exit $?
-else
-    cp {out_prefix}.inhouse_normal.${{SGE_TASK_ID}}.txt {out_prefix}.inhouse_tumor.${{SGE_TASK_ID}}.txt
+    annotate inhouse_tumor {inhouse_tumor_database} || exit $?
 fi
 
 if [ _{active_HGVD_2013_flag} = "_True" ]; then 
-    {mutanno} mutation -t {out_prefix}.inhouse_tumor.${{SGE_TASK_ID}}.txt -o {out_prefix}.HGVD_2013.${{SGE_TASK_ID}}.txt -d {HGVD_2013_database} -c 5 || exit $?
-else
-    cp {out_prefix}.inhouse_tumor.${{SGE_TASK_ID}}.txt {out_prefix}.HGVD_2013.${{SGE_TASK_ID}}.txt
+    annotate HGVD_2013 {HGVD_2013_database} -c 5 || exit $?
 fi
 
 if [ _{active_HGVD_2016_flag} = "_True" ]; then 
-    {mutanno} mutation -t {out_prefix}.HGVD_2013.${{SGE_TASK_ID}}.txt -o {out_prefix}.HGVD_2016.${{SGE_TASK_ID}}.txt -d {HGVD_2016_database} -c 5 || exit $?
-else
-    cp {out_prefix}.HGVD_2013.${{SGE_TASK_ID}}.txt {out_prefix}.HGVD_2016.${{SGE_TASK_ID}}.txt
+    annotate HGVD_2016 {HGVD_2016_database} -c 5 || exit $?
 fi
 
 if [ _{active_ExAC_flag} = "_True" ]; then 
-    {mutanno} mutation -t {out_prefix}.HGVD_2016.${{SGE_TASK_ID}}.txt -o {out_prefix}.ExAC.${{SGE_TASK_ID}}.txt -d {ExAC_database} -c 8 || exit $?
-else
-    cp {out_prefix}.HGVD_2016.${{SGE_TASK_ID}}.txt {out_prefix}.ExAC.${{SGE_TASK_ID}}.txt
+    annotate ExAC {ExAC_database} -c 8 || exit $?
 fi
 
 if [ _{active_HGMD_flag} = "_True" ]; then 
-    {mutanno} mutation -t {out_prefix}.ExAC.${{SGE_TASK_ID}}.txt -o {out_prefix}.HGMD.${{SGE_TASK_ID}}.txt -d {HGMD_database} -c 7 || exit $?
-else
-    cp {out_prefix}.ExAC.${{SGE_TASK_ID}}.txt {out_prefix}.HGMD.${{SGE_TASK_ID}}.txt
+    annotate HGMD {HGMD_database} -c 7 || exit $?
 fi
 
 if [ _{active_annovar_flag} = "_True" ];then
-    {annovar}/table_annovar.pl --outfile {out_prefix}_mutations_candidate.${{SGE_TASK_ID}} {table_annovar_params} {out_prefix}.HGMD.${{SGE_TASK_ID}}.txt {annovar_database} || exit $?
+    {annovar}/table_annovar.pl --outfile {out_prefix}_mutations_candidate.${{SGE_TASK_ID}} {table_annovar_params} ${{anno_input}} {annovar_database} || exit $?
 else
-    cp {out_prefix}.HGMD.${{SGE_TASK_ID}}.txt {out_prefix}_mutations_candidate.${{SGE_TASK_ID}}.{annovar_buildver}_multianno.txt
+    mv ${{anno_input}} {out_prefix}_mutations_candidate.${{SGE_TASK_ID}}.{annovar_buildver}_multianno.txt || exit $?
 fi
 
 """
-    def __init__(self, qsub_option, script_dir):
-        super(Mutation_call, self).__init__(qsub_option, script_dir)
+    def __init__(self, qsub_option, script_dir, conf_section = None):
+        super(Mutation_call, self).__init__(qsub_option, script_dir, conf_section)
 
 
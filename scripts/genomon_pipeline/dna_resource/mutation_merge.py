@@ -46,9 +46,22 @@ fi
 
 print_header=""
 
+# the annotation of ANNOVAR is done once for all the candidates of the sample (annovar_in_merge) or by every mutation_call task
+annovar_result={out_prefix}_mutations_candidate.1.{annovar_buildver}_multianno.txt
+if [ _{active_annovar_flag} = _True -a _{annovar_in_merge} = _True ]
+then
+    : > {out_prefix}_mutations_candidate.txt || exit $?
+    for i in `seq 1 1 {filecount}`
+    do
+        cat {out_prefix}_mutations_candidate.${{i}}.{annovar_buildver}_multianno.txt >> {out_prefix}_mutations_candidate.txt || exit $?
+    done
+    {annovar}/table_annovar.pl --outfile {out_prefix}_mutations_candidate {table_annovar_params} {out_prefix}_mutations_candidate.txt {annovar_database} || exit $?
+    annovar_result={out_prefix}_mutations_candidate.{annovar_buildver}_multianno.txt
+fi
+
 if [ _{active_annovar_flag} = _True ]
 then
-    tmp_header=`head -n 1 {out_prefix}_mutations_candidate.1.{annovar_buildver}_multianno.txt | awk -F"\t" -v OFS="\t" '{{$NF=""; sub(/.$/,""); print $0}}'` || exit $?
+    tmp_header=`head -n 1 ${{annovar_result}} | awk -F"\t" -v OFS="\t" '{{$NF=""; sub(/.$/,""); print $0}}'` || exit $?
     print_header=${{tmp_header}}
 
     tmp_header=`echo $mut_header | cut -d "," -f 6- | tr "," "\t"` || exit $?
@@ -117,15 +130,20 @@ fi
 
 echo "$print_header" >> {out_prefix}.genomon_mutation.result.txt || exit $?
 
-for i in `seq 1 1 {filecount}`
-do
-    if [ _{active_annovar_flag} = "_True" ]
-    then
-        awk 'NR>1 {{print}}' {out_prefix}_mutations_candidate.${{i}}.{annovar_buildver}_multianno.txt >> {out_prefix}.genomon_mutation.result.txt || exit $?
-    else
-        cat {out_prefix}_mutations_candidate.${{i}}.{annovar_buildver}_multianno.txt >> {out_prefix}.genomon_mutation.result.txt || exit $?
-    fi
-done
+if [ _{active_annovar_flag} = "_True" -a _{annovar_in_merge} = "_True" ]
+then
+    awk 'NR>1 {{print}}' ${{annovar_result}} >> {out_prefix}.genomon_mutation.result.txt || exit $?
+else
+    for i in `seq 1 1 {filecount}`
+    do
+        if [ _{active_annovar_flag} = "_True" ]
+        then
+            awk 'NR>1 {{print}}' {out_prefix}_mutations_candidate.${{i}}.{annovar_buildver}_multianno.txt >> {out_prefix}.genomon_mutation.result.txt || exit $?
+        else
+            cat {out_prefix}_mutations_candidate.${{i}}.{annovar_buildver}_multianno.txt >> {out_prefix}.genomon_mutation.result.txt || exit $?
+        fi
+    done
+fi
 
 if [ _{control_bam} = "_None" ]
 then 
@@ -145,7 +163,7 @@ else
 fi
 
 """
-    def __init__(self, qsub_option, script_dir):
-        super(Mutation_merge, self).__init__(qsub_option, script_dir)
+    def __init__(self, qsub_option, script_dir, conf_section = None):
+        super(Mutation_merge, self).__init__(qsub_option, script_dir, conf_section)
 
 
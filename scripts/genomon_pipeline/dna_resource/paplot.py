@@ -52,7 +52,7 @@ fi
 {paplot} index {output_dir} --config_file {config_file} --remarks '{remarks}'
 """
 
-    def __init__(self, qsub_option, script_dir):
-        super(Res_PA_Plot, self).__init__(qsub_option, script_dir)
+    def __init__(self, qsub_option, script_dir, conf_section = None):
+        super(Res_PA_Plot, self).__init__(qsub_option, script_dir, conf_section)
 
         
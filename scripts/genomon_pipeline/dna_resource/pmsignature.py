@@ -52,6 +52,6 @@ fi
 $R_PATH/R --vanilla --slave --args {outputdir}/full.$sig_num.Rdata {outputdir}/pmsignature.full.result.$sig_num.json < {script_path}/pmsignature/convert_toJson_full.R
 """
 
-    def __init__(self, qsub_option, script_dir):
-        super(Res_Pmsignature, self).__init__(qsub_option, script_dir)
+    def __init__(self, qsub_option, script_dir, conf_section = None):
+        super(Res_Pmsignature, self).__init__(qsub_option, script_dir, conf_section)
 
@@ -32,8 +32,8 @@ export PYTHONPATH={pythonpath}
 --input_file_case4 "{input_file_case4}"
 """
 
-    def __init__(self, qsub_option, script_dir):
-        super(Res_PostAnalysis, self).__init__(qsub_option, script_dir)
+    def __init__(self, qsub_option, script_dir, conf_section = None):
+        super(Res_PostAnalysis, self).__init__(qsub_option, script_dir, conf_section)
 
     def output_files(self, mode, samples, genomon_root, sample_conf_name, genomon_conf):
         
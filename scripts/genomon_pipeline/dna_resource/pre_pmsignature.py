@@ -43,6 +43,6 @@ else
 fi
 """
  
-    def __init__(self, qsub_option, script_dir):
-        super(Res_PrePmsignature, self).__init__(qsub_option, script_dir)
+    def __init__(self, qsub_option, script_dir, conf_section = None):
+        super(Res_PrePmsignature, self).__init__(qsub_option, script_dir, conf_section)
 
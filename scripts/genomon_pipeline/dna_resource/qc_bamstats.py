@@ -23,9 +23,9 @@ set -o pipefail
 export PYTHONHOME={pythonhome}
 export PATH=$PYTHONHOME/bin:$PATH
 export PYTHONPATH={pythonpath}
-
+""" + cram_reference_template + """
 {genomon_qc} bamstats {input_file} {output_file} --perl5lib {perl5lib} --bamstats {bamstats}
 """
 
-    def __init__(self, qsub_option, script_dir):
-        super(Res_QC_Bamstats, self).__init__(qsub_option, script_dir)
+    def __init__(self, qsub_option, script_dir, conf_section = None):
+        super(Res_QC_Bamstats, self).__init__(qsub_option, script_dir, conf_section)
@@ -24,7 +24,7 @@ set -o pipefail
 export PYTHONHOME={pythonhome}
 export PATH=$PYTHONHOME/bin:$PATH
 export PYTHONPATH={pythonpath}
-
+""" + cram_reference_template + """
 if [ {data_type} = "wgs" ]
 then
 ########## WGS ##########
@@ -36,5 +36,5 @@ else
 fi
 """
 
-    def __init__(self, qsub_option, script_dir):
-        super(Res_QC_Coverage, self).__init__(qsub_option, script_dir)
+    def __init__(self, qsub_option, script_dir, conf_section = None):
+        super(Res_QC_Coverage, self).__init__(qsub_option, script_dir, conf_section)
@@ -39,5 +39,5 @@ fi
 {genomon_qc} merge {coverage_file} {bamstats_file} {output_file} --meta "{meta}"
 """
 
-    def __init__(self, qsub_option, script_dir):
-        super(Res_QC_Merge, self).__init__(qsub_option, script_dir)
+    def __init__(self, qsub_option, script_dir, conf_section = None):
+        super(Res_QC_Merge, self).__init__(qsub_option, script_dir, conf_section)
@@ -25,7 +25,7 @@ blat_home={blat}
 export PATH=${{blat_home%/*}}:{htslib}:$PYTHONHOME/bin:$PATH
 export LD_LIBRARY_PATH={ld_library_path}
 export PYTHONPATH={pythonpath}
-
+""" + cram_reference_template + """
 {genomon_sv} filt {input_bam} {output_prefix} {reference_genome} {param} || exit $?
 
 mv {output_prefix}.genomonSV.result.txt {output_prefix}.genomonSV.result.txt.tmp || exit $?
@@ -41,7 +41,7 @@ rm -rf {output_prefix}.genomonSV.result.txt.tmp
 mv {output_prefix}.genomonSV.result.filt.txt.tmp {output_prefix}.genomonSV.result.filt.txt
 """
 
-    def __init__(self, qsub_option, script_dir):
-        super(SV_filt, self).__init__(qsub_option, script_dir)
+    def __init__(self, qsub_option, script_dir, conf_section = None):
+        super(SV_filt, self).__init__(qsub_option, script_dir, conf_section)
 
 
@@ -29,7 +29,7 @@ export PYTHONPATH={pythonpath}
 
 """
 
-    def __init__(self, qsub_option, script_dir):
-        super(SV_merge, self).__init__(qsub_option, script_dir)
+    def __init__(self, qsub_option, script_dir, conf_section = None):
+        super(SV_merge, self).__init__(qsub_option, script_dir, conf_section)
 
 
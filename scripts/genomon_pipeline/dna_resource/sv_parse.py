@@ -24,13 +24,13 @@ export PYTHONHOME={pythonhome}
 export PATH={htslib}:$PYTHONHOME/bin:$PATH
 export LD_LIBRARY_PATH={ld_library_path}
 export PYTHONPATH={pythonpath}
-
+""" + cram_reference_template + """
 
 {genomon_sv} parse {input_bam} {output_prefix} {param} || exit $?
 
 """
 
-    def __init__(self, qsub_option, script_dir):
-        super(SV_parse, self).__init__(qsub_option, script_dir)
+    def __init__(self, qsub_option, script_dir, conf_section = None):
+        super(SV_parse, self).__init__(qsub_option, script_dir, conf_section)
 
 
@@ -0,0 +1,94 @@
+#! /usr/bin/env python
+
+import os
+import atexit
+import threading
+from genomon_pipeline.config.run_conf import *
+
+global drmaa_session
+
+class Drmaa_session(object):
+    """
+    class for sharing one DRMAA session among all the stage tasks of a process
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.session = None
+        self.module = None
+        self.pid = None
+        self.job_templates = {}
+
+
+    def get_module(self):
+        # the fake DRMAA runs the jobs on the local host (for the test mode)
+        if self.module is None:
+            if run_conf.drmaa_test_mode is not None:
+                import genomon_pipeline.fake_drmaa as drmaa
+                drmaa.mode = run_conf.drmaa_test_mode
+            else:
+                import drmaa
+            self.module = drmaa
+        return self.module
+
+
+    def get_session(self):
+        with self.lock:
+            # a session inherited from the parent process can not be used after fork
+            if self.session is not None and self.pid != os.getpid():
+                self.session = None
+                self.job_templates = {}
+
+            if self.session is None:
+                drmaa = self.get_module()
+                self.session = drmaa.Session()
+                self.session.initialize()
+                self.pid = os.getpid()
+                atexit.register(self.exit)
+
+            return self.session
+
+
+    def get_job_template(self, task_name, qsub_option):
+        # a job template is cached for each stage and reused for every submission
+        # (the qsub_option changes with the priority and the escalated memory, so it is set on every submission)
+        with self.lock:
+            s = self.get_session()
+            if task_name not in self.job_templates:
+                self.job_templates[task_name] = s.createJobTemplate()
+            jt = self.job_templates[task_name]
+            jt.nativeSpecification = qsub_option
+            return jt
+
+
+    def run_job(self, task_name, qsub_option, job_name, remote_command, log_dir):
+        with self.lock:
+            jt = self.get_job_template(task_name, qsub_option)
+            jt.jobName = job_name
+            jt.outputPath = ':' + log_dir
+            jt.errorPath = ':' + log_dir
+            jt.remoteCommand = remote_command
+            return self.session.runJob(jt)
+
+
+    def run_bulk_jobs(self, task_name, qsub_option, job_name, remote_command, log_dir, begin, end):
+        with self.lock:
+            jt = self.get_job_template(task_name, qsub_option)
+            jt.jobName = job_name
+            jt.outputPath = ':' + log_dir
+            jt.errorPath = ':' + log_dir
+            jt.remoteCommand = remote_command
+            return self.session.runBulkJobs(jt, begin, end, 1)
+
+
+    def exit(self):
+        with self.lock:
+            if self.session is None or self.pid != os.getpid():
+                return
+            for jt in self.job_templates.values():
+                self.session.deleteJobTemplate(jt)
+            self.job_templates = {}
+            self.session.exit()
+            self.session = None
+
+drmaa_session = Drmaa_session()
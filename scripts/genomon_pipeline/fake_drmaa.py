@@ -0,0 +1,172 @@
+#! /usr/bin/env python
+"""
+local stand-in for the drmaa module, used by the test mode of the pipeline
+
+mode = "local": the job scripts are executed on the local host with bash
+mode = "dry"  : the job scripts are not executed and every job succeeds at once
+"""
+
+import os
+import time
+import signal
+import threading
+import subprocess
+from collections import namedtuple
+
+mode = "local"
+
+# the terminated signal is reported by name as the DRMAA of SGE does (e.g. SIGKILL)
+signal_names = dict((getattr(signal, name), name) for name in dir(signal) if name.startswith("SIG") and not name.startswith("SIG_"))
+
+JobInfo = namedtuple("JobInfo", ["jobId", "hasExited", "hasSignal", "terminatedSignal",
+                                 "hasCoreDump", "wasAborted", "exitStatus", "resourceUsage"])
+
+class ExitTimeoutException(Exception):
+    pass
+
+
+class JobState(object):
+    UNDETERMINED = 'undetermined'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+
+class JobTemplate(object):
+
+    def __init__(self):
+        self.jobName = ""
+        self.outputPath = ""
+        self.errorPath = ""
+        self.nativeSpecification = ""
+        self.remoteCommand = ""
+
+
+class Session(object):
+
+    TIMEOUT_WAIT_FOREVER = -1
+    TIMEOUT_NO_WAIT = 0
+    JOB_IDS_SESSION_ALL = 'DRMAA_JOB_IDS_SESSION_ALL'
+    JOB_IDS_SESSION_ANY = 'DRMAA_JOB_IDS_SESSION_ANY'
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.job_number = 0
+
+
+    def initialize(self):
+        pass
+
+
+    def exit(self):
+        pass
+
+
+    def createJobTemplate(self):
+        return JobTemplate()
+
+
+    def deleteJobTemplate(self, jt):
+        pass
+
+
+    def _start(self, jt, job_number, task_id):
+        jobid = str(job_number) if task_id is None else str(job_number) + '.' + str(task_id)
+        env = dict(os.environ)
+        env["JOB_ID"] = str(job_number)
+        env["JOB_NAME"] = jt.jobName
+        env["SGE_TASK_ID"] = "undefined" if task_id is None else str(task_id)
+
+        suffix = str(job_number) if task_id is None else str(job_number) + '.' + str(task_id)
+        out_dir = jt.outputPath.lstrip(':')
+        err_dir = jt.errorPath.lstrip(':')
+
+        proc = None
+        if mode != "dry":
+            out = open(out_dir + '/' + jt.jobName + '.o' + suffix, 'w')
+            err = open(err_dir + '/' + jt.jobName + '.e' + suffix, 'w')
+            proc = subprocess.Popen(['/bin/bash', jt.remoteCommand], env = env, stdout = out, stderr = err)
+            out.close()
+            err.close()
+
+        self.jobs[jobid] = {"proc": proc, "start": time.time(), "info": None}
+        return jobid
+
+
+    def runJob(self, jt):
+        with self.lock:
+            self.job_number += 1
+            return self._start(jt, self.job_number, None)
+
+
+    def runBulkJobs(self, jt, begin, end, step):
+        with self.lock:
+            self.job_number += 1
+            return [self._start(jt, self.job_number, task_id) for task_id in range(begin, end + 1, step)]
+
+
+    def _collect(self, jobid, block):
+        job = self.jobs[jobid]
+        if job["info"] is not None:
+            return job["info"]
+
+        usage = {"wallclock": "0.0000", "cpu": "0.0000", "maxvmem": "0.0000"}
+        status = 0
+        if job["proc"] is not None:
+            pid, ret, rusage = os.wait4(job["proc"].pid, 0 if block else os.WNOHANG)
+            if pid == 0:
+                return None
+            job["proc"].returncode = ret
+            status = os.WEXITSTATUS(ret) if os.WIFEXITED(ret) else 0
+            usage["cpu"] = "%.4f" % (rusage.ru_utime + rusage.ru_stime)
+            usage["maxvmem"] = "%.4f" % (rusage.ru_maxrss * 1024.0)
+            usage["wallclock"] = "%.4f" % (time.time() - job["start"])
+            job["info"] = JobInfo(jobid, os.WIFEXITED(ret), os.WIFSIGNALED(ret),
+                                  signal_names.get(os.WTERMSIG(ret), str(os.WTERMSIG(ret))) if os.WIFSIGNALED(ret) else "",
+                                  False, False, status, usage)
+        else:
+            job["info"] = JobInfo(jobid, True, False, "", False, False, status, usage)
+
+        return job["info"]
+
+
+    def jobStatus(self, jobid):
+        info = self._collect(jobid, False)
+        if info is None:
+            return JobState.RUNNING
+        if info.exitStatus == 0 and info.hasExited:
+            return JobState.DONE
+        return JobState.FAILED
+
+
+    def synchronize(self, jobIds, timeout=-1, dispose=False):
+        for jobid in jobIds:
+            self._collect(jobid, True)
+            if dispose:
+                del self.jobs[jobid]
+
+
+    def wait(self, jobId, timeout=-1):
+        if jobId == Session.JOB_IDS_SESSION_ANY:
+            start = time.time()
+            while True:
+                with self.lock:
+                    jobids = self.jobs.keys()
+                for jobid in jobids:
+                    try:
+                        info = self._collect(jobid, False)
+                    except KeyError:
+                        continue
+                    if info is not None:
+                        with self.lock:
+                            del self.jobs[jobid]
+                        return info
+                if timeout >= 0 and time.time() - start >= timeout:
+                    raise ExitTimeoutException("time out")
+                time.sleep(0.1)
+
+        info = self._collect(jobId, True)
+        with self.lock:
+            del self.jobs[jobId]
+        return info
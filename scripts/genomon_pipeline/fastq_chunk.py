@@ -0,0 +1,328 @@
+#! /usr/bin/env python
+"""
+virtual chunks of FASTQ files
+
+index: record the start position of every chunk of the given number of lines,
+       a byte offset for plain FASTQ and a BGZF virtual offset for BGZF compressed FASTQ
+       (other gzip files are recompressed once to BGZF next to the index with bgzip,
+       or decompressed there with --spill_plain when bgzip is not available)
+read:  write the lines of a chunk to stdout
+
+This script is run in the job scripts, so it uses the standard library only.
+"""
+
+import os
+import re
+import sys
+import zlib
+import struct
+import argparse
+import subprocess
+
+block_size = 4 * 1024 * 1024
+
+# the reads filtered by the sequencer are skipped when fastq_filter is True (same as the Fastq_splitter)
+filter_pattern = re.compile(r'^@.* [^:]*:N:[^:]*:')
+
+def is_gzip(path):
+    with open(path, 'rb') as in_handle:
+        return in_handle.read(2) == b'\x1f\x8b'
+
+
+def is_bgzf(path):
+    with open(path, 'rb') as in_handle:
+        header = in_handle.read(18)
+    if len(header) < 18 or header[0:4] != b'\x1f\x8b\x08\x04':
+        return False
+    return header[12:14] == b'BC' and struct.unpack('<H', header[14:16])[0] == 2
+
+
+class Plain_file(object):
+    """
+    blocks of a plain file. the position is the byte offset.
+    """
+
+    def __init__(self, path):
+        self.handle = open(path, 'rb')
+
+
+    def make_position(self, block_position, within):
+        return block_position + within
+
+
+    def blocks(self, position = 0):
+        self.handle.seek(position)
+        while True:
+            block_position = self.handle.tell()
+            data = self.handle.read(block_size)
+            if not data: break
+            yield (block_position, data)
+
+
+    def close(self):
+        self.handle.close()
+
+
+class Bgzf_file(object):
+    """
+    blocks of a BGZF file. the position is the virtual offset (compressed offset << 16 | offset in the block).
+    """
+
+    def __init__(self, path):
+        self.handle = open(path, 'rb')
+        self.block_length = 0
+
+
+    def make_position(self, block_position, within):
+        # the end of the block is the start of the next block (the offset in the block has 16 bits)
+        if within >= self.block_length:
+            return self.handle.tell() << 16
+        return (block_position << 16) | within
+
+
+    def read_block(self):
+        header = self.handle.read(12)
+        if len(header) == 0:
+            return None
+        if len(header) < 12 or header[0:2] != b'\x1f\x8b':
+            raise ValueError("invalid BGZF block at " + str(self.handle.tell() - len(header)))
+        xlen = struct.unpack('<H', header[10:12])[0]
+        extra = self.handle.read(xlen)
+        bsize = None
+        pos = 0
+        while pos < xlen:
+            (si1, si2, slen) = struct.unpack('<BBH', extra[pos:pos + 4])
+            if si1 == 66 and si2 == 67:
+                bsize = struct.unpack('<H', extra[pos + 4:pos + 6])[0]
+            pos += 4 + slen
+        if bsize is None:
+            raise ValueError("no BSIZE in the BGZF block")
+        cdata = self.handle.read(bsize - xlen - 19)
+        self.handle.read(8)
+        return zlib.decompress(cdata, -15)
+
+
+    def blocks(self, position = 0):
+        block_position = position >> 16
+        within = position & 0xFFFF
+        self.handle.seek(block_position)
+        while True:
+            block_position = self.handle.tell()
+            data = self.read_block()
+            if data is None: break
+            self.block_length = len(data)
+            if within > 0:
+                # the first block is returned from the offset in the block
+                yield (block_position, data, within)
+                within = 0
+            else:
+                yield (block_position, data, 0)
+
+
+    def close(self):
+        self.handle.close()
+
+
+def open_blocks(path, file_type, position = 0):
+    """
+    return the file and the generator of (block position, data, offset of data in the block)
+    """
+    if file_type == "bgzf":
+        bgzf_file = Bgzf_file(path)
+        return (bgzf_file, bgzf_file.blocks(position))
+    plain_file = Plain_file(path)
+    return (plain_file, ((block_position, data, 0) for (block_position, data) in plain_file.blocks(position)))
+
+
+def nth_newline(data, start, n):
+    """
+    index of the n-th newline (n >= 1) in data[start:]
+    """
+    pos = start - 1
+    for i in range(n):
+        pos = data.index(b'\n', pos + 1)
+    return pos
+
+
+def recompress(path, out_path, bgzip, threads, pigz):
+    """
+    decompress the gzip file (pigz with threads) into bgzip, or into a plain file without bgzip
+    """
+    if threads > 1 and pigz:
+        decompress_command = [pigz, '-p', str(threads), '-dc', path]
+    else:
+        decompress_command = ['gzip', '-dc', path]
+    with open(out_path, 'wb') as out_handle:
+        if not bgzip:
+            if subprocess.call(decompress_command, stdout = out_handle) != 0:
+                raise RuntimeError("failed to decompress " + path)
+            return
+        decompress = subprocess.Popen(decompress_command, stdout = subprocess.PIPE)
+        compress = subprocess.Popen([bgzip, '-@', str(threads), '-c'], stdin = decompress.stdout, stdout = out_handle)
+        decompress.stdout.close()
+        if compress.wait() != 0 or decompress.wait() != 0:
+            raise RuntimeError("failed to recompress " + path + " with " + bgzip)
+
+
+def build_index(index_file, input_files, lines, fastq_filter, bgzip = None, threads = 1, pigz = None, spill_plain = False):
+    files = []
+    for path in input_files:
+        if is_bgzf(path):
+            files.append((path, "bgzf"))
+        elif is_gzip(path):
+            # the gzip file without BGZF blocks can not be read from the middle, so it is written once as BGZF
+            # (removed with the index after the alignment)
+            chunk_prefix = os.path.splitext(index_file)[0] + '.chunk_' + str(len(files) + 1)
+            if bgzip:
+                recompress(path, chunk_prefix + '.fastq.gz', bgzip, threads, pigz)
+                files.append((chunk_prefix + '.fastq.gz', "bgzf"))
+            elif spill_plain:
+                recompress(path, chunk_prefix + '.fastq', None, threads, pigz)
+                files.append((chunk_prefix + '.fastq', "plain"))
+            else:
+                raise ValueError(path + " is not BGZF compressed: give --bgzip to recompress it or --spill_plain to decompress it")
+        else:
+            files.append((path, "plain"))
+
+    # (start line, file index, position)
+    chunks = [(0, 0, 0)]
+    line_count = 0
+    next_boundary = lines
+    for (file_index, (path, file_type)) in enumerate(files):
+        (handle, blocks) = open_blocks(path, file_type)
+        if not fastq_filter:
+            for (block_position, data, within) in blocks:
+                pos = within
+                newlines = data.count(b'\n', pos)
+                while line_count + newlines >= next_boundary:
+                    end = nth_newline(data, pos, next_boundary - line_count)
+                    newlines -= next_boundary - line_count
+                    line_count = next_boundary
+                    chunks.append((line_count, file_index, handle.make_position(block_position, end + 1)))
+                    next_boundary += lines
+                    pos = end + 1
+                line_count += newlines
+        else:
+            record = []
+            partial = b''
+            for (block_position, data, within) in blocks:
+                pos = within
+                while True:
+                    end = data.find(b'\n', pos)
+                    if end < 0:
+                        partial += data[pos:]
+                        break
+                    record.append(partial + data[pos:end])
+                    partial = b''
+                    pos = end + 1
+                    if len(record) == 4:
+                        if filter_pattern.match(record[0]):
+                            line_count += 4
+                            if line_count == next_boundary:
+                                chunks.append((line_count, file_index, handle.make_position(block_position, pos)))
+                                next_boundary += lines
+                        record = []
+        handle.close()
+
+    # no empty chunk at the end
+    chunks = [chunk for chunk in chunks if chunk[0] < line_count or chunk[0] == 0]
+
+    with open(index_file + '.tmp', 'w') as out_handle:
+        out_handle.write("#lines\t" + str(lines) + "\n")
+        out_handle.write("#fastq_filter\t" + str(fastq_filter) + "\n")
+        for path in input_files:
+            out_handle.write("#input\t" + path + "\n")
+        for (path, file_type) in files:
+            out_handle.write("#file\t" + path + "\t" + file_type + "\n")
+        out_handle.write("#total\t" + str(line_count) + "\n")
+        for (start_line, file_index, position) in chunks:
+            out_handle.write(str(file_index) + "\t" + str(position) + "\n")
+    os.rename(index_file + '.tmp', index_file)
+
+
+def read_index(index_file):
+    index = {"inputs": [], "files": [], "chunks": []}
+    with open(index_file) as in_handle:
+        for line in in_handle:
+            F = line.rstrip('\n').split('\t')
+            if F[0] == "#lines": index["lines"] = int(F[1])
+            elif F[0] == "#fastq_filter": index["fastq_filter"] = (F[1] == "True")
+            elif F[0] == "#input": index["inputs"].append(F[1])
+            elif F[0] == "#file": index["files"].append((F[1], F[2]))
+            elif F[0] == "#total": index["total"] = int(F[1])
+            else: index["chunks"].append((int(F[0]), int(F[1])))
+    return index
+
+
+def read_chunk(index_file, chunk_number, out = sys.stdout):
+    index = read_index(index_file)
+    (file_index, position) = index["chunks"][chunk_number]
+    lines = min(index["lines"], index["total"] - chunk_number * index["lines"])
+
+    written = 0
+    record = []
+    partial = b''
+    while written < lines and file_index < len(index["files"]):
+        (path, file_type) = index["files"][file_index]
+        (handle, blocks) = open_blocks(path, file_type, position)
+        for (block_position, data, within) in blocks:
+            pos = within
+            if not index["fastq_filter"]:
+                newlines = data.count(b'\n', pos)
+                if written + newlines >= lines:
+                    end = nth_newline(data, pos, lines - written)
+                    out.write(data[pos:end + 1])
+                    written = lines
+                    break
+                out.write(data[pos:])
+                written += newlines
+            else:
+                while written < lines:
+                    end = data.find(b'\n', pos)
+                    if end < 0:
+                        partial += data[pos:]
+                        break
+                    record.append(partial + data[pos:end + 1])
+                    partial = b''
+                    pos = end + 1
+                    if len(record) == 4:
+                        if filter_pattern.match(record[0]):
+                            out.write(b''.join(record))
+                            written += 4
+                        record = []
+                if written >= lines: break
+        handle.close()
+        file_index += 1
+        position = 0
+
+    out.flush()
+    if written != lines:
+        raise RuntimeError("chunk " + str(chunk_number) + " of " + index_file + " has " + str(written) + " lines (expected " + str(lines) + ")")
+
+
+def main():
+    parser = argparse.ArgumentParser(prog = "fastq_chunk")
+    subparsers = parser.add_subparsers()
+
+    index_parser = subparsers.add_parser("index", help = "make the chunk index of the fastq files")
+    index_parser.add_argument("--lines", help = "lines of a chunk", type = int, required = True)
+    index_parser.add_argument("--fastq_filter", help = "skip the reads filtered by the sequencer", action = "store_true", default = False)
+    index_parser.add_argument("--bgzip", help = "bgzip to recompress the gzip fastq without BGZF blocks", type = str, default = None)
+    index_parser.add_argument("--threads", help = "threads of bgzip and pigz", type = int, default = 1)
+    index_parser.add_argument("--pigz", help = "pigz to decompress the gzip fastq with threads", type = str, default = None)
+    index_parser.add_argument("--spill_plain", help = "decompress the gzip fastq without BGZF blocks to a plain fastq (without --bgzip)", action = "store_true", default = False)
+    index_parser.add_argument("index_file", type = str)
+    index_parser.add_argument("input_files", type = str, nargs = '+')
+    index_parser.set_defaults(func = lambda args: build_index(args.index_file, args.input_files, args.lines, args.fastq_filter, args.bgzip, args.threads, args.pigz, args.spill_plain))
+
+    read_parser = subparsers.add_parser("read", help = "write a chunk to stdout")
+    read_parser.add_argument("index_file", type = str)
+    read_parser.add_argument("chunk_number", help = "0-based chunk number", type = int)
+    read_parser.set_defaults(func = lambda args: read_chunk(args.index_file, args.chunk_number))
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+#! /usr/bin/env python
+"""
+split the read 1 and read 2 fastq in one pass
+
+The reads of the two files are read in lockstep, a pair is removed when the filter flag
+of either mate is set (fastq_filter), and the chunks are written as
+{target_dir}/1_NNNN.fastq_split and {target_dir}/2_NNNN.fastq_split (the same names as split -a 4 -d).
+The number of the reads of every chunk and of the whole input is written to
+{target_dir}/fastq_split_manifest.txt, and the number of the lines of read 1 to
+{target_dir}/fastq_line_num.txt. An input without any read pair is an error.
+
+This script is run in the job scripts, so it uses the standard library only.
+"""
+
+import os
+import re
+import argparse
+
+# same as the grep of the Fastq_splitter
+filter_pattern = re.compile(r'^@.* [^:]*:N:[^:]*:')
+
+manifest_name = "fastq_split_manifest.txt"
+
+def read_name(header):
+    name = header.split(None, 1)[0] if header.strip() else header
+    if name.endswith('/1') or name.endswith('/2'):
+        name = name[:-2]
+    return name
+
+
+def read_record(in_handle):
+    header = in_handle.readline()
+    if not header:
+        return None
+    record = [header, in_handle.readline(), in_handle.readline(), in_handle.readline()]
+    if not record[3]:
+        raise ValueError("truncated fastq record: " + header.rstrip('\n'))
+    if not record[3].endswith('\n'):
+        record[3] += '\n'
+    return record
+
+
+def split_pair(target_dir, fastq1, fastq2, lines, fastq_filter):
+    if lines % 4 != 0:
+        raise ValueError("the lines of a chunk must be a multiple of 4: " + str(lines))
+    chunk_reads = lines / 4
+
+    in_handle1 = open(fastq1)
+    in_handle2 = open(fastq2)
+    out_handle1 = None
+    out_handle2 = None
+    chunks = []
+    total_reads = 0
+    filtered_reads = 0
+    try:
+        while True:
+            record1 = read_record(in_handle1)
+            record2 = read_record(in_handle2)
+            if record1 is None or record2 is None:
+                if record1 is not None or record2 is not None:
+                    raise ValueError("the numbers of the reads in read 1 and read 2 are different")
+                break
+            if read_name(record1[0]) != read_name(record2[0]):
+                raise ValueError("the mates are out of order: " + record1[0].rstrip('\n') + " " + record2[0].rstrip('\n'))
+
+            if fastq_filter and not (filter_pattern.match(record1[0]) and filter_pattern.match(record2[0])):
+                filtered_reads += 1
+                continue
+
+            if len(chunks) == 0 or chunks[-1] == chunk_reads:
+                if out_handle1 is not None:
+                    out_handle1.close()
+                    out_handle2.close()
+                num = str(len(chunks)).zfill(4)
+                out_handle1 = open(target_dir + '/1_' + num + '.fastq_split', 'w')
+                out_handle2 = open(target_dir + '/2_' + num + '.fastq_split', 'w')
+                chunks.append(0)
+
+            out_handle1.write(''.join(record1))
+            out_handle2.write(''.join(record2))
+            chunks[-1] += 1
+            total_reads += 1
+    finally:
+        in_handle1.close()
+        in_handle2.close()
+        if out_handle1 is not None:
+            out_handle1.close()
+            out_handle2.close()
+
+    # the alignment has no task without reads
+    if len(chunks) == 0:
+        raise ValueError("no read pairs in " + fastq1 + " and " + fastq2 + (" after the fastq_filter" if filtered_reads > 0 else ""))
+
+    with open(target_dir + '/' + manifest_name + '.tmp', 'w') as out_handle:
+        out_handle.write("#lines\t" + str(lines) + "\n")
+        out_handle.write("#total_reads\t" + str(total_reads) + "\n")
+        out_handle.write("#filtered_reads\t" + str(filtered_reads) + "\n")
+        for (index, reads) in enumerate(chunks):
+            out_handle.write(str(index).zfill(4) + "\t" + str(reads) + "\n")
+    os.rename(target_dir + '/' + manifest_name + '.tmp', target_dir + '/' + manifest_name)
+
+    with open(target_dir + '/fastq_line_num.txt', 'w') as out_handle:
+        out_handle.write(str(total_reads * 4) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(prog = "fastq_pair_split")
+    parser.add_argument("--lines", help = "lines of a chunk", type = int, required = True)
+    parser.add_argument("--fastq_filter", help = "remove the pairs filtered by the sequencer", action = "store_true", default = False)
+    parser.add_argument("target_dir", type = str)
+    parser.add_argument("fastq1", type = str)
+    parser.add_argument("fastq2", type = str)
+    args = parser.parse_args()
+
+    split_pair(args.target_dir, args.fastq1, args.fastq2, args.lines, args.fastq_filter)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#! /usr/bin/env python
+
+import os
+import sys
+import threading
+from genomon_pipeline.drmaa_session import *
+
+global job_monitor
+
+class Job_future(object):
+    """
+    class for the result (drmaa JobInfo) of a submitted job
+    """
+
+    def __init__(self, jobid):
+        self.jobid = jobid
+        self.event = threading.Event()
+        self.info = None
+
+
+    def set_result(self, info):
+        self.info = info
+        self.event.set()
+
+
+    def result(self):
+        # Event.wait without timeout can not be interrupted in python2
+        while not self.event.is_set():
+            self.event.wait(60)
+        return self.info
+
+
+class Job_monitor(object):
+    """
+    class for collecting the finished jobs of the shared DRMAA session in one thread
+
+    Every stage task registers its job ids and sleeps on a Job_future.
+    A single thread reaps the finished jobs of the whole session with
+    wait(JOB_IDS_SESSION_ANY), so the scheduler is not polled per job.
+    """
+
+    def __init__(self, interval = 10):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.futures = {}
+        self.finished = {}
+        self.thread = None
+        self.pid = None
+
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None and self.pid == os.getpid() and self.thread.is_alive():
+                return
+            self.futures = {}
+            self.finished = {}
+            self.pid = os.getpid()
+            self.thread = threading.Thread(target = self.run, name = "job_monitor")
+            self.thread.daemon = True
+            self.thread.start()
+
+
+    def watch(self, jobid):
+        self.start()
+        jobid = str(jobid)
+        with self.lock:
+            future = Job_future(jobid)
+            if jobid in self.finished:
+                future.set_result(self.finished.pop(jobid))
+            else:
+                self.futures[jobid] = future
+            return future
+
+
+    def wait(self, jobid):
+        return self.watch(jobid).result()
+
+
+    def run(self):
+        drmaa = drmaa_session.get_module()
+        s = drmaa_session.get_session()
+        while True:
+            with self.lock:
+                pending = len(self.futures)
+            if pending == 0:
+                threading.Event().wait(1)
+                continue
+            try:
+                info = s.wait(drmaa.Session.JOB_IDS_SESSION_ANY, self.interval)
+            except drmaa.ExitTimeoutException:
+                continue
+            except Exception as e:
+                print >> sys.stderr, "job_monitor: " + str(e)
+                threading.Event().wait(self.interval)
+                continue
+
+            jobid = str(info.jobId)
+            with self.lock:
+                future = self.futures.pop(jobid, None)
+                if future is None:
+                    # the job finished before its submitter started watching it
+                    self.finished[jobid] = info
+            if future is not None:
+                future.set_result(info)
+
+job_monitor = Job_monitor()
@@ -0,0 +1,163 @@
+#! /usr/bin/env python
+
+import os
+import sys
+import math
+import datetime
+import sqlite3
+import threading
+from genomon_pipeline.qsub_option import *
+
+global job_stats
+
+create_table = """
+CREATE TABLE IF NOT EXISTS job_stats (
+    date TEXT,
+    project_root TEXT,
+    task_name TEXT,
+    sample TEXT,
+    job_name TEXT,
+    job_id TEXT,
+    task_id INTEGER,
+    input_size INTEGER,
+    qsub_option TEXT,
+    exit_status INTEGER,
+    wallclock REAL,
+    cpu REAL,
+    maxvmem REAL,
+    io REAL
+)
+"""
+
+def get_input_size(arguments):
+    """
+    total size of the input files given to a stage (arguments named *input*, *_bam or *bam_files)
+    """
+    paths = set()
+    for key, value in arguments.iteritems():
+        if not isinstance(value, basestring): continue
+        if not ("input" in key or key.endswith("_bam") or key.endswith("bam_files")): continue
+        for item in value.replace(';', ' ').replace(',', ' ').split():
+            if '=' in item: item = item.split('=', 1)[1]
+            if os.path.isfile(item): paths.add(os.path.realpath(item))
+    return sum(os.path.getsize(path) for path in paths)
+
+
+def get_usage(usage, *keys):
+    for key in keys:
+        if key in usage:
+            try:
+                return float(usage[key])
+            except ValueError:
+                pass
+    return None
+
+
+def percentile(values, q):
+    # nearest-rank percentile
+    values = sorted(values)
+    if len(values) == 0: return None
+    index = max(0, min(len(values) - 1, int(math.ceil(q / 100.0 * len(values))) - 1))
+    return values[index]
+
+
+class Job_stats(object):
+    """
+    class for recording the resource usage of every finished job in a sqlite database
+    """
+
+    def __init__(self, db_path = None):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+
+
+    def connect(self):
+        conn = sqlite3.connect(self.db_path, timeout = 600)
+        conn.execute(create_table)
+        return conn
+
+
+    def record(self, project_root, task_name, sample, job_name, job_id, task_id, input_size, qsub_option, exit_status, usage):
+        if self.db_path is None: return
+
+        values = (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                  project_root, task_name, sample, job_name, str(job_id), task_id, input_size, qsub_option, exit_status,
+                  get_usage(usage, "ru_wallclock", "wallclock"),
+                  get_usage(usage, "cpu"),
+                  get_usage(usage, "maxvmem"),
+                  get_usage(usage, "io"))
+        try:
+            with self.lock:
+                conn = self.connect()
+                with conn:
+                    conn.execute("INSERT INTO job_stats VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)", values)
+                conn.close()
+        except sqlite3.Error as e:
+            # the statistics should never stop the pipeline
+            print >> sys.stderr, "job_stats: " + str(e)
+
+
+    def stage_history(self):
+        """
+        {task_name: [(wallclock, input_size)]} of the jobs finished successfully
+        """
+        history = {}
+        if self.db_path is None or not os.path.exists(self.db_path): return history
+        try:
+            conn = self.connect()
+            for row in conn.execute("SELECT task_name, wallclock, input_size FROM job_stats WHERE exit_status = 0 AND wallclock IS NOT NULL"):
+                history.setdefault(row[0], []).append((row[1], row[2]))
+            conn.close()
+        except sqlite3.Error as e:
+            print >> sys.stderr, "job_stats: " + str(e)
+        return history
+
+
+    def report(self, task_name = None, out = sys.stdout):
+        conn = self.connect()
+        query = "SELECT task_name, exit_status, wallclock, maxvmem, qsub_option FROM job_stats"
+        params = ()
+        if task_name is not None:
+            query += " WHERE task_name = ?"
+            params = (task_name,)
+
+        stages = {}
+        for row in conn.execute(query, params):
+            stage = stages.setdefault(row[0], {"jobs": 0, "failed": 0, "wallclock": [], "maxvmem": [], "request": []})
+            stage["jobs"] += 1
+            if row[1] != 0:
+                stage["failed"] += 1
+                continue
+            if row[2] is not None: stage["wallclock"].append(row[2])
+            if row[3] is not None: stage["maxvmem"].append(row[3] / (1024.0 ** 3))
+            stage["request"].append(get_memory(row[4]) * get_slot_num(row[4]))
+        conn.close()
+
+        print >> out, '\t'.join(["task_name", "jobs", "failed",
+                                 "wallclock_p50", "wallclock_p90", "wallclock_p99", "wallclock_max",
+                                 "maxvmem_p50(GB)", "maxvmem_p90(GB)", "maxvmem_p99(GB)", "maxvmem_max(GB)",
+                                 "requested_max(GB)"])
+        for name in sorted(stages.keys()):
+            stage = stages[name]
+            row = [name, str(stage["jobs"]), str(stage["failed"])]
+            for key in ["wallclock", "maxvmem"]:
+                for q in [50, 90, 99, 100]:
+                    value = percentile(stage[key], q)
+                    row.append("---" if value is None else "%.2f" % value)
+            row.append("---" if len(stage["request"]) == 0 else "%.2f" % max(stage["request"]))
+            print >> out, '\t'.join(row)
+
+job_stats = Job_stats()
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(prog = "genomon_job_stats")
+    parser.add_argument("job_stats_db", help = "job statistics database written with genomon_pipeline --job_stats_db", type = str)
+    parser.add_argument("--task_name", help = "report only this stage", default = None, type = str)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.job_stats_db):
+        raise ValueError("No such file: " + args.job_stats_db)
+
+    Job_stats(args.job_stats_db).report(args.task_name)
@@ -0,0 +1,32 @@
+#! /usr/bin/env python
+
+import time
+import multiprocessing
+
+class Token_bucket(object):
+    """
+    class for limiting the submission rate [jobs per minute] of a stage
+
+    The bucket is made before ruffus forks the worker processes,
+    so the workers of the driver share the tokens.
+    """
+
+    def __init__(self, rate, capacity = 1):
+        self.rate = rate / 60.0
+        self.capacity = capacity
+        self.tokens = multiprocessing.Value('d', capacity, lock = False)
+        self.last = multiprocessing.Value('d', time.time(), lock = False)
+        self.lock = multiprocessing.Lock()
+
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens.value = min(self.capacity, self.tokens.value + (now - self.last.value) * self.rate)
+                self.last.value = now
+                if self.tokens.value >= 1:
+                    self.tokens.value -= 1
+                    return
+                wait = (1 - self.tokens.value) / self.rate
+            time.sleep(wait)
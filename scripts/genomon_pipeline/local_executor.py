@@ -0,0 +1,142 @@
+#! /usr/bin/env python
+
+import os
+import sys
+import time
+import datetime
+import threading
+import subprocess
+import multiprocessing
+from genomon_pipeline.qsub_option import *
+
+global local_executor
+
+def get_total_memory():
+    with open("/proc/meminfo") as hin:
+        for line in hin:
+            F = line.split()
+            if F[0] == "MemTotal:":
+                return float(F[1]) / (1024 * 1024)
+    return 0.0
+
+
+class Local_executor(object):
+    """
+    class for running the job scripts on the local host instead of the batch scheduler
+
+    The slots (-pe) and the memory (s_vmem/mem_req per slot) in the qsub_option
+    of each stage are reserved from the CPUs and the memory of the host
+    before a script is started.
+    """
+
+    def __init__(self, cpus = None, memory = None):
+        self.cpus = cpus if cpus else multiprocessing.cpu_count()
+        self.memory = memory if memory else get_total_memory()
+        self.used_cpus = 0
+        self.used_memory = 0.0
+        self.condition = threading.Condition()
+        self.lock = threading.Lock()
+        self.job_number = 0
+
+
+    def acquire(self, cpus, memory):
+        with self.condition:
+            while self.used_cpus + cpus > self.cpus or self.used_memory + memory > self.memory + 1e-6:
+                self.condition.wait(60)
+            self.used_cpus += cpus
+            self.used_memory += memory
+
+
+    def release(self, cpus, memory):
+        with self.condition:
+            self.used_cpus -= cpus
+            self.used_memory -= memory
+            self.condition.notify_all()
+
+
+    def run_script(self, job_name, script, log_dir, job_id, task_id, slots):
+        env = dict(os.environ)
+        env["JOB_ID"] = str(job_id)
+        env["JOB_NAME"] = job_name
+        env["NSLOTS"] = str(slots)
+        env["SGE_TASK_ID"] = "undefined" if task_id is None else str(task_id)
+
+        suffix = str(job_id) if task_id is None else str(job_id) + '.' + str(task_id)
+        out = open(log_dir + '/' + job_name + '.o' + suffix, 'w')
+        err = open(log_dir + '/' + job_name + '.e' + suffix, 'w')
+        start = time.time()
+        proc = subprocess.Popen(['/bin/bash', script], env = env, stdout = out, stderr = err)
+        out.close()
+        err.close()
+
+        pid, ret, rusage = os.wait4(proc.pid, 0)
+        proc.returncode = ret
+        usage = {"wallclock": "%.4f" % (time.time() - start),
+                 "cpu": "%.4f" % (rusage.ru_utime + rusage.ru_stime),
+                 "maxvmem": "%.4f" % (rusage.ru_maxrss * 1024.0)}
+        exit_status = os.WEXITSTATUS(ret) if os.WIFEXITED(ret) else 128 + os.WTERMSIG(ret)
+        return exit_status, usage
+
+
+    def reservation(self, qsub_option):
+        return (min(get_slot_num(qsub_option), self.cpus), min(get_memory(qsub_option) * get_slot_num(qsub_option), self.memory))
+
+
+    def run_task(self, job_name, script, log_dir, job_id, task_id, qsub_option, retry_count, retry_option, results):
+        # every attempt is kept for the job statistics
+        results[task_id] = []
+        (slots, memory) = self.reservation(qsub_option)
+        try:
+            for var in range(0, (retry_count+1)):
+                exit_status, usage = self.run_script(job_name, script, log_dir, job_id, task_id, slots)
+                date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                print >> sys.stderr, "Job: " + job_name + " task: " + str(task_id) + " finished with exit status: " + str(exit_status) + " at Date/Time: " + date
+                results[task_id].append((exit_status, usage, qsub_option))
+                if exit_status == 0 or var == retry_count: break
+
+                # the retry after a memory-limit kill reserves more memory (same as the batch scheduler)
+                if retry_option is not None:
+                    new_option = retry_option(qsub_option, exit_status, usage)
+                    if new_option != qsub_option:
+                        self.release(slots, memory)
+                        (slots, memory) = (0, 0.0)
+                        qsub_option = new_option
+                        (new_slots, new_memory) = self.reservation(qsub_option)
+                        self.acquire(new_slots, new_memory)
+                        (slots, memory) = (new_slots, new_memory)
+        finally:
+            self.release(slots, memory)
+
+
+    def run_job(self, qsub_option, job_name, script, log_dir, max_task = 0, retry_count = 0, retry_option = None):
+        """
+        run the script (each task of the array when max_task > 0) and
+        return {task_id: [(exit status, resource usage, qsub_option) of every attempt]}
+        retry_option(qsub_option, exit status, resource usage) gives the qsub_option of the retry
+        """
+        (slots, memory) = self.reservation(qsub_option)
+
+        with self.lock:
+            self.job_number += 1
+            job_id = self.job_number
+
+        date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        print >> sys.stderr, "Your job has been started on the local host with id: " + str(job_id) + " at Date/Time: " + date
+
+        task_ids = [None] if max_task == 0 else range(1, max_task + 1)
+        results = {}
+        threads = []
+        for task_id in task_ids:
+            self.acquire(slots, memory)
+            thread = threading.Thread(target = self.run_task,
+                                      args = (job_name, script, log_dir, job_id, task_id, qsub_option, retry_count, retry_option, results))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        for thread in threads:
+            thread.join()
+
+        return results
+
+local_executor = Local_executor()
@@ -0,0 +1,58 @@
+#! /usr/bin/env python
+
+import re
+
+memory_units = {"K": 1.0 / (1024 * 1024), "M": 1.0 / 1024, "G": 1.0, "T": 1024.0}
+
+def get_slot_num(qsub_option):
+    """
+    number of slots requested by "-pe <parallel environment> <slots>"
+    """
+    match = re.search(r'-pe\s+\S+\s+(\d+)', qsub_option)
+    if match:
+        return int(match.group(1))
+    return 1
+
+
+def get_thread_num(qsub_option, default):
+    """
+    number of threads for the slots requested by "-pe", or default without "-pe"
+    """
+    if re.search(r'-pe\s+\S+\s+(\d+)', qsub_option):
+        return get_slot_num(qsub_option)
+    return default
+
+
+def parse_memory(value):
+    """
+    convert the memory value of SGE (e.g. 10.6G, 500M) to GB
+    """
+    match = re.match(r'^([0-9.]+)([KkMmGgTt]?)$', value.strip())
+    if not match:
+        raise ValueError("invalid memory value: " + value)
+    unit = match.group(2).upper() if match.group(2) != "" else "G"
+    return float(match.group(1)) * memory_units[unit]
+
+
+def format_memory(value):
+    """
+    convert the memory value [GB] to the format of SGE
+    """
+    return ("%.1f" % value).rstrip('0').rstrip('.') + "G"
+
+
+def get_memory(qsub_option):
+    """
+    memory [GB] per slot requested by s_vmem or mem_req (the larger one)
+    """
+    memory = 0.0
+    for match in re.finditer(r'(s_vmem|mem_req)=([0-9.]+[KkMmGgTt]?)', qsub_option):
+        memory = max(memory, parse_memory(match.group(2)))
+    return memory
+
+
+def set_memory(qsub_option, memory):
+    """
+    replace the s_vmem and mem_req values of the qsub_option with memory [GB]
+    """
+    return re.sub(r'(s_vmem|mem_req)=[0-9.]+[KkMmGgTt]?', lambda match: match.group(1) + '=' + format_memory(memory), qsub_option)
@@ -0,0 +1,76 @@
+#! /usr/bin/env python
+"""
+reference cache of the cram files
+
+The sequences of the reference fasta are written to {cache_dir}/%2s/%2s/%s by the md5 of
+each sequence (the same layout as seq_cache_populate.pl of htslib), so every tool built on
+htslib finds the reference of a cram through REF_PATH and REF_CACHE without the UR field
+of the header or a download from the EBI.
+"""
+
+import os
+import sys
+import hashlib
+import argparse
+
+def cache_path(cache_dir, md5):
+    return cache_dir + '/' + md5[0:2] + '/' + md5[2:4] + '/' + md5[4:]
+
+
+def path_pattern(cache_dir):
+    # the value of REF_PATH and REF_CACHE
+    return cache_dir + '/%2s/%2s/%s'
+
+
+def populate(ref_fa, cache_dir):
+    """
+    write the sequences of ref_fa to the cache (skipped when the cache of the same fasta is complete)
+    """
+    stat = os.stat(ref_fa)
+    done_file = cache_dir + '/.populated.' + hashlib.md5(os.path.realpath(ref_fa) + '\t' + str(stat.st_size) + '\t' + str(stat.st_mtime)).hexdigest()
+    if os.path.exists(done_file):
+        return
+    if not os.path.isdir(cache_dir): os.makedirs(cache_dir)
+
+    tmp_file = cache_dir + '/.sequence.' + str(os.getpid())
+    out_handle = None
+    md5 = None
+
+    def close_sequence():
+        out_handle.close()
+        digest = md5.hexdigest()
+        path = cache_path(cache_dir, digest)
+        if os.path.exists(path):
+            os.unlink(tmp_file)
+            return
+        if not os.path.isdir(os.path.dirname(path)): os.makedirs(os.path.dirname(path))
+        os.rename(tmp_file, path)
+
+    with open(ref_fa) as in_handle:
+        for line in in_handle:
+            if line.startswith('>'):
+                if out_handle is not None: close_sequence()
+                out_handle = open(tmp_file, 'w')
+                md5 = hashlib.md5()
+                continue
+            # the M5 of the SAM specification is the md5 of the upper case sequence without the white spaces
+            sequence = ''.join(line.split()).upper()
+            md5.update(sequence)
+            out_handle.write(sequence)
+    if out_handle is not None: close_sequence()
+
+    open(done_file, 'w').close()
+
+
+def main():
+    parser = argparse.ArgumentParser(prog = "ref_cache")
+    parser.add_argument("ref_fa", type = str)
+    parser.add_argument("cache_dir", type = str)
+    args = parser.parse_args()
+
+    populate(args.ref_fa, args.cache_dir)
+    print >> sys.stderr, "REF_PATH=" + path_pattern(args.cache_dir)
+
+
+if __name__ == "__main__":
+    main()
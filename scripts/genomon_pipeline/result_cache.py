@@ -0,0 +1,193 @@
+#! /usr/bin/env python
+
+import os
+import sys
+import time
+import shutil
+import hashlib
+import sqlite3
+import subprocess
+from genomon_pipeline.config.run_conf import *
+from genomon_pipeline.config.genomon_conf import *
+
+global result_cache
+
+create_tables = ["""
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    stage TEXT,
+    size INTEGER,
+    last_access REAL
+)
+"""]
+
+# resource requests do not change the results of a stage
+ignored_options = ["qsub_option", "retry_memory_scale", "retry_max_memory", "max_concurrent_jobs", "max_concurrent_tasks", "max_submit_rate",
+                   "threads", "sort_tmp_dir", "index_stage", "local_index_dir", "chunks_per_job",
+                   "local_db_dir", "local_db_max_size", "ref_cache_dir"]
+
+# the bytes read from the head and the tail of an input file for its fingerprint
+fingerprint_block = 1024 * 1024
+
+def link_file(src, dst):
+    """
+    hard link on the same device (a copy across the devices), and return whether dst was linked.
+    the entries are read-only, so a stage never rewrites a linked output in place.
+    """
+    if os.path.lexists(dst): os.unlink(dst)
+    if os.stat(src).st_dev == os.stat(os.path.dirname(os.path.abspath(dst))).st_dev:
+        try:
+            os.link(src, dst)
+            return True
+        except OSError:
+            pass
+    if subprocess.call(["cp", "--reflink=auto", src, dst]) != 0:
+        shutil.copyfile(src, dst)
+    return False
+
+
+def file_fingerprint(path):
+    """
+    the size, the mtime and the sha1 of the head and the tail of the file (None when the file does not exist)
+    """
+    if not os.path.exists(path): return None
+    stat = os.stat(path)
+    sha = hashlib.sha1()
+    with open(path, 'rb') as in_handle:
+        sha.update(in_handle.read(fingerprint_block))
+        if stat.st_size > fingerprint_block:
+            in_handle.seek(max(fingerprint_block, stat.st_size - fingerprint_block))
+            sha.update(in_handle.read(fingerprint_block))
+    return str(stat.st_size) + '\t' + repr(stat.st_mtime) + '\t' + sha.hexdigest()
+
+
+class Result_cache(object):
+    """
+    class for sharing the results of the stages across the projects
+
+    An entry is keyed on the fingerprints of the input files (the keys of the upstream entries for the
+    files made by the pipeline), the script templates of the stage tasks, the settings of the stages in
+    the genomon_conf and the software versions. The outputs are hard-linked between the cache and the
+    project (copied across the devices), and the least recently used entries are evicted when the cache
+    exceeds max_size [GB].
+    """
+
+    def __init__(self, cache_dir = None, max_size = 0):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+
+    def enabled(self):
+        return self.cache_dir is not None
+
+
+    def connect(self):
+        if not os.path.isdir(self.cache_dir): os.makedirs(self.cache_dir)
+        conn = sqlite3.connect(self.cache_dir + '/index.db', timeout = 600)
+        for create_table in create_tables:
+            conn.execute(create_table)
+        return conn
+
+
+    def entry_dir(self, key):
+        return self.cache_dir + '/' + key[0:2] + '/' + key
+
+
+    def get_key(self, stage_tasks, input_files, sections, values = []):
+        """
+        values are the other inputs of the stages as strings (e.g. the keys of the upstream entries).
+        return None when an input file does not exist yet or a value is None
+        """
+        if not self.enabled(): return None
+        for path in input_files:
+            if path is not None and not os.path.exists(path): return None
+        if None in values: return None
+
+        sha = hashlib.sha1()
+        for path in input_files:
+            sha.update("input\t" + (file_fingerprint(path) if path is not None else "None") + "\n")
+        for value in values:
+            sha.update("value\t" + value + "\n")
+        for stage_task in stage_tasks:
+            sha.update("script\t" + stage_task.task_name + "\t" + stage_task.script_template + "\n")
+        for section in sections:
+            if not genomon_conf.has_section(section): continue
+            for (option, value) in sorted(genomon_conf.items(section)):
+                if option in ignored_options: continue
+                sha.update("conf\t" + section + "\t" + option + "\t" + value.replace(run_conf.project_root, "{project_root}") + "\n")
+        for name in sorted(software_version.keys()):
+            sha.update("version\t" + name + "\t" + software_version[name] + "\n")
+        return sha.hexdigest()
+
+
+    def restore(self, stage, key, output_files):
+        """
+        link the cached outputs into the project, and return whether the entry was found
+        """
+        if key is None: return False
+        entry_dir = self.entry_dir(key)
+        if not os.path.isdir(entry_dir): return False
+
+        restored = []
+        for (index, path) in enumerate(output_files):
+            if not os.path.exists(entry_dir + '/' + str(index)): continue
+            if not os.path.isdir(os.path.dirname(path)): os.makedirs(os.path.dirname(path))
+            if not link_file(entry_dir + '/' + str(index), path):
+                os.chmod(path, 0644)
+            restored.append(path)
+
+        try:
+            conn = self.connect()
+            with conn:
+                conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+            conn.close()
+        except sqlite3.Error as e:
+            print >> sys.stderr, "result_cache: " + str(e)
+
+        print >> sys.stderr, "result_cache: " + stage + " restored " + ', '.join(restored)
+        return True
+
+
+    def store(self, stage, key, output_files):
+        if key is None: return
+        entry_dir = self.entry_dir(key)
+        if os.path.isdir(entry_dir): return
+
+        # the entry is made in a temporary directory and renamed, so a half-stored entry is never restored
+        tmp_dir = entry_dir + '.tmp.' + str(os.getpid())
+        if os.path.isdir(tmp_dir): shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+        size = 0
+        for (index, path) in enumerate(output_files):
+            if not os.path.exists(path): continue
+            link_file(os.path.realpath(path), tmp_dir + '/' + str(index))
+            # the entry (and the output linked to it) is read-only
+            os.chmod(tmp_dir + '/' + str(index), 0444)
+            size += os.path.getsize(path)
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # stored by another process
+            shutil.rmtree(tmp_dir)
+            return
+
+        try:
+            conn = self.connect()
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO entries VALUES (?,?,?,?)", (key, stage, size, time.time()))
+                self.evict(conn)
+            conn.close()
+        except sqlite3.Error as e:
+            print >> sys.stderr, "result_cache: " + str(e)
+
+
+    def evict(self, conn):
+        if not self.max_size: return
+        total = conn.execute("SELECT SUM(size) FROM entries").fetchone()[0] or 0
+        for (key, size) in conn.execute("SELECT key, size FROM entries ORDER BY last_access").fetchall():
+            if total <= self.max_size * 1024 * 1024 * 1024: break
+            if os.path.isdir(self.entry_dir(key)): shutil.rmtree(self.entry_dir(key))
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+
+result_cache = Result_cache()
@@ -13,17 +13,42 @@ from genomon_pipeline.rna_resource.fusion_merge import *
 from genomon_pipeline.rna_resource.genomon_expression import *
 from genomon_pipeline.rna_resource.intron_retention import *
 from genomon_pipeline.dna_resource.bamtofastq import *
+from genomon_pipeline.stage_group import *
+from genomon_pipeline.critical_path import *
 
 # set task classes
-bamtofastq = Bam2Fastq(genomon_conf.get("bam2fastq", "qsub_option"), run_conf.drmaa)
-star_align = Star_align(genomon_conf.get("star_align", "qsub_option"), run_conf.drmaa)
-fusionfusion = Fusionfusion(genomon_conf.get("fusionfusion", "qsub_option"), run_conf.drmaa)
-fusion_count = Fusion_count(genomon_conf.get("fusion_count_control", "qsub_option"), run_conf.drmaa)
-fusion_merge = Fusion_merge(genomon_conf.get("fusion_merge_control", "qsub_option"), run_conf.drmaa)
-genomon_expression = Genomon_expression(genomon_conf.get("genomon_expression", "qsub_option"), run_conf.drmaa)
-intron_retention = Intron_retention(genomon_conf.get("intron_retention", "qsub_option"), run_conf.drmaa)
-r_paplot = Res_PA_Plot(genomon_conf.get("paplot", "qsub_option"), run_conf.drmaa)
-r_post_analysis = Res_PostAnalysis(genomon_conf.get("post_analysis", "qsub_option"), run_conf.drmaa)
+bamtofastq = Bam2Fastq(genomon_conf.get("bam2fastq", "qsub_option"), run_conf.drmaa, "bam2fastq")
+star_align = Star_align(genomon_conf.get("star_align", "qsub_option"), run_conf.drmaa, "star_align")
+fusionfusion = Fusionfusion(genomon_conf.get("fusionfusion", "qsub_option"), run_conf.drmaa, "fusionfusion")
+fusion_count = Fusion_count(genomon_conf.get("fusion_count_control", "qsub_option"), run_conf.drmaa, "fusion_count_control")
+fusion_merge = Fusion_merge(genomon_conf.get("fusion_merge_control", "qsub_option"), run_conf.drmaa, "fusion_merge_control")
+genomon_expression = Genomon_expression(genomon_conf.get("genomon_expression", "qsub_option"), run_conf.drmaa, "genomon_expression")
+intron_retention = Intron_retention(genomon_conf.get("intron_retention", "qsub_option"), run_conf.drmaa, "intron_retention")
+r_paplot = Res_PA_Plot(genomon_conf.get("paplot", "qsub_option"), run_conf.drmaa, "paplot")
+r_post_analysis = Res_PostAnalysis(genomon_conf.get("post_analysis", "qsub_option"), run_conf.drmaa, "post_analysis")
+
+# stage groups run the small stages in one job
+post_analysis_group = Stage_group("post_analysis_group", [r_post_analysis], run_conf.drmaa)
+
+_group_post_analysis = False
+if genomon_conf.has_section("stage_group"):
+    if genomon_conf.has_option("stage_group", "post_analysis"):
+        _group_post_analysis = genomon_conf.getboolean("stage_group", "post_analysis")
+
+# downstream stages of each stage (following the order of the tasks below) for the scheduler priority
+critical_path.set_graph({"bam2fastq": ["star_align"],
+                         "star_align": ["fusion_count", "genomon_expression", "intron_retention"],
+                         "fusion_count": ["fusion_merge"],
+                         "fusion_merge": ["fusionfusion"],
+                         "fusionfusion": ["post_analysis", "post_analysis_group"],
+                         "genomon_expression": ["post_analysis", "post_analysis_group"],
+                         "intron_retention": [],
+                         "post_analysis": ["paplot"],
+                         "post_analysis_group": ["paplot"],
+                         "paplot": []})
+
+if genomon_conf.has_option("priority", "enable"):
+    critical_path.enable = genomon_conf.getboolean("priority", "enable")
 
 _debug = False
 if genomon_conf.has_section("develop"):
@@ -66,6 +91,13 @@ if pa_outputs_starqc["run_pa"] == True:
     for sample in sample_conf.qc:
         pa_inputs_starqc.append(run_conf.project_root + '/star/' + sample + '/' + sample + '.Log.final.out')
 
+# generate input/output list of 'post analysis group'
+pa_inputs_group = pa_inputs_fusion + pa_inputs_starqc
+pa_outputs_group = []
+for pa_outputs in [pa_outputs_fusion, pa_outputs_starqc]:
+    if pa_outputs["run_pa"] == True:
+        pa_outputs_group.extend(pa_outputs["outputs"])
+
 # generate input list of paplot
 paplot_output = run_conf.project_root + '/paplot/' + sample_conf_name + '/index.html'
 
@@ -209,7 +241,9 @@ def bam2fastq(outputfiles):
                  "o1_name": output_dir + '/unmatched_first_output.txt',
                  "o2_name": output_dir + '/unmatched_second_output.txt',
                  "t": output_dir + '/temp.txt',
-                 "s": output_dir + '/single_end_output.txt'}
+                 "s": output_dir + '/single_end_output.txt',
+                 "output_dir": output_dir,
+                 "ref_fa": genomon_conf.get("REFERENCE", "ref_fasta")}
 
     if not os.path.isdir(output_dir): os.mkdir(output_dir)
     bamtofastq.task_exec(arguments, run_conf.project_root + '/log/' + sample, run_conf.project_root + '/script/'+ sample)
@@ -362,61 +396,71 @@ def task_intron_retention(input_file, output_file):
     intron_retention.task_exec(arguments, run_conf.project_root + '/log/' + sample_name, run_conf.project_root + '/script/' + sample_name)
 
 
+def post_analysis_arguments(mode, input_file_cases):
+    return {"pythonhome": genomon_conf.get("ENV", "PYTHONHOME"),
+            "pythonpath": genomon_conf.get("ENV", "PYTHONPATH"),
+            "genomon_pa":  genomon_conf.get("SOFTWARE", "genomon_pa"),
+            "mode": mode,
+            "genomon_root": run_conf.project_root,
+            "output_dir": run_conf.project_root + "/post_analysis/" + sample_conf_name,
+            "sample_sheet": os.path.abspath(run_conf.sample_conf_file),
+            "config_file": genomon_conf.get("post_analysis", "config_file"),
+            "samtools": genomon_conf.get("SOFTWARE", "samtools"),
+            "bedtools": genomon_conf.get("SOFTWARE", "bedtools"),
+            "input_file_case1": input_file_cases[0],
+            "input_file_case2": input_file_cases[1],
+            "input_file_case3": input_file_cases[2],
+            "input_file_case4": input_file_cases[3]
+           }
+
+
 @active_if(genomon_conf.getboolean("post_analysis", "enable"))
+@active_if(not _group_post_analysis)
 @active_if(len(pa_inputs_fusion) > 0)
 @follows(task_fusionfusion)
 @follows(task_genomon_expression)
 @collate(pa_inputs_fusion, formatter(), pa_outputs_fusion["outputs"])
 def post_analysis_fusion(input_files, output_file):
 
-    arguments = {"pythonhome": genomon_conf.get("ENV", "PYTHONHOME"),
-                 "pythonpath": genomon_conf.get("ENV", "PYTHONPATH"),
-                 "genomon_pa":  genomon_conf.get("SOFTWARE", "genomon_pa"),
-                 "mode": "fusion",
-                 "genomon_root": run_conf.project_root,
-                 "output_dir": run_conf.project_root + "/post_analysis/" + sample_conf_name,
-                 "sample_sheet": os.path.abspath(run_conf.sample_conf_file),
-                 "config_file": genomon_conf.get("post_analysis", "config_file"),
-                 "samtools": genomon_conf.get("SOFTWARE", "samtools"),
-                 "bedtools": genomon_conf.get("SOFTWARE", "bedtools"),
-                 "input_file_case1": ",".join(pa_outputs_fusion["case1"]["samples"]),
-                 "input_file_case2": ",".join(pa_outputs_fusion["case2"]["samples"]),
-                 "input_file_case3": "",
-                 "input_file_case4": ""
-                }
+    arguments = post_analysis_arguments("fusion", [",".join(pa_outputs_fusion["case1"]["samples"]), ",".join(pa_outputs_fusion["case2"]["samples"]), "", ""])
                  
     r_post_analysis.task_exec(arguments, run_conf.project_root + '/log/post_analysis', run_conf.project_root + '/script/post_analysis')
 
 @active_if(genomon_conf.getboolean("post_analysis", "enable"))
+@active_if(not _group_post_analysis)
 @active_if(len(pa_inputs_starqc) > 0)
 @follows(task_fusionfusion)
 @follows(task_genomon_expression)
 @collate(pa_inputs_starqc, formatter(), pa_outputs_starqc["outputs"])
 def post_analysis_starqc(input_files, output_file):
 
-    arguments = {"pythonhome": genomon_conf.get("ENV", "PYTHONHOME"),
-                 "pythonpath": genomon_conf.get("ENV", "PYTHONPATH"),
-                 "genomon_pa":  genomon_conf.get("SOFTWARE", "genomon_pa"),
-                 "mode": "starqc",
-                 "genomon_root": run_conf.project_root,
-                 "output_dir": run_conf.project_root + "/post_analysis/" + sample_conf_name,
-                 "sample_sheet": os.path.abspath(run_conf.sample_conf_file),
-                 "config_file": genomon_conf.get("post_analysis", "config_file"),
-                 "samtools": genomon_conf.get("SOFTWARE", "samtools"),
-                 "bedtools": genomon_conf.get("SOFTWARE", "bedtools"),
-                 "input_file_case1": ",".join(sample_conf.qc),
-                 "input_file_case2": "",
-                 "input_file_case3": "",
-                 "input_file_case4": ""
-                }
+    arguments = post_analysis_arguments("starqc", [",".join(sample_conf.qc), "", "", ""])
                  
     r_post_analysis.task_exec(arguments, run_conf.project_root + '/log/post_analysis', run_conf.project_root + '/script/post_analysis')
+
+# post analysis of every mode in one job
+@active_if(genomon_conf.getboolean("post_analysis", "enable"))
+@active_if(_group_post_analysis)
+@active_if(len(pa_inputs_group) > 0)
+@follows(task_fusionfusion)
+@follows(task_genomon_expression)
+@collate(pa_inputs_group, formatter(), pa_outputs_group)
+def group_post_analysis(input_files, output_file):
+
+    steps = []
+    if len(pa_inputs_fusion) > 0:
+        steps.append((r_post_analysis, post_analysis_arguments("fusion", [",".join(pa_outputs_fusion["case1"]["samples"]), ",".join(pa_outputs_fusion["case2"]["samples"]), "", ""])))
+    if len(pa_inputs_starqc) > 0:
+        steps.append((r_post_analysis, post_analysis_arguments("starqc", [",".join(sample_conf.qc), "", "", ""])))
+
+    post_analysis_group.group_exec(steps, run_conf.project_root + '/log/post_analysis', run_conf.project_root + '/script/post_analysis', run_conf.project_root + '/post_analysis/' + sample_conf_name)
     
 @active_if(genomon_conf.getboolean("post_analysis", "enable"))
 @active_if(genomon_conf.getboolean("paplot", "enable"))
 @active_if(len(paplot_inputs) > 0)
 @follows(post_analysis_fusion)
 @follows(post_analysis_starqc)
+@follows(group_post_analysis)
 @collate(paplot_inputs, formatter(), run_conf.project_root + '/paplot/' + sample_conf_name + '/index.html')
 def paplot(input_file, output_file):
     
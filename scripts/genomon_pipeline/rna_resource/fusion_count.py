@@ -28,5 +28,5 @@ export PYTHONPATH={pythonpath}
 {chimera_utils} count {additional_params} {chimeric_sam} {output}
 """
 
-    def __init__(self, qsub_option, script_dir):
-        super(Fusion_count, self).__init__(qsub_option, script_dir)
+    def __init__(self, qsub_option, script_dir, conf_section = None):
+        super(Fusion_count, self).__init__(qsub_option, script_dir, conf_section)
@@ -28,5 +28,5 @@ export PYTHONPATH={pythonpath}
 {chimera_utils} merge_control {additional_params} {count_list} {output}
 """
 
-    def __init__(self, qsub_option, script_dir):
-        super(Fusion_merge, self).__init__(qsub_option, script_dir)
+    def __init__(self, qsub_option, script_dir, conf_section = None):
+        super(Fusion_merge, self).__init__(qsub_option, script_dir, conf_section)
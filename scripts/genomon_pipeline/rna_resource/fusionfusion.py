@@ -35,5 +35,5 @@ mv {output_prefix}/fusion_fusion.result.txt {output_prefix}/{sample}.genomonFusi
 mv {output_prefix}/{sample}.fusion.fusion.result.filt.txt {output_prefix}/{sample}.genomonFusion.result.filt.txt
 """
 
-    def __init__(self, qsub_option, script_dir):
-        super(Fusionfusion, self).__init__(qsub_option, script_dir)
+    def __init__(self, qsub_option, script_dir, conf_section = None):
+        super(Fusionfusion, self).__init__(qsub_option, script_dir, conf_section)
@@ -29,5 +29,5 @@ export PYTHONPATH={pythonpath}
 mv {output_prefix}.sym2fpkm.txt {output_prefix}.genomonExpression.result.txt
 """
 
-    def __init__(self, qsub_option, script_dir):
-        super(Genomon_expression, self).__init__(qsub_option, script_dir)
+    def __init__(self, qsub_option, script_dir, conf_section = None):
+        super(Genomon_expression, self).__init__(qsub_option, script_dir, conf_section)
@@ -29,6 +29,6 @@ export PYTHONPATH={pythonpath}
 mv {output_prefix}.ir_simple_count.txt {output_prefix}.genomonIR.result.txt
 """
 
-    def __init__(self, qsub_option, script_dir):
-        super(Intron_retention, self).__init__(qsub_option, script_dir)
+    def __init__(self, qsub_option, script_dir, conf_section = None):
+        super(Intron_retention, self).__init__(qsub_option, script_dir, conf_section)
 
@@ -33,7 +33,7 @@ if test "{inputs_sv}" != ""; then
 fi
 """
 
-    def __init__(self, qsub_option, script_dir):
-        super(Res_PA_Plot, self).__init__(qsub_option, script_dir)
+    def __init__(self, qsub_option, script_dir, conf_section = None):
+        super(Res_PA_Plot, self).__init__(qsub_option, script_dir, conf_section)
 
         
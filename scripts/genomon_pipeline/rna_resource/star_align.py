@@ -28,5 +28,5 @@ set -o pipefail
 rm -rf {out_prefix}Aligned.out.bam
 """
 
-    def __init__(self, qsub_option, script_dir):
-        super(Star_align, self).__init__(qsub_option, script_dir)
+    def __init__(self, qsub_option, script_dir, conf_section = None):
+        super(Star_align, self).__init__(qsub_option, script_dir, conf_section)
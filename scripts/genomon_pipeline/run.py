@@ -4,6 +4,9 @@ from ruffus import *
 from genomon_pipeline.config.genomon_conf import *
 from genomon_pipeline.config.run_conf import *
 from genomon_pipeline.config.sample_conf import *
+from genomon_pipeline.job_monitor import *
+from genomon_pipeline.local_executor import *
+from genomon_pipeline.job_stats import *
 
 
 def main(args):
@@ -15,6 +18,13 @@ def main(args):
     run_conf.project_root = os.path.abspath(args.project_root)
     run_conf.genomon_conf_file = args.genomon_conf_file
     run_conf.drmaa = False if args.disable_drmaa else True
+    run_conf.drmaa_test_mode = args.drmaa_test_mode
+    run_conf.job_monitor = args.job_monitor and run_conf.drmaa
+    job_monitor.interval = args.job_monitor_interval
+    run_conf.local_exec = args.local_exec
+    if args.local_cpus: local_executor.cpus = args.local_cpus
+    if args.local_memory: local_executor.memory = args.local_memory
+    if args.job_stats_db: job_stats.db_path = os.path.abspath(args.job_stats_db)
 
     ###
     # read sample list file
@@ -38,9 +48,17 @@ def main(args):
             import dna_pipeline
         elif run_conf.analysis_type == "rna":
             import rna_pipeline
-        pipeline_run(
-                     verbose = args.verbose, 
-                     multiprocess = args.multiprocess
-                    )
+        if run_conf.job_monitor or run_conf.local_exec:
+            # the stage tasks only wait for their jobs, so threads of one driver process are enough
+            # (the local executor also needs one process to share the CPUs and the memory of the host)
+            pipeline_run(
+                         verbose = args.verbose, 
+                         multithread = args.multiprocess
+                        )
+        else:
+            pipeline_run(
+                         verbose = args.verbose, 
+                         multiprocess = args.multiprocess
+                        )
 
         
@@ -0,0 +1,330 @@
+#! /usr/bin/env python
+"""
+coverage-balanced shards of the interval list for the mutation call
+
+The amount of the data of every 16 kb window is estimated from the index of the bams
+(the compressed bytes between the offsets of the linear index of a BAI, or the slice sizes of a CRAI
+with its reference ids mapped through the @SQ lines of the cram header).
+The cost of a region is its share of the data plus a small share of its length, and the regions of
+the interval list are merged (consecutive regions on the same chromosome) or split (at the window
+boundaries) into shards of about the same cost.
+
+The shard manifest has a line for every task of the mutation call:
+span<TAB>regions (comma separated)<TAB>cost
+The span (chr:start-end) covers all the regions of the shard, and the shards are in the order of the
+interval list, so the merge of the results of the tasks keeps the order of the mutations.
+"""
+
+import os
+import re
+import sys
+import gzip
+import zlib
+import struct
+import argparse
+
+window_shift = 14
+window_size = 1 << window_shift
+
+# pseudo bin of the BAI with the offsets of the start and the end of the reference
+pseudo_bin = 37450
+
+# share of the length in the cost of a region (the rest is the share of the data)
+length_weight = 0.1
+
+# a region is split when its cost is over this ratio to the target cost of a shard
+split_ratio = 1.5
+
+region_pattern = re.compile(r'^(.+):(\d+)-(\d+)$')
+
+def read_fai(ref_fa):
+    references = []
+    with open(ref_fa + '.fai') as in_handle:
+        for line in in_handle:
+            F = line.rstrip('\n').split('\t')
+            references.append((F[0], int(F[1])))
+    return references
+
+
+def read_bam_references(bam):
+    # the header of the bam (the bam is a series of gzip members)
+    in_handle = gzip.open(bam, 'rb')
+    try:
+        if in_handle.read(4) != b'BAM\x01':
+            raise ValueError("invalid bam header: " + bam)
+        l_text = struct.unpack('<i', in_handle.read(4))[0]
+        in_handle.read(l_text)
+        n_ref = struct.unpack('<i', in_handle.read(4))[0]
+        references = []
+        for i in range(n_ref):
+            l_name = struct.unpack('<i', in_handle.read(4))[0]
+            name = in_handle.read(l_name).rstrip(b'\x00')
+            l_ref = struct.unpack('<i', in_handle.read(4))[0]
+            references.append((name, l_ref))
+    finally:
+        in_handle.close()
+    return references
+
+
+def read_itf8(in_handle):
+    first = ord(in_handle.read(1))
+    if first < 0x80: return first
+    if first < 0xC0: return ((first & 0x3F) << 8) | ord(in_handle.read(1))
+    if first < 0xE0: return ((first & 0x1F) << 16) | struct.unpack('>H', in_handle.read(2))[0]
+    if first < 0xF0: return ((first & 0x0F) << 24) | (ord(in_handle.read(1)) << 16) | struct.unpack('>H', in_handle.read(2))[0]
+    rest = struct.unpack('>I', in_handle.read(4))[0]
+    return ((first & 0x0F) << 28) | ((rest >> 4) & 0x0FFFFFF0) | (rest & 0x0F)
+
+
+def read_ltf8(in_handle):
+    first = ord(in_handle.read(1))
+    # the number of the leading 1 bits is the number of the following bytes
+    length = 0
+    while length < 8 and first & (0x80 >> length):
+        length += 1
+    value = first & (0xFF >> (length + 1)) if length < 8 else 0
+    for byte in in_handle.read(length):
+        value = (value << 8) | ord(byte)
+    return value
+
+
+def read_cram_references(cram):
+    """
+    the (name, length) of the @SQ lines of the cram header in the order of the reference ids of the crai
+    """
+    with open(cram, 'rb') as in_handle:
+        definition = in_handle.read(26)
+        if definition[0:4] != b'CRAM':
+            raise ValueError("invalid cram header: " + cram)
+        major_version = ord(definition[4])
+
+        # the container of the header
+        in_handle.read(4)
+        for i in range(4): read_itf8(in_handle)
+        if major_version >= 2:
+            read_ltf8(in_handle)
+            read_ltf8(in_handle)
+        else:
+            read_itf8(in_handle)
+            read_itf8(in_handle)
+        read_itf8(in_handle)
+        for i in range(read_itf8(in_handle)): read_itf8(in_handle)
+        if major_version >= 3: in_handle.read(4)
+
+        # the first block of the container has the header text
+        method = ord(in_handle.read(1))
+        in_handle.read(1)
+        read_itf8(in_handle)
+        compressed_size = read_itf8(in_handle)
+        read_itf8(in_handle)
+        data = in_handle.read(compressed_size)
+    if method == 1:
+        data = zlib.decompress(data, 16 + zlib.MAX_WBITS)
+    elif method != 0:
+        raise ValueError("unsupported compression of the cram header: " + cram)
+
+    l_text = struct.unpack('<i', data[0:4])[0]
+    references = []
+    for line in data[4:4 + l_text].split('\n'):
+        if not line.startswith('@SQ'): continue
+        tags = dict(field.split(':', 1) for field in line.split('\t')[1:] if ':' in field)
+        references.append((tags["SN"], int(tags.get("LN", "0"))))
+    return references
+
+
+def read_bai_windows(bai, references):
+    """
+    return {reference name: [compressed bytes of every window]}
+    """
+    windows = {}
+    with open(bai, 'rb') as in_handle:
+        if in_handle.read(4) != b'BAI\x01':
+            raise ValueError("invalid bai: " + bai)
+        n_ref = struct.unpack('<i', in_handle.read(4))[0]
+        for ref_id in range(n_ref):
+            ref_end = None
+            n_bin = struct.unpack('<i', in_handle.read(4))[0]
+            for i in range(n_bin):
+                (bin_id, n_chunk) = struct.unpack('<Ii', in_handle.read(8))
+                chunks = in_handle.read(16 * n_chunk)
+                if bin_id == pseudo_bin and n_chunk > 0:
+                    ref_end = struct.unpack('<QQ', chunks[0:16])[1]
+            n_intv = struct.unpack('<i', in_handle.read(4))[0]
+            offsets = [offset >> 16 for offset in struct.unpack('<' + str(n_intv) + 'Q', in_handle.read(8 * n_intv))]
+            if n_intv == 0: continue
+
+            # the last window ends at the end of the reference
+            offsets.append(ref_end >> 16 if ref_end is not None else offsets[-1])
+            sizes = [max(0, offsets[i + 1] - offsets[i]) for i in range(n_intv)]
+            if ref_id < len(references):
+                windows[references[ref_id][0]] = sizes
+    return windows
+
+
+def read_crai_windows(crai, references):
+    """
+    return {reference name: [compressed bytes of every window]} (the bytes of a slice are spread over its span)
+    """
+    windows = {}
+    with gzip.open(crai, 'rb') as in_handle:
+        for line in in_handle:
+            F = line.rstrip('\n').split('\t')
+            if len(F) < 6: continue
+            (ref_id, start, span, slice_size) = (int(F[0]), int(F[1]), int(F[2]), int(F[5]))
+            if ref_id < 0 or ref_id >= len(references) or span <= 0: continue
+            sizes = windows.setdefault(references[ref_id][0], [])
+            first = (start - 1) >> window_shift
+            last = (start + span - 2) >> window_shift
+            if len(sizes) <= last:
+                sizes.extend([0] * (last + 1 - len(sizes)))
+            for window in range(first, last + 1):
+                sizes[window] += float(slice_size) / (last - first + 1)
+    return windows
+
+
+def bam_windows(bam, ref_fa):
+    if bam.endswith(".cram"):
+        # the reference ids of the crai are the order of the @SQ lines of the cram header
+        try:
+            references = read_cram_references(bam)
+        except ValueError as e:
+            print >> sys.stderr, "shard_planner: " + str(e) + ", the reference ids of the crai follow the fai"
+            references = read_fai(ref_fa)
+        return read_crai_windows(bam + '.crai', references)
+    return read_bai_windows(bam + '.bai', read_bam_references(bam))
+
+
+def read_intervals(interval_list, references):
+    lengths = dict(references)
+    intervals = []
+    with open(interval_list) as in_handle:
+        for line in in_handle:
+            region = line.strip()
+            if region == "": continue
+            match = region_pattern.match(region)
+            if match:
+                intervals.append((match.group(1), int(match.group(2)), int(match.group(3))))
+            else:
+                # a whole chromosome
+                intervals.append((region, 1, lengths.get(region, 1)))
+    return intervals
+
+
+class Shard_planner(object):
+
+    def __init__(self, intervals, windows):
+        self.intervals = intervals
+        self.windows = windows
+        total_length = sum(end - start + 1 for (chrom, start, end) in intervals)
+        total_data = sum(self.data(chrom, start, end) for (chrom, start, end) in intervals)
+        self.length_unit = length_weight / total_length if total_length > 0 else 0.0
+        self.data_unit = (1.0 - length_weight) / total_data if total_data > 0 else 0.0
+        if total_data == 0:
+            self.length_unit = 1.0 / total_length if total_length > 0 else 0.0
+
+
+    def data(self, chrom, start, end):
+        sizes = self.windows.get(chrom, [])
+        total = 0.0
+        for window in range((start - 1) >> window_shift, min(((end - 1) >> window_shift) + 1, len(sizes))):
+            window_start = (window << window_shift) + 1
+            window_end = window_start + window_size - 1
+            overlap = min(end, window_end) - max(start, window_start) + 1
+            total += sizes[window] * float(overlap) / window_size
+        return total
+
+
+    def cost(self, chrom, start, end):
+        return self.data(chrom, start, end) * self.data_unit + (end - start + 1) * self.length_unit
+
+
+    def split(self, chrom, start, end, target):
+        """
+        split a heavy region at the window boundaries into pieces of about the target cost
+        """
+        pieces = []
+        piece_start = start
+        piece_cost = 0.0
+        position = start
+        while position <= end:
+            window_end = min(end, ((position - 1) | (window_size - 1)) + 1)
+            piece_cost += self.cost(chrom, position, window_end)
+            if piece_cost >= target and window_end < end:
+                pieces.append((chrom, piece_start, window_end))
+                piece_start = window_end + 1
+                piece_cost = 0.0
+            position = window_end + 1
+        pieces.append((chrom, piece_start, end))
+        return pieces
+
+
+    def plan(self, shard_num):
+        target = 1.0 / shard_num
+
+        regions = []
+        for (chrom, start, end) in self.intervals:
+            if self.cost(chrom, start, end) > target * split_ratio:
+                regions.extend(self.split(chrom, start, end, target))
+            else:
+                regions.append((chrom, start, end))
+
+        # consecutive regions on the same chromosome are merged up to the target cost
+        shards = []
+        for (chrom, start, end) in regions:
+            region_cost = self.cost(chrom, start, end)
+            if len(shards) > 0 and shards[-1]["chrom"] == chrom and shards[-1]["cost"] + region_cost <= target:
+                shards[-1]["regions"].append((chrom, start, end))
+                shards[-1]["cost"] += region_cost
+            else:
+                shards.append({"chrom": chrom, "regions": [(chrom, start, end)], "cost": region_cost})
+        return shards
+
+
+def region_string(chrom, start, end):
+    return chrom + ':' + str(start) + '-' + str(end)
+
+
+def write_manifest(manifest_file, shards):
+    with open(manifest_file + '.tmp', 'w') as out_handle:
+        for shard in shards:
+            regions = shard["regions"]
+            span = region_string(shard["chrom"], regions[0][1], regions[-1][2])
+            out_handle.write(span + '\t' + ','.join(region_string(*region) for region in regions) + '\t' + '%.6f' % shard["cost"] + '\n')
+    os.rename(manifest_file + '.tmp', manifest_file)
+
+
+def plan_shards(manifest_file, interval_list, bams, ref_fa, shard_num):
+    """
+    write the shard manifest and return the number of the shards
+    """
+    windows = {}
+    for bam in bams:
+        for (chrom, sizes) in bam_windows(bam, ref_fa).items():
+            total = windows.setdefault(chrom, [])
+            if len(total) < len(sizes):
+                total.extend([0] * (len(sizes) - len(total)))
+            for (window, size) in enumerate(sizes):
+                total[window] += size
+
+    intervals = read_intervals(interval_list, read_fai(ref_fa))
+    if shard_num <= 0:
+        shard_num = len(intervals)
+    shards = Shard_planner(intervals, windows).plan(max(1, shard_num))
+    write_manifest(manifest_file, shards)
+    return len(shards)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog = "shard_planner")
+    parser.add_argument("--shards", help = "number of the shards (default: the number of the intervals)", type = int, default = 0)
+    parser.add_argument("manifest_file", type = str)
+    parser.add_argument("interval_list", type = str)
+    parser.add_argument("ref_fa", type = str)
+    parser.add_argument("bams", type = str, nargs = '+')
+    args = parser.parse_args()
+
+    print >> sys.stderr, str(plan_shards(args.manifest_file, args.interval_list, args.bams, args.ref_fa, args.shards)) + " shards"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#! /usr/bin/env python
+
+import os
+import hashlib
+import datetime
+from genomon_pipeline.stage_task import *
+
+step_template = """
+# step {step}: {task_name}
+if [ -f {done_dir}/{step}_{task_name}.{digest} ]; then
+    echo "step {step} ({task_name}) has already finished" >&2
+else
+    /bin/bash {script}
+    status=$?
+    echo "step {step} ({task_name}) finished with exit status: $status" >&2
+    if [ $status -ne 0 ]; then
+        exit $status
+    fi
+    touch {done_dir}/{step}_{task_name}.{digest}
+fi
+"""
+
+# the markers are kept only while the group has not finished
+group_end_template = """
+rm -rf {done_dir}
+"""
+
+class Stage_group(Stage_task):
+    """
+    class for running the scripts of several small stage tasks in one scheduler job
+
+    The script of each step is rendered from the script_template of its stage task,
+    and the group script runs the steps in order. The job exits with the exit status
+    of the failed step, and the steps that finished are skipped on the retry.
+    """
+
+    script_template = """
+#!/bin/bash
+#
+# Set SGE
+#
+#$ -S /bin/bash         # set shell in UGE
+#$ -cwd                 # execute at the submitted dir
+pwd                     # print current working directory
+hostname                # print hostname
+date                    # print date
+{steps}
+"""
+
+    def __init__(self, task_name, stage_tasks, use_drmaa_flag, conf_section = None):
+        self.task_name = task_name
+        self.stage_tasks = stage_tasks
+
+        # the group requests the resources of the largest step
+        qsub_option = max([stage_task.qsub_option for stage_task in stage_tasks],
+                          key = lambda option: (get_memory(option) * get_slot_num(option), get_slot_num(option)))
+        super(Stage_group, self).__init__(qsub_option, use_drmaa_flag, conf_section)
+
+
+    def group_exec(self, steps, log_dir, script_dir, output_prefix):
+        """
+        steps: list of (stage task, arguments) to run in one job
+        output_prefix: identity of the group (the markers of the finished steps are shared by the reruns of the pipeline)
+        """
+        now = datetime.datetime.now()
+        group_name = file_timestamp_format.format(
+                         name=self.task_name,
+                         year=now.year,
+                         month=now.month,
+                         day=now.day,
+                         hour=now.hour,
+                         min=now.minute,
+                         second=now.second,
+                         msecond=now.microsecond )
+
+        # a marker is named with the digest of the step script, so a step changed by the rerun is not skipped
+        done_dir = script_dir + '/' + self.task_name + '.' + hashlib.md5(output_prefix).hexdigest()[0:16] + '.done'
+        if not os.path.isdir(done_dir): os.mkdir(done_dir)
+
+        step_scripts = []
+        for (index, (stage_task, arguments)) in enumerate(steps):
+            step_script = "{script}/{group}.{step}_{task}.sh".format(script = script_dir, group = group_name, step = index + 1, task = stage_task.task_name)
+            script = stage_task.script_template.format(**arguments)
+            with open(step_script, 'w') as out_handle:
+                out_handle.write(script)
+            step_scripts.append(step_template.format(step = index + 1, task_name = stage_task.task_name, done_dir = done_dir, script = step_script,
+                                                     digest = hashlib.md5(script).hexdigest()[0:16]))
+        step_scripts.append(group_end_template.format(done_dir = done_dir))
+
+        self.task_exec({"steps": ''.join(step_scripts)}, log_dir, script_dir)
+
@@ -1,20 +1,156 @@
 #! /usr/bin/env python
 
 import os
+import re
 import sys
+import time
 import datetime
 import subprocess
+import multiprocessing
 from genomon_pipeline.config.run_conf import *
+from genomon_pipeline.config.genomon_conf import *
+from genomon_pipeline.drmaa_session import *
+from genomon_pipeline.job_monitor import *
+from genomon_pipeline.local_executor import *
+from genomon_pipeline.job_stats import *
+from genomon_pipeline.job_throttle import *
+from genomon_pipeline.critical_path import *
 
 file_timestamp_format = "{name}_{year:0>4d}{month:0>2d}{day:0>2d}_{hour:0>2d}{min:0>2d}{second:0>2d}_{msecond:0>6d}"
 
+# the job id is left for qacct, because SIGKILL over h_vmem kills the wrapper with the script.
+# s_vmem sends SIGXCPU to the whole job, so the wrapper catches it and records the status of the script.
+wrapper_template = """#!/bin/bash
+#$ -S /bin/bash
+#$ -cwd
+echo ${{JOB_ID}} > {exit_dir}/${{SGE_TASK_ID}}.job
+/bin/bash {script} &
+pid=$!
+trap ':' XCPU
+wait ${{pid}}
+status=$?
+while kill -0 ${{pid}} 2> /dev/null; do
+    wait ${{pid}}
+    status=$?
+done
+echo $status > {exit_dir}/${{SGE_TASK_ID}}
+exit $status
+"""
+
+# the tools built on htslib find the reference of a cram in the reference cache (ref_cache.py, empty for bam)
+cram_reference_template = """
+if [ "_{ref_cache}" != "_" ]; then
+    export REF_PATH={ref_cache}/%2s/%2s/%s
+    export REF_CACHE={ref_cache}/%2s/%2s/%s
+fi
+"""
+
+# SGE kills a job over h_vmem with SIGKILL and over s_vmem with SIGXCPU
+memory_kill_signals = ["SIGKILL", "SIGXCPU"]
+memory_kill_exit_status = [128 + 9, 128 + 24]
+memory_kill_ratio = 0.9
+
+# the accounting record of a job is written shortly after its end
+accounting_retry_count = 3
+accounting_retry_interval = 10
+
+accounting_units = {"B": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+def task_ranges(task_ids):
+    """
+    compress the sorted task ids into (begin, end) ranges for qsub -t
+    """
+    ranges = []
+    for task_id in task_ids:
+        if len(ranges) > 0 and ranges[-1][1] + 1 == task_id:
+            ranges[-1] = (ranges[-1][0], task_id)
+        else:
+            ranges.append((task_id, task_id))
+    return ranges
+
+
+def read_exit_status(exit_file):
+    if not os.path.exists(exit_file):
+        return None
+    with open(exit_file) as in_handle:
+        value = in_handle.read().strip()
+    return int(value) if value.isdigit() else None
+
+
+def read_job_id(job_file):
+    if not os.path.exists(job_file):
+        return None
+    with open(job_file) as in_handle:
+        value = in_handle.read().strip()
+    return value if value.isdigit() else None
+
+
+def parse_accounting_value(value):
+    """
+    convert the value of qacct (e.g. 1.953G, 12.000s) to bytes or seconds
+    """
+    match = re.match(r'^([0-9.]+)([BKMGT]?)s?$', value.split()[0] if value.strip() else "")
+    if not match:
+        return None
+    return float(match.group(1)) * accounting_units.get(match.group(2), 1)
+
+
+def read_accounting(job_id, task_id = None):
+    """
+    (exit_status, usage) of a job (or an array task) in the accounting of SGE, or None without the record.
+    exit_status is None when SGE marks the task failed with the exit status 0.
+    """
+    if job_id is None:
+        return None
+    record = None
+    for var in range(0, accounting_retry_count):
+        try:
+            with open(os.devnull, 'w') as devnull:
+                output = subprocess.check_output(['qacct', '-j', str(job_id)] + (['-t', str(task_id)] if task_id is not None else []), stderr = devnull)
+        except OSError:
+            return None
+        except subprocess.CalledProcessError:
+            time.sleep(accounting_retry_interval)
+            continue
+        record = {}
+        for line in output.splitlines():
+            F = line.split(None, 1)
+            if len(F) == 2: record[F[0]] = F[1].strip()
+        break
+    if record is None or "exit_status" not in record:
+        return None
+
+    exit_status = int(record["exit_status"].split()[0])
+    if exit_status == 0 and record.get("failed", "0").split()[0] != "0":
+        exit_status = None
+    usage = {}
+    for key in ["ru_wallclock", "cpu", "maxvmem", "io"]:
+        if key in record and parse_accounting_value(record[key]) is not None:
+            usage[key] = parse_accounting_value(record[key])
+    return exit_status, usage
+
+
 class Stage_task(object):
 
-    def __init__(self, qsub_option, use_drmaa_flag):
+    def __init__(self, qsub_option, use_drmaa_flag, conf_section = None):
         self.qsub_option = qsub_option
         self.drmaa = use_drmaa_flag
+        self.conf_section = conf_section
         self.retry_count = 2
 
+        # limits of the stage shared by the worker processes of ruffus (forked after the stage tasks are made)
+        max_concurrent_jobs = self.get_conf("max_concurrent_jobs")
+        self.job_semaphore = multiprocessing.BoundedSemaphore(int(max_concurrent_jobs)) if max_concurrent_jobs else None
+        max_submit_rate = self.get_conf("max_submit_rate")
+        self.token_bucket = Token_bucket(float(max_submit_rate)) if max_submit_rate else None
+
+
+    def get_conf(self, option, default = None):
+        # optional settings in the section of the stage in the genomon_conf
+        if self.conf_section is None or not genomon_conf.has_option(self.conf_section, option):
+            return default
+        return genomon_conf.get(self.conf_section, option)
+
 
     def task_exec(self, arguments, log_dir, script_dir, max_task=0):
         # Make shell script
@@ -35,43 +171,66 @@ class Stage_task(object):
         shell_script_file.write(self.script_template.format(**arguments))
         shell_script_file.close()
 
-        if self.drmaa:
-            import drmaa
-        
-            s = drmaa.Session()
-            s.initialize()
-        
-            jt = s.createJobTemplate()
-            jt.jobName = shell_script_name
-            jt.outputPath = ':' + log_dir
-            jt.errorPath = ':' + log_dir
-            jt.nativeSpecification = self.qsub_option
-            jt.remoteCommand = shell_script_full_path
+        if self.job_semaphore is not None: self.job_semaphore.acquire()
+        try:
+            self.submit_job(arguments, log_dir, script_dir, shell_script_name, shell_script_full_path, max_task)
+        finally:
+            if self.job_semaphore is not None: self.job_semaphore.release()
+
+
+    def submit_job(self, arguments, log_dir, script_dir, shell_script_name, shell_script_full_path, max_task):
+
+        # the jobs on the longer chain of stages get the higher priority
+        base_option = self.qsub_option
+        if critical_path.enable:
+            priority = critical_path.get_priority(self.task_name, get_input_size(arguments))
+            if priority is not None:
+                base_option = base_option + " -p " + str(priority)
+
+        if run_conf.local_exec:
+            os.chmod(shell_script_full_path, 0750)
+            results = local_executor.run_job(self.qsub_option, shell_script_name, shell_script_full_path, log_dir, max_task, self.retry_count, self.retry_option)
+            task_ids = [None] if max_task == 0 else range(1, max_task + 1)
+            for task_id in results:
+                for (exit_status, usage, qsub_option) in results[task_id]:
+                    self.record_job(arguments, log_dir, shell_script_name, 'local', task_id, exit_status, usage, qsub_option)
+            failed_ids = [str(task_id) for task_id in task_ids if len(results.get(task_id, [])) == 0 or results[task_id][-1][0] != 0]
+            if len(failed_ids) > 0:
+                raise RuntimeError("Job: " + shell_script_name + " failed at the task: " + ','.join(failed_ids))
+
+        elif self.drmaa:
+            # the session and the job template are shared by every stage task of this process
+            drmaa = drmaa_session.get_module()
+            s = drmaa_session.get_session()
             os.chmod(shell_script_full_path, 0750)
 
             returncode = 0
             returnflag = True
             if max_task == 0:
+                qsub_option = base_option
                 for var in range(0, (self.retry_count+1)):
-                    jobid = s.runJob(jt)
+                    self.wait_submit()
+                    jobid = drmaa_session.run_job(self.task_name, qsub_option, shell_script_name, shell_script_full_path, log_dir)
                     returncode = 0
                     returnflag = True
                     now = datetime.datetime.now()
                     date = now.strftime("%Y-%m-%d %H:%M:%S")
                     print >> sys.stderr, "Your job has been submitted with id: " + jobid + " at Date/Time: " + date
-                    retval = s.wait(jobid, drmaa.Session.TIMEOUT_WAIT_FOREVER)
+                    retval = self.wait_job(s, jobid)
                     now = datetime.datetime.now()
                     date = now.strftime("%Y-%m-%d %H:%M:%S")
                     print >> sys.stderr, "Job: " + str(retval.jobId) + ' finished with status: ' + str(retval.hasExited) + ' and exit status: ' + str(retval.exitStatus) + " at Date/Time: " + date
                     returncode = retval.exitStatus
                     returnflag = retval.hasExited
+                    self.record_job(arguments, log_dir, shell_script_name, retval.jobId, None, retval.exitStatus, retval.resourceUsage, qsub_option)
                     if returncode == 0 and returnflag: break
-                s.deleteJobTemplate(jt)
-                s.exit()
+                    qsub_option = self.retry_option(qsub_option, retval.exitStatus, retval.resourceUsage, retval.terminatedSignal if retval.hasSignal else None)
 
             else:
-                joblist = s.runBulkJobs(jt,1,max_task,1)
+                self.wait_submit()
+                joblist = drmaa_session.run_bulk_jobs(self.task_name, self.array_option(base_option), shell_script_name, shell_script_full_path, log_dir, 1, max_task)
                 all_jobids = []
+                task_options = {}
                 for var in range(0, (self.retry_count+1)):
                     if len(all_jobids) > 0:
                         joblist = all_jobids
@@ -81,39 +240,180 @@ class Stage_task(object):
                     now = datetime.datetime.now()
                     date = now.strftime("%Y-%m-%d %H:%M:%S")
                     print >> sys.stderr, 'Your job has been submitted with id ' + str(joblist) + " at Date/Time: " + date
-                    s.synchronize(joblist, drmaa.Session.TIMEOUT_WAIT_FOREVER, False)
-                    for curjob in joblist:
+                    if run_conf.job_monitor:
+                        futures = [job_monitor.watch(curjob) for curjob in joblist]
+                    else:
+                        s.synchronize(joblist, drmaa.Session.TIMEOUT_WAIT_FOREVER, False)
+                    for (index, curjob) in enumerate(joblist):
                         print >> sys.stderr, 'Collecting job ' + curjob
-                        retval = s.wait(curjob, drmaa.Session.TIMEOUT_WAIT_FOREVER)
+                        if run_conf.job_monitor:
+                            retval = futures[index].result()
+                        else:
+                            retval = s.wait(curjob, drmaa.Session.TIMEOUT_WAIT_FOREVER)
                         now = datetime.datetime.now()
                         date = now.strftime("%Y-%m-%d %H:%M:%S")
                         print >> sys.stderr, "Job: " + str(retval.jobId) + ' finished with status: ' + str(retval.hasExited) + ' and exit status: ' + str(retval.exitStatus) + " at Date/Time: " + date
+                        jobId_list = ((retval.jobId).encode('utf-8')).split(".")
+                        taskId = int(jobId_list[1])
+                        qsub_option = task_options.get(taskId, base_option)
+                        self.record_job(arguments, log_dir, shell_script_name, retval.jobId, taskId, retval.exitStatus, retval.resourceUsage, qsub_option)
                         
                         if retval.exitStatus != 0 or not retval.hasExited:
                             returncode = retval.exitStatus
                             returnflag = retval.hasExited
                             if var == self.retry_count: break
-                            jobId_list = ((retval.jobId).encode('utf-8')).split(".")
-                            taskId = int(jobId_list[1])
-                            all_jobids.extend(s.runBulkJobs(jt,taskId,taskId,1))
+                            task_options[taskId] = self.retry_option(qsub_option, retval.exitStatus, retval.resourceUsage, retval.terminatedSignal if retval.hasSignal else None)
+                            self.wait_submit()
+                            all_jobids.extend(drmaa_session.run_bulk_jobs(self.task_name, self.array_option(task_options[taskId]), shell_script_name, shell_script_full_path, log_dir, taskId, taskId))
                        
                     if returncode == 0 and returnflag: break
-                s.deleteJobTemplate(jt)
-                s.exit()
 
             if returncode != 0 or not returnflag: 
                 raise RuntimeError("Job: " + str(retval.jobId)  + ' failed at Date/Time: ' + date)
 
         else:
             qsub_commands = ['qsub', '-sync', 'yes']
-            if max_task != 0:
-                qsub_commands.extend(['-t', '1-'+str(max_task)+':1'])
 
-            qsub_options = self.qsub_option.split(' ')
-            returncode = subprocess.call(qsub_commands + qsub_options + [shell_script_full_path])
+            if max_task == 0:
+                # qsub -terse prints the job id, and the exit status of a failed job is taken from qacct
+                qsub_option = base_option
+                for var in range(0, (self.retry_count+1)):
+                    self.wait_submit()
+                    proc = subprocess.Popen(qsub_commands + ['-terse'] + qsub_option.split(' ') + [shell_script_full_path], stdout = subprocess.PIPE)
+                    output = proc.communicate()[0]
+                    returncode = proc.returncode
+                    if returncode == 0: break
+
+                    job_id = output.split('\n')[0].strip()
+                    accounting = read_accounting(job_id if job_id.isdigit() else None)
+                    (exit_status, usage) = accounting if accounting is not None else (returncode, None)
+                    date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    print >> sys.stderr, "Job: " + shell_script_name + " failed with exit status: " + str(exit_status) + " at Date/Time: " + date
+                    qsub_option = self.retry_option(qsub_option, exit_status, usage)
+
+                if returncode != 0: 
+                    raise RuntimeError("The batch job failed.")
+
+            else:
+                # each task leaves its exit status in exit_dir, and only the failed tasks are submitted again
+                exit_dir = script_dir + '/' + shell_script_name + '.exit'
+                if not os.path.isdir(exit_dir): os.mkdir(exit_dir)
+                wrapper_script = script_dir + '/' + shell_script_name + '.wrapper.sh'
+                with open(wrapper_script, 'w') as out_handle:
+                    out_handle.write(wrapper_template.format(script = shell_script_full_path, exit_dir = exit_dir))
+                os.chmod(shell_script_full_path, 0750)
+                os.chmod(wrapper_script, 0750)
+
+                task_ids = range(1, max_task + 1)
+                task_options = dict((task_id, base_option) for task_id in task_ids)
+                for var in range(0, (self.retry_count+1)):
+                    for task_id in task_ids:
+                        for exit_file in [exit_dir + '/' + str(task_id), exit_dir + '/' + str(task_id) + '.job']:
+                            if os.path.exists(exit_file): os.unlink(exit_file)
+
+                    # the tasks resubmitted with more memory are grouped by their qsub_option
+                    procs = []
+                    for qsub_option in sorted(set(task_options[task_id] for task_id in task_ids)):
+                        option_task_ids = [task_id for task_id in task_ids if task_options[task_id] == qsub_option]
+                        for (begin, end) in task_ranges(option_task_ids):
+                            self.wait_submit()
+                            procs.append(subprocess.Popen(qsub_commands + ['-N', shell_script_name, '-t', str(begin)+'-'+str(end)+':1'] + self.array_option(qsub_option).split(' ') + [wrapper_script]))
+                    for proc in procs:
+                        proc.wait()
+
+                    failed_ids = []
+                    for task_id in task_ids:
+                        exit_status = read_exit_status(exit_dir + '/' + str(task_id))
+                        usage = None
+                        if exit_status is None:
+                            # the task killed with its wrapper leaves no exit status, so it is taken from qacct
+                            accounting = read_accounting(read_job_id(exit_dir + '/' + str(task_id) + '.job'), task_id)
+                            if accounting is not None:
+                                (exit_status, usage) = accounting
+                        if exit_status == 0: continue
+                        failed_ids.append(task_id)
+                        task_options[task_id] = self.retry_option(task_options[task_id], exit_status, usage)
+                    task_ids = failed_ids
+                    if len(task_ids) == 0: break
+
+                    date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    print >> sys.stderr, "Job: " + shell_script_name + " failed tasks: " + ','.join(map(str, task_ids)) + " at Date/Time: " + date
+
+                if len(task_ids) > 0:
+                    raise RuntimeError("The batch job failed at the task: " + ','.join(map(str, task_ids)))
+
+
+    def wait_submit(self):
+        # max_submit_rate [jobs per minute] of the stage
+        if self.token_bucket is not None:
+            self.token_bucket.acquire()
+
+
+    def array_option(self, qsub_option):
+        # max_concurrent_tasks limits the tasks of an array job running at once
+        max_concurrent_tasks = self.get_conf("max_concurrent_tasks")
+        if max_concurrent_tasks:
+            return qsub_option + " -tc " + max_concurrent_tasks
+        return qsub_option
+
+
+    def wait_job(self, s, jobid):
+        # with the job monitor, the finished jobs are collected by one thread of the driver
+        if run_conf.job_monitor:
+            return job_monitor.wait(jobid)
+        return s.wait(jobid, drmaa_session.get_module().Session.TIMEOUT_WAIT_FOREVER)
+
+
+    def is_memory_killed(self, qsub_option, exit_status, usage = None, signal = None):
+        """
+        judge from the terminated signal, the exit status or the maxvmem close to
+        the requested memory whether the job was killed by the memory limit
+        """
+        if signal in memory_kill_signals:
+            return True
+        if exit_status in memory_kill_exit_status:
+            return True
+        if usage is None:
+            return False
+        request = get_memory(qsub_option) * get_slot_num(qsub_option)
+        maxvmem = get_usage(usage, "maxvmem")
+        if request > 0 and maxvmem is not None and maxvmem / (1024.0 ** 3) >= request * memory_kill_ratio:
+            return True
+        return False
+
+
+    def retry_option(self, qsub_option, exit_status, usage = None, signal = None):
+        """
+        the qsub_option of the retry of a failed job (used by the local executor, DRMAA and qsub)
+        """
+        if self.is_memory_killed(qsub_option, exit_status, usage, signal):
+            return self.escalate_memory(qsub_option)
+        return qsub_option
+
+
+    def escalate_memory(self, qsub_option):
+        """
+        scale s_vmem and mem_req by retry_memory_scale up to retry_max_memory [per slot].
+        the qsub_option is not changed unless retry_max_memory is set for the stage.
+        """
+        max_memory = self.get_conf("retry_max_memory")
+        memory = get_memory(qsub_option)
+        if not max_memory or memory == 0:
+            return qsub_option
+
+        new_memory = min(memory * float(self.get_conf("retry_memory_scale", "2.0")), parse_memory(max_memory))
+        if new_memory <= memory:
+            return qsub_option
 
-            if returncode != 0: 
-                raise RuntimeError("The batch job failed.")
+        new_option = set_memory(qsub_option, new_memory)
+        date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        print >> sys.stderr, "Stage: " + self.task_name + " exceeded the memory limit, retrying with: " + new_option + " at Date/Time: " + date
+        return new_option
 
 
+    def record_job(self, arguments, log_dir, job_name, job_id, task_id, exit_status, usage, qsub_option = None):
+        # the job statistics are keyed by the stage and the sample (the name of the log directory)
+        if job_stats.db_path is None: return
+        job_stats.record(run_conf.project_root, self.task_name, os.path.basename(log_dir), job_name, job_id, task_id,
+                         get_input_size(arguments), qsub_option if qsub_option else self.qsub_option, exit_status, usage)
 
@@ -11,6 +11,6 @@ setup(name='genomon_pipeline',
       url='https://github.com/Genomon-Project/Genomon.git',
       package_dir = {'': 'scripts'},
       packages=['genomon_pipeline', 'genomon_pipeline.rna_resource', 'genomon_pipeline.dna_resource', 'genomon_pipeline.config'],
-      scripts=['genomon_pipeline'],
+      scripts=['genomon_pipeline', 'genomon_job_stats'],
       license='License of GenomonPipeline'
      )